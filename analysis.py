@@ -0,0 +1,277 @@
+"""
+The module with the batch analysis of positions over a pool of UCI engines.
+
+Every line of the input is a position, either a FEN (optionally followed
+by "moves ...") or the UCI moves played from the start position. The
+results are written as JSON lines, one per position, in the order they
+complete. Positions already in the output file are skipped, so an
+interrupted run continues where it stopped. Positions the engines fail on
+are written to a separate error file (the output path with ".errors"
+added), and are analysed again by the next run. Run as a script, for example:
+
+    python analysis.py positions.txt results.jsonl --depth 16 --workers 8
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import engine
+
+
+def read_positions(path):
+    """
+    Yields (id, position) for the positions of the input file, the id is the
+    line number. Blank lines and lines starting with # are skipped.
+    """
+
+    with open(path) as positions:
+        for line_number, line in enumerate(positions, 1):
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line_number, line
+
+
+def parse_position(position):
+    """
+    Splits a position line into (fen, moves), fen is None for the start position.
+    """
+
+    words = position.split()
+
+    if "/" not in position:
+        return None, words
+
+    if "moves" in words:
+        index = words.index("moves")
+        return " ".join(words[:index]), words[index + 1:]
+
+    return position, []
+
+
+def completed_ids(path):
+    """
+    Returns the ids of the positions already analysed in an output file.
+    A last line cut by an interrupted run is removed from the file,
+    the position is analysed again, and so are the failed positions.
+    """
+
+    ids = set()
+    if not os.path.exists(path):
+        return ids
+
+    with open(path, "rb+") as results:
+        data = results.read()
+        if data and not data.endswith(b"\n"):
+            results.truncate(data.rfind(b"\n") + 1)
+
+    with open(path) as results:
+        for line in results:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if "id" in result and "error" not in result:
+                ids.add(result["id"])
+
+    return ids
+
+
+class BatchAnalyzer(object):
+    """
+    Analyses a stream of positions on the engines of a pool, with one thread
+    per engine. At most 2 * workers positions are read ahead of the engines.
+    """
+
+    def __init__(self, pool, limit, workers, retries=1):
+
+        self.pool = pool
+
+        # Arguments of the go command, e.g. "depth 16" or "movetime 500".
+        self.limit = limit
+
+        self.workers = workers
+
+        # How many times a position is tried again on a new engine,
+        # if the engine crashes while analysing it.
+        self.retries = retries
+
+        # Errors that stopped the worker threads, see run().
+        self.worker_errors = []
+
+    def run(self, positions):
+        """
+        Analyses the (id, position) pairs, yields the result dictionaries
+        as they complete. A worker stopped by an unexpected error sends it
+        back, it is added to worker_errors and the other workers go on.
+        """
+
+        tasks = queue.Queue(maxsize=2 * self.workers)
+        results = queue.Queue()
+
+        feeder = threading.Thread(target=self._feed, args=(positions, tasks))
+        feeder.daemon = True
+        feeder.start()
+
+        for _ in range(self.workers):
+            worker = threading.Thread(target=self._work, args=(tasks, results))
+            worker.daemon = True
+            worker.start()
+
+        # Every worker puts None to the results when it is finished.
+        running = self.workers
+        while running:
+            result = results.get()
+            if result is None:
+                running -= 1
+            elif isinstance(result, Exception):
+                self.worker_errors.append(result)
+                print("A worker stopped: {0!r}".format(result), file=sys.stderr)
+            else:
+                yield result
+
+    def _feed(self, positions, tasks):
+
+        for task in positions:
+            tasks.put(task)
+
+        for _ in range(self.workers):
+            tasks.put(None)
+
+    def _work(self, tasks, results):
+
+        chess_engine = None
+
+        try:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+
+                result, chess_engine = self._analyse(chess_engine, *task)
+                results.put(result)
+        except Exception as error:
+            results.put(error)
+        finally:
+            if chess_engine:
+                self.pool.release(chess_engine)
+            results.put(None)
+
+    def _analyse(self, chess_engine, position_id, position):
+        """
+        Analyses a single position, returns the result and the engine to use next.
+        """
+
+        fen, moves = parse_position(position)
+        result = {"id": position_id, "position": position}
+
+        for _ in range(self.retries + 1):
+            try:
+                if chess_engine is None:
+                    chess_engine = self.pool.acquire()
+
+                start = time.perf_counter()
+                chess_engine.set_position(moves, fen)
+                info = chess_engine.analyse(self.limit)
+                elapsed = time.perf_counter() - start
+
+            except (engine.EngineError, OSError) as error:
+                # The engine crashed, could not be started or its pipe broke.
+                # The pool replaces the crashed engine.
+                if chess_engine:
+                    self.pool.release(chess_engine)
+                chess_engine = None
+                result["error"] = "{0}: {1}".format(type(error).__name__, error)
+                continue
+
+            result.pop("error", None)
+            result.update({
+                "bestmove": info["bestmove"],
+                "score": info.get("score"),
+                "pv": info.get("pv", []),
+                "depth": info.get("depth"),
+                "nodes": info.get("nodes"),
+                "time": int(elapsed * 1000)
+            })
+            break
+
+        return result, chess_engine
+
+
+def analyse_file(input_path, output_path, pool, limit, workers):
+    """
+    Analyses the positions of the input file that are not in the output
+    file yet, appending the results to the output file and the failures
+    to the error file. Returns the number of failed positions and workers.
+    """
+
+    done = completed_ids(output_path)
+    positions = ((position_id, position) for position_id, position in read_positions(input_path)
+                 if position_id not in done)
+
+    analyzer = BatchAnalyzer(pool, limit, workers)
+
+    count = failed = 0
+    start = time.perf_counter()
+
+    with open(output_path, "a") as output, open(output_path + ".errors", "a") as errors:
+        for result in analyzer.run(positions):
+            if "error" in result:
+                errors.write(json.dumps(result) + "\n")
+                errors.flush()
+                failed += 1
+                continue
+
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+            count += 1
+            if count % 100 == 0:
+                elapsed = time.perf_counter() - start
+                print("{0} positions, {1:.1f} positions/s".format(count, count / elapsed), file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print("Analysed {0} positions in {1:.1f} s ({2} were already done).".format(count, elapsed, len(done)),
+          file=sys.stderr)
+
+    if failed or analyzer.worker_errors:
+        print("{0} positions failed, see {1}.errors, {2} workers stopped.".format(
+            failed, output_path, len(analyzer.worker_errors)), file=sys.stderr)
+
+    return failed + len(analyzer.worker_errors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch analysis of positions with UCI engines.")
+    parser.add_argument("input", help="Positions, one FEN or UCI move list per line.")
+    parser.add_argument("output", help="JSON lines results, appended to and resumed from.")
+    parser.add_argument("--engine", default=engine.ENGINE_PATH, help="Path of the UCI engine.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of engine processes.")
+    parser.add_argument("--hash", type=int, default=64, help="Hash size of each engine in MB.")
+
+    limits = parser.add_mutually_exclusive_group(required=True)
+    limits.add_argument("--depth", type=int)
+    limits.add_argument("--movetime", type=int, help="Milliseconds per position.")
+    limits.add_argument("--nodes", type=int)
+
+    args = parser.parse_args()
+
+    if args.depth:
+        limit = "depth {0}".format(args.depth)
+    elif args.movetime:
+        limit = "movetime {0}".format(args.movetime)
+    else:
+        limit = "nodes {0}".format(args.nodes)
+
+    # One thread per engine, all the cores are used by the workers.
+    pool = engine.EnginePool(args.workers, args.engine, threads=1, hash_mb=args.hash)
+    try:
+        failures = analyse_file(args.input, args.output, pool, limit, args.workers)
+    finally:
+        pool.close()
+
+    sys.exit(1 if failures else 0)
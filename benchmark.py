@@ -0,0 +1,702 @@
+"""
+The module with benchmarks for the hot paths of the internals module.
+Run as a script, for example:
+
+    python benchmark.py legal-moves --iterations 20
+"""
+
+import argparse
+import copy
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+import bitboard
+import engine
+import evaluation
+import internals
+import parallel
+import positions as positions_module
+import search
+
+# Moves played from the start position to reach the benchmark positions.
+# An Italian game, leading to a middlegame with all piece types active.
+OPENING_MOVES = ["e2e4", "e7e5", "g1f3", "b8c6", "f1c4", "f8c5",
+                 "c2c3", "g8f6", "d2d4", "e5d4", "c3d4", "c5b4"]
+
+
+def benchmark_positions(board_class=internals.Board):
+    """
+    Returns the boards and side to move used in the benchmarks,
+    one for every ply of the opening moves.
+    """
+
+    positions = []
+    board = board_class()
+    turn = "white"
+
+    for move in OPENING_MOVES:
+        positions.append((copy.deepcopy(board), turn))
+        board.make_move(internals.Board.square_to_pos(move[:2]), internals.Board.square_to_pos(move[2:]))
+        turn = "white" if turn == "black" else "black"
+
+    positions.append((board, turn))
+    return positions
+
+
+def deepcopy_legal_moves(board, color):
+    """
+    The legal move generation as it was done before make/unmake,
+    testing every move on a deep copy of the board.
+    """
+
+    legal_moves = defaultdict(list)
+    all_moves = board.get_all_moves(color)
+
+    for from_tile in all_moves:
+        for to_tile in all_moves[from_tile]:
+            board_copy = copy.deepcopy(board)
+            board_copy.make_move(from_tile, to_tile, promote="pawn")
+            if not board_copy.king_under_attack(color):
+                legal_moves[from_tile].append(to_tile)
+
+    return legal_moves
+
+
+def time_legal_moves(generator, positions, iterations):
+    """
+    Returns the seconds spent for generating the legal moves
+    of all the positions, iterations times.
+    """
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for board, turn in positions:
+            generator(board, turn)
+    return time.perf_counter() - start
+
+
+def bench_legal_moves(args):
+    positions = benchmark_positions()
+
+    # Every call generates the moves, not looks them up, as before the
+    # attack cache. The attack-cache benchmark measures the cache hits.
+    for board, turn in positions:
+        board.attack_cache_size = 0
+        board.attack_cache.clear()
+
+    # Both of the generators must agree before comparing them.
+    for board, turn in positions:
+        assert deepcopy_legal_moves(board, turn) == board.get_all_legal_moves(turn)
+
+    calls = args.iterations * len(positions)
+    deepcopy_time = time_legal_moves(deepcopy_legal_moves, positions, args.iterations)
+    make_unmake_time = time_legal_moves(lambda board, turn: board.get_all_legal_moves(turn), positions, args.iterations)
+
+    print("get_all_legal_moves over {0} positions, {1} calls".format(len(positions), calls))
+    print("deepcopy:      {0:8.3f} ms/call".format(1000 * deepcopy_time / calls))
+    print("make/unmake:   {0:8.3f} ms/call".format(1000 * make_unmake_time / calls))
+    print("speedup:       {0:8.2f}x".format(deepcopy_time / make_unmake_time))
+
+
+def time_calls(function, positions, iterations):
+    """
+    Returns the microseconds spent for a single call of function(board, turn).
+    """
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for board, turn in positions:
+            function(board, turn)
+    return 1000000 * (time.perf_counter() - start) / (iterations * len(positions))
+
+
+def bench_backends(args):
+    queries = [
+        ("get_all_attacks", lambda board, turn: board.get_all_attacks(turn)),
+        ("king_under_attack", lambda board, turn: board.king_under_attack(turn)),
+        ("get_all_legal_moves", lambda board, turn: board.get_all_legal_moves(turn)),
+    ]
+
+    grid_positions = benchmark_positions(internals.Board)
+    bitboard_positions = benchmark_positions(bitboard.BitBoard)
+
+    print("{0:22}{1:>14}{2:>14}{3:>10}".format("us/call", "grid", "bitboard", "speedup"))
+    for name, query in queries:
+        grid_time = time_calls(query, grid_positions, args.iterations)
+        bitboard_time = time_calls(query, bitboard_positions, args.iterations)
+        print("{0:22}{1:14.1f}{2:14.1f}{3:9.2f}x".format(name, grid_time, bitboard_time, grid_time / bitboard_time))
+
+
+def bench_transposition(args):
+    """
+    Searches the benchmark positions at a fixed depth with several
+    transposition table sizes, to choose the size for the hardware.
+    """
+
+    positions = benchmark_positions(bitboard.BitBoard)[::4]
+
+    print("{0:>8}{1:>10}{2:>10}{3:>12}{4:>12}{5:>10}".format("size_mb", "nodes", "seconds", "hit_rate", "collisions", "fill"))
+    for size_mb in args.hash_sizes:
+        searcher = search.Searcher(hash_mb=size_mb)
+        nodes = 0
+        start = time.perf_counter()
+        for board, turn in positions:
+            for info in searcher._iterate(board, {"depth": args.depth}):
+                pass
+            nodes += searcher.nodes
+        elapsed = time.perf_counter() - start
+
+        stats = searcher.tt.stats()
+        print("{0:>8}{1:>10}{2:>10.2f}{3:>12.3f}{4:>12}{5:>10.4f}".format(
+            size_mb, nodes, elapsed, stats["hit_rate"], stats["collisions"], stats["fill_ratio"]))
+
+
+def bench_engine_cpu(args):
+    """
+    Measures the CPU time used by this process, not the engine's,
+    while the engine analyses with go infinite.
+    """
+
+    chess_engine = engine.Engine(args.engine)
+    chess_engine.set_position(OPENING_MOVES)
+
+    stopper = threading.Timer(args.seconds, chess_engine.stop_infinite_search)
+
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    stopper.start()
+    lines = sum(1 for _ in chess_engine.start_infinite_search())
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+
+    chess_engine.stop_process()
+
+    print("analysed for {0:.1f} s, read {1} info lines".format(elapsed, lines))
+    print("CPU used by this process: {0:.3f} s ({1:.1f}% of a core)".format(cpu, 100 * cpu / elapsed))
+
+
+def bench_fen(args):
+    """
+    Measures the FEN import and export speed on the benchmark positions.
+    """
+
+    fens = [board.to_fen() for board, turn in benchmark_positions()] * args.iterations
+
+    for board_class in (internals.Board, bitboard.BitBoard):
+        start = time.perf_counter()
+        boards = [board_class.from_fen(fen) for fen in fens]
+        parse_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        exported = [board.to_fen() for board in boards]
+        export_time = time.perf_counter() - start
+
+        assert exported == fens
+        print("{0:10} from_fen {1:>10.0f} positions/min   to_fen {2:>10.0f} positions/min".format(
+            board_class.__name__, 60 * len(fens) / parse_time, 60 * len(fens) / export_time))
+
+
+def bench_engine_positions(args):
+    """
+    Plays a long game of the engine against itself, once sending the full
+    move list every move and once sending the position incrementally.
+    Reports the bytes written to the engine and the time to the best move.
+    """
+
+    pool = engine.EnginePool(1, args.engine)
+    limit = "depth {0}".format(args.depth)
+
+    print("{0:>12}{1:>8}{2:>14}{3:>14}{4:>16}".format("mode", "plies", "total bytes", "bytes/move", "ms to bestmove"))
+    try:
+        for incremental in (False, True):
+            game = internals.Game(0, "test", engine_pool=pool, incremental_position=incremental)
+            chess_engine = game.chess_engine
+            chess_engine.new_game()
+            start_bytes = chess_engine.bytes_written
+
+            think_time = 0
+            for _ in range(args.plies):
+                if not game.board.get_legal_move_list(game.turn):
+                    break
+
+                start = time.perf_counter()
+                move = chess_engine.get_best_move(limit)
+                think_time += time.perf_counter() - start
+
+                game.move(*internals.Board.uci_to_move(move))
+
+            plies = len(game.all_moves)
+            written = chess_engine.bytes_written - start_bytes
+            print("{0:>12}{1:>8}{2:>14}{3:>14.1f}{4:>16.2f}".format(
+                "incremental" if incremental else "full", plies, written,
+                written / plies, 1000 * think_time / plies))
+
+            game.game_exit()
+    finally:
+        pool.close()
+
+
+def bench_pack(args):
+    """
+    Compares the memory of boards and of packed positions,
+    and measures the packing and unpacking speed.
+    """
+
+    fens = [board.to_fen() for board, turn in benchmark_positions()] * args.iterations
+
+    tracemalloc.start()
+    boards = [internals.Board.from_fen(fen) for fen in fens]
+    board_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    array = positions_module.PositionArray()
+    array.extend(boards)
+    pack_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    unpacked = [array.board(index) for index in range(len(array))]
+    unpack_time = time.perf_counter() - start
+
+    assert [board.to_fen() for board in unpacked] == fens
+
+    print("{0} positions".format(len(fens)))
+    print("Board:          {0:10.0f} bytes/position".format(board_memory / len(fens)))
+    print("PositionArray:  {0:10.0f} bytes/position".format(len(array.data) / len(fens)))
+    print("pack {0:.0f} positions/s, unpack {1:.0f} positions/s".format(
+        len(fens) / pack_time, len(fens) / unpack_time))
+
+
+class StringPiece(object):
+    """
+    The piece as it was before the integer codes, for comparison.
+    The codes are looked up by the names for make_move and unmake_move,
+    which are shared with the current board.
+    """
+
+    def __init__(self, color, kind):
+        self.color = color
+        self.kind = kind
+        self.last_move = None
+
+    @property
+    def color_code(self):
+        return internals.COLOR_CODES[self.color]
+
+    @property
+    def kind_code(self):
+        return internals.KIND_CODES[self.kind]
+
+
+class StringPieceBoard(internals.Board):
+    """
+    The grid board with string pieces and the move generation as it was
+    before the integer codes, comparing the names of the pieces.
+    """
+
+    def _load_fen(self, fen):
+
+        internals.Board._load_fen(self, fen)
+
+        for row in self.grid:
+            for col, piece in enumerate(row):
+                if piece:
+                    row[col] = StringPiece(piece.color, piece.kind)
+                    row[col].last_move = piece.last_move
+
+        pieces = [piece for row in self.grid for piece in row if piece]
+        self.white_pieces = [piece for piece in pieces if piece.color == "white"]
+        self.black_pieces = [piece for piece in pieces if piece.color == "black"]
+
+    def get_moves(self, pos):
+
+        self.debug_output("get_moves called.", 5)
+
+        moves = set()
+        row, col = pos
+        piece = self.grid[row][col]
+
+        bishop_move = [(-1, -1), (-1, 1), (1, 1), (1, -1)]
+        rook_move = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+        queen_move = bishop_move + rook_move
+
+        if piece.kind == "king":
+            moves = self.direction_search(pos, queen_move, 1)
+
+            opponent = "white" if piece.color == "black" else "black"
+            if not self.king_under_attack(piece.color) and piece.last_move == None and self.grid[row][col + 3]:
+                if self.grid[row][col + 3].last_move == None:
+                    tiles_between = self.direction_search(pos, [(0, 1)], 2)
+                    if len(tiles_between) == 2 and not tiles_between.intersection(self.get_all_attacks(opponent)):
+                        moves.add((row, col + 2))
+
+            if not self.king_under_attack(piece.color) and piece.last_move == None and self.grid[row][col - 4]:
+                if self.grid[row][col - 4].last_move == None:
+                    tiles_between = self.direction_search(pos, [(0, -1)], 3)
+                    tiles_king_pass = self.direction_search(pos, [(0, -1)], 2)
+                    if len(tiles_between) == 3 and not tiles_king_pass.intersection(self.get_all_attacks(opponent)):
+                        moves.add((row, col - 2))
+
+        elif piece.kind == "queen":
+            moves = self.direction_search(pos, queen_move, 7)
+
+        elif piece.kind == "bishop":
+            moves = self.direction_search(pos, bishop_move, 7)
+
+        elif piece.kind == "knight":
+            move_list = [(row - 2, col - 1), (row - 2, col + 1), (row - 1, col + 2), (row + 1, col + 2),
+                         (row + 2, col + 1), (row + 2, col - 1), (row + 1, col - 2), (row - 1, col - 2)]
+
+            for move in move_list:
+                if 0 <= move[0] <= 7 and 0 <= move[1] <= 7:
+                    i, j = move
+                    if not self.grid[i][j]:
+                        moves.add(move)
+
+        elif piece.kind == "rook":
+            moves = self.direction_search(pos, rook_move, 7)
+
+        elif piece.kind == "pawn":
+            if piece.color == "white":
+                if row == 6:
+                    moves = self.direction_search(pos, [(-1, 0)], 2)
+                else:
+                    moves = self.direction_search(pos, [(-1, 0)], 1)
+                    if self.en_passant_square in [(row - 1, col - 1), (row - 1, col + 1)]:
+                        moves.add(self.en_passant_square)
+
+            elif piece.color == "black":
+                if row == 1:
+                    moves = self.direction_search(pos, [(1, 0)], 2)
+                else:
+                    moves = self.direction_search(pos, [(1, 0)], 1)
+                    if self.en_passant_square in [(row + 1, col - 1), (row + 1, col + 1)]:
+                        moves.add(self.en_passant_square)
+
+        for tile in self.get_attacks(pos):
+            i, j = tile
+            if self.grid[i][j] and self.grid[i][j].color != piece.color:
+                moves.add((i, j))
+
+        return moves
+
+    def get_all_moves(self, color):
+
+        self.debug_output("get_all_moves called.", 4)
+
+        moves = defaultdict(list)
+
+        for i, row in enumerate(self.grid):
+            for j, piece in enumerate(row):
+                if piece and piece.color == color:
+                    for move in self.get_moves((i, j)):
+                        moves[(i, j)].append(move)
+
+        return moves
+
+    def get_legal_move_list(self, color):
+
+        moves = []
+        legal_moves = self.get_all_legal_moves(color)
+
+        for from_tile in legal_moves:
+            piece = self.grid[from_tile[0]][from_tile[1]]
+            for to_tile in legal_moves[from_tile]:
+                if piece.kind == "pawn" and (to_tile[0] == 0 or to_tile[0] == 7):
+                    for kind in internals.PROMOTION_KINDS:
+                        moves.append((from_tile, to_tile, kind))
+                else:
+                    moves.append((from_tile, to_tile, None))
+
+        return moves
+
+    def get_attacks(self, pos):
+
+        self.debug_output("get_attacks called.", 5)
+
+        tiles = set()
+        row, col = pos
+        piece = self.grid[row][col]
+
+        bishop_move = [(-1, -1), (-1, 1), (1, 1), (1, -1)]
+        rook_move = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+        queen_move = bishop_move + rook_move
+
+        if piece.kind == "king":
+            tiles = self.direction_search(pos, queen_move, 1, True)
+
+        elif piece.kind == "queen":
+            tiles = self.direction_search(pos, queen_move, 7, True)
+
+        elif piece.kind == "bishop":
+            tiles = self.direction_search(pos, bishop_move, 7, True)
+
+        elif piece.kind == "knight":
+            move_list = [(row - 2, col - 1), (row - 2, col + 1), (row - 1, col + 2), (row + 1, col + 2),
+                         (row + 2, col + 1), (row + 2, col - 1), (row + 1, col - 2), (row - 1, col - 2)]
+
+            for move in move_list:
+                if 0 <= move[0] <= 7 and 0 <= move[1] <= 7:
+                    tiles.add(move)
+
+        elif piece.kind == "rook":
+            tiles = self.direction_search(pos, rook_move, 7, True)
+
+        elif piece.kind == "pawn":
+            if piece.color == "white":
+                if col > 0:
+                    tiles.add((row - 1, col - 1))
+                if col < 7:
+                    tiles.add((row - 1, col + 1))
+
+            elif piece.color == "black":
+                if col > 0:
+                    tiles.add((row + 1, col - 1))
+                if col < 7:
+                    tiles.add((row + 1, col + 1))
+
+        return tiles
+
+    def get_all_attacks(self, color):
+
+        self.debug_output("get_attacks called.", 3)
+
+        tiles = set()
+
+        for i, row in enumerate(self.grid):
+            for j, tile in enumerate(row):
+                if tile and tile.color == color:
+                    tiles = tiles.union(self.get_attacks((i, j)))
+
+        return tiles
+
+    def king_position(self, color):
+
+        self.debug_output("king_position called.", 4)
+
+        for i, row in enumerate(self.grid):
+            for j, tile in enumerate(row):
+                if tile and tile.color == color and tile.kind == "king":
+                    return (i, j)
+
+    def king_under_attack(self, color):
+
+        self.debug_output("king_under_attack called.", 4)
+
+        if color == "white" and self.king_position("white") in self.get_all_attacks("black"):
+            return True
+
+        elif color == "black" and self.king_position("black") in self.get_all_attacks("white"):
+            return True
+
+        else:
+            return False
+
+    def direction_search(self, pos, directions, search_distance, inclusive=False):
+
+        self.debug_output("direction_search called.", 4)
+
+        tiles = set()
+        row, col = pos
+        piece = self.grid[row][col]
+
+        for x, y in directions:
+            try:
+                for i in range(1, search_distance + 1):
+                    m, n = row + x * i, col + y * i
+                    in_tile = self.grid[m][n]
+                    if in_tile or not (0 <= m <= 7 and 0 <= n <= 7):
+                        if piece.kind != "pawn":
+                            if inclusive and 0 <= m <= 7 and 0 <= n <= 7:
+                                tiles.add((m, n))
+                        break
+                    tiles.add((m, n))
+            except IndexError:
+                continue
+
+        return tiles
+
+
+def bench_pieces(args):
+    """
+    Compares the memory of the slotted, integer coded pieces with the
+    string attribute pieces, and the legal move generation with both of
+    them on the same positions, without the attack cache.
+    """
+
+    count = 32 * 10000
+    for piece_class in (StringPiece, internals.Piece):
+        tracemalloc.start()
+        pieces = [piece_class("white", "pawn") for _ in range(count)]
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del pieces
+        print("{0:12} {1:6.0f} bytes/piece".format(piece_class.__name__, memory / count))
+
+    fens = [board.to_fen() for board, turn in benchmark_positions()]
+    timings = {}
+
+    for board_class in (StringPieceBoard, internals.Board):
+        positions = []
+        for fen in fens:
+            board = board_class.from_fen(fen)
+            board.attack_cache_size = 0
+            positions.append((board, board.turn))
+
+        timings[board_class] = (
+            time_calls(lambda board, turn: board.get_legal_move_list(turn), positions, args.iterations),
+            time_calls(lambda board, turn: board.get_all_attacks(turn), positions, args.iterations),
+            [sorted(board.get_legal_move_list(turn)) for board, turn in positions])
+
+    # Both of the generators must agree before comparing them.
+    assert timings[StringPieceBoard][2] == timings[internals.Board][2]
+
+    print("{0:22}{1:>14}{2:>14}{3:>10}".format("us/call", "string pieces", "Piece", "speedup"))
+    for index, name in enumerate(("get_legal_move_list", "get_all_attacks")):
+        before, after = timings[StringPieceBoard][index], timings[internals.Board][index]
+        print("{0:22}{1:14.1f}{2:14.1f}{3:9.2f}x".format(name, before, after, before / after))
+
+
+def bench_attack_cache(args):
+    """
+    Generates the legal moves of the benchmark positions on the grid board
+    with and without the attack cache, a first time and then again,
+    as the GUI does for every selection.
+    """
+
+    print("{0:>10}{1:>16}{2:>16}{3:>10}{4:>10}".format("cache", "first ms/call", "again ms/call", "hits", "misses"))
+    for cache_size in (0, internals.ATTACK_CACHE_SIZE):
+        positions = benchmark_positions()
+        for board, turn in positions:
+            board.attack_cache_size = cache_size
+
+        first = time_legal_moves(lambda board, turn: board.get_all_legal_moves(turn), positions, 1)
+        again = time_legal_moves(lambda board, turn: board.get_all_legal_moves(turn), positions, args.iterations)
+
+        hits = sum(board.attack_cache_hits for board, turn in positions)
+        misses = sum(board.attack_cache_misses for board, turn in positions)
+        print("{0:>10}{1:16.3f}{2:16.3f}{3:>10}{4:>10}".format(
+            cache_size, 1000 * first / len(positions), 1000 * again / (args.iterations * len(positions)), hits, misses))
+
+
+def bench_evaluation(args):
+    """
+    Compares the incremental evaluation with rescanning the grid,
+    and the batch scoring of packed positions with scoring them one by one.
+    """
+
+    positions = benchmark_positions(bitboard.BitBoard)
+
+    def rescan(board, turn):
+        board.compute_psqt()
+        return evaluation.evaluate(board)
+
+    incremental = time_calls(lambda board, turn: evaluation.evaluate(board), positions, 1000 * args.iterations)
+    rescanned = time_calls(rescan, positions, 1000 * args.iterations)
+    print("evaluate: incremental {0:.2f} us, rescanning the grid {1:.2f} us".format(incremental, rescanned))
+
+    array = positions_module.PositionArray()
+    for _ in range(100 * args.iterations):
+        array.extend(board for board, turn in positions)
+
+    start = time.perf_counter()
+    single = [evaluation.evaluate_packed(packed) for packed in array]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = evaluation.evaluate_batch(array.data)
+    batch_time = time.perf_counter() - start
+
+    assert list(batch) == single
+    print("{0} packed positions: one by one {1:.0f} positions/s, batch {2:.0f} positions/s{3}".format(
+        len(array), len(array) / single_time, len(array) / batch_time,
+        "" if evaluation.numpy else " (NumPy is not installed)"))
+
+
+def bench_ordering(args):
+    """
+    Searches the benchmark positions at a fixed depth with and without
+    move ordering, and compares the nodes searched.
+    """
+
+    positions = benchmark_positions(bitboard.BitBoard)[::2]
+
+    print("{0:>10}{1:>12}{2:>10}{3:>12}{4:>10}".format("ordering", "nodes", "seconds", "nodes/pos", "nps"))
+    for move_ordering in (False, True):
+        searcher = search.Searcher(move_ordering=move_ordering)
+        nodes = 0
+        start = time.perf_counter()
+        for board, turn in positions:
+            searcher.new_game()
+            for info in searcher._iterate(board, {"depth": args.depth}):
+                pass
+            nodes += searcher.nodes
+        elapsed = time.perf_counter() - start
+
+        print("{0:>10}{1:>12}{2:>10.2f}{3:>12.0f}{4:>10.0f}".format(
+            "on" if move_ordering else "off", nodes, elapsed, nodes / len(positions), nodes / elapsed))
+
+
+def bench_parallel(args):
+    """
+    Searches the benchmark positions to a fixed depth with more and more
+    searcher processes, and reports the speedup of the time to depth
+    and the combined speed of the searchers.
+    """
+
+    positions = benchmark_positions(bitboard.BitBoard)[::4]
+    thread_counts = args.threads or sorted({1, 2, 4, os.cpu_count()})
+
+    print("{0:>8}{1:>12}{2:>10}{3:>10}{4:>10}".format("threads", "nodes", "seconds", "nps", "speedup"))
+    single = None
+    for threads in thread_counts:
+        searcher = parallel.ParallelSearcher(threads=threads)
+        nodes = 0
+        elapsed = 0
+        for board, turn in positions:
+            searcher.new_game()
+            start = time.perf_counter()
+            for info in searcher._iterate(board, {"depth": args.depth}):
+                pass
+            elapsed += time.perf_counter() - start
+            nodes += searcher.nodes + searcher.helper_nodes
+        searcher.stop_process()
+
+        single = single or elapsed
+        print("{0:>8}{1:>12}{2:>10.2f}{3:>10.0f}{4:>9.2f}x".format(
+            threads, nodes, elapsed, nodes / elapsed, single / elapsed))
+
+
+BENCHMARKS = {
+    "legal-moves": bench_legal_moves,
+    "backends": bench_backends,
+    "transposition": bench_transposition,
+    "engine-cpu": bench_engine_cpu,
+    "fen": bench_fen,
+    "engine-positions": bench_engine_positions,
+    "pack": bench_pack,
+    "pieces": bench_pieces,
+    "attack-cache": bench_attack_cache,
+    "evaluation": bench_evaluation,
+    "ordering": bench_ordering,
+    "parallel": bench_parallel,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ITUChess benchmarks.")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--engine", default=engine.ENGINE_PATH, help="Path of the UCI engine.")
+    parser.add_argument("--seconds", type=float, default=10, help="Duration of the engine benchmarks.")
+    parser.add_argument("--depth", type=int, default=4, help="Search depth of the search benchmarks.")
+    parser.add_argument("--plies", type=int, default=200, help="Length of the engine games.")
+    parser.add_argument("--hash-sizes", type=float, nargs="+", default=[0.001, 1, 16],
+                        help="Transposition table sizes in MB.")
+    parser.add_argument("--threads", type=int, nargs="+", help="Searcher counts of the parallel search benchmark.")
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
@@ -0,0 +1,489 @@
+"""
+The module with the endgame bitbases.
+
+A bitbase tells if the stronger side wins an endgame position with best
+play, one bit for every position. There are tables of the king and queen,
+king and rook, and king and pawn against the king. The other side can
+never win these endings, so a position that is not won is a draw.
+
+The tables are generated by retrograde analysis. The legal moves of every
+position are generated with the bitboard backend of the board, then the
+wins are propagated backwards from the checkmates: a position of the
+stronger side to move is won if one of its moves reaches a won position,
+a position of the weaker side to move is won if all of its moves do.
+The move generation is split into chunks that run in a process pool.
+
+Positions are indexed by the side to move and the squares of the pieces,
+the stronger side is white in the tables, and positions of a stronger
+black are mirrored:
+
+    index = ((turn * 64 + strong_king) * 64 + weak_king) * 64 + piece
+
+turn is 0 when the stronger side is to move, squares are row * 8 + col of
+the grid. A result alone does not tell which winning move makes progress,
+so the file also has, for the won positions of the weaker side to move,
+the plies left until the mate or the winning promotion, one byte each.
+The stronger side plays the move reaching the smallest of them. Every table
+is 64 KB of bits followed by 256 KB of distances, the tables are in one
+file, and the file is memory-mapped, so a probe reads a single bit.
+Generate it with:
+
+    python bitbase.py generate bitbases.bin --workers 8
+"""
+
+import argparse
+import mmap
+import multiprocessing
+import os
+import time
+from array import array
+
+import bitboard
+from internals import Board, BLACK, KING, PAWN, PIECE_LETTERS, Piece, QUEEN, ROOK, WHITE
+
+# The tables in the order of the file, by the extra piece of the stronger side.
+# KPK is generated last, its promotions are looked up in the other two.
+TABLES = (QUEEN, ROOK, PAWN)
+
+TABLE_POSITIONS = 2 * 64 * 64 * 64
+TABLE_BYTES = TABLE_POSITIONS // 8
+
+# Positions of the weaker side to move, the second half of a table.
+WEAK_POSITIONS = TABLE_POSITIONS // 2
+
+# Bytes of a table and its distances in the file.
+FILE_TABLE_BYTES = TABLE_BYTES + WEAK_POSITIONS
+
+# Distances above this are stored as it.
+MAX_DISTANCE = 255
+
+# Positions of a chunk, the positions of a side to move and a strong king square.
+CHUNK_POSITIONS = 64 * 64
+
+# States of the positions found by the move generation.
+INVALID = 0
+OPEN = 1  # Decided by the moves to the other positions of the table
+WON = 2  # Checkmate, or a promotion to a won position
+DRAWN = 3  # Stalemate, or the weaker king can take the piece
+
+# Results of a probe, for the player to move.
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+# Promotions of the KPK table, under-promotions to a knight or
+# a bishop never win, and are not looked up.
+PROMOTION_TABLES = {"queen": QUEEN, "rook": ROOK}
+
+# The board of a generator process, and the tables generated before.
+_board = None
+_tables = None
+
+
+def position_index(turn, strong_king, weak_king, piece):
+    return ((turn * 64 + strong_king) * 64 + weak_king) * 64 + piece
+
+
+def table_bit(table, index):
+    return table[index >> 3] >> (index & 7) & 1
+
+
+def _init_generator(tables):
+    """
+    Initializer of the generator processes. tables is {kind: bytes}
+    of the tables generated before.
+    """
+
+    global _board, _tables
+
+    _board = bitboard.BitBoard.from_fen("8/8/8/8/8/8/8/8 w - - 0 1")
+    _tables = tables
+
+
+def _new_piece(color, kind):
+
+    piece = Piece(color, kind)
+
+    # The pieces are not on their starting tiles, there is no castling.
+    piece.last_move = ((0, 0), 0)
+    return piece
+
+
+def _generate_chunk(chunk):
+    """
+    Generates the moves of the positions of a chunk, (kind, turn, strong_king).
+    Returns (first index, states, offsets, successors), the successors of
+    the position first + i are successors[offsets[i]:offsets[i + 1]].
+    """
+
+    kind, turn, strong_king = chunk
+    board = _board
+    board.turn = "white" if turn == 0 else "black"
+
+    states = bytearray(CHUNK_POSITIONS)
+    offsets = array("I", [0])
+    successors = array("I")
+
+    strong_tile = divmod(strong_king, 8)
+    board._add_piece(_new_piece(WHITE, KING), strong_tile)
+
+    for weak_king in range(64):
+        weak_tile = divmod(weak_king, 8)
+
+        # Kings can not be next to each other.
+        if max(abs(weak_tile[0] - strong_tile[0]), abs(weak_tile[1] - strong_tile[1])) <= 1:
+            offsets.extend([len(successors)] * 64)
+            continue
+
+        board._add_piece(_new_piece(BLACK, KING), weak_tile)
+
+        for piece_sq in range(64):
+            state = _position_state(board, kind, turn, strong_king, weak_king, piece_sq, successors)
+            states[weak_king * 64 + piece_sq] = state
+            offsets.append(len(successors))
+
+        board._remove_piece(weak_tile)
+
+    board._remove_piece(strong_tile)
+
+    return position_index(turn, strong_king, 0, 0), bytes(states), offsets, successors
+
+
+def _position_state(board, kind, turn, strong_king, weak_king, piece_sq, successors):
+    """
+    Returns the state of a position, the kings are on the board.
+    The indices of the positions reached by its moves are added
+    to successors if the state is OPEN.
+    """
+
+    piece_tile = divmod(piece_sq, 8)
+    if piece_sq in (strong_king, weak_king) or (kind == PAWN and piece_tile[0] in (0, 7)):
+        return INVALID
+
+    board._add_piece(_new_piece(WHITE, kind), piece_tile)
+    try:
+        # The player who just moved can not be in check.
+        if turn == 0 and board.king_under_attack("black"):
+            return INVALID
+
+        moves = board.generate_legal_moves(board.turn)
+        if not moves:
+            if turn == 1 and board.king_under_attack("black"):
+                return WON  # Checkmate
+            return DRAWN  # Stalemate
+
+        start = len(successors)
+        for from_tile, to_tile, promote in moves:
+            to_sq = to_tile[0] * 8 + to_tile[1]
+
+            if turn == 1:
+                if to_sq == piece_sq:
+                    del successors[start:]
+                    return DRAWN  # King against king
+                successors.append(position_index(0, strong_king, to_sq, piece_sq))
+
+            elif from_tile[0] * 8 + from_tile[1] == strong_king:
+                successors.append(position_index(1, to_sq, weak_king, piece_sq))
+
+            elif promote:
+                table = _tables.get(PROMOTION_TABLES.get(promote))
+                if table and table_bit(table, position_index(1, strong_king, weak_king, to_sq)):
+                    del successors[start:]
+                    return WON
+
+            else:
+                successors.append(position_index(1, strong_king, weak_king, to_sq))
+
+        return OPEN
+    finally:
+        board._remove_piece(piece_tile)
+
+
+def _propagate(states, offsets, successors):
+    """
+    Retrograde analysis of a table from the states and the moves of its
+    positions. Returns the set bits of the won positions, and the distances
+    of the won positions of the weaker side to move, as bytes.
+    """
+
+    # The moves backwards, the predecessors of position v are
+    # predecessors[first[v]:first[v + 1]].
+    first = array("I", bytes(4 * (TABLE_POSITIONS + 1)))
+    for successor in successors:
+        first[successor + 1] += 1
+    for index in range(TABLE_POSITIONS):
+        first[index + 1] += first[index]
+
+    predecessors = array("I", bytes(4 * len(successors)))
+    filled = array("I", first)
+    for index in range(TABLE_POSITIONS):
+        for offset in range(offsets[index], offsets[index + 1]):
+            successor = successors[offset]
+            predecessors[filled[successor]] = index
+            filled[successor] += 1
+
+    # Moves not known to be won yet, of the positions of the weaker side to move.
+    remaining = array("I", (offsets[index + 1] - offsets[index] for index in range(TABLE_POSITIONS)))
+
+    # Plies to the mate or to the winning promotion, of the won positions.
+    # The positions are taken by their distance, so a position is won
+    # at its smallest distance for the stronger side to move, and
+    # at its largest for the weaker side to move.
+    distance = array("B", bytes(TABLE_POSITIONS))
+    won = bytearray(TABLE_POSITIONS)
+
+    # Checkmates are at 0, winning promotions at 1.
+    levels = [[], []]
+    for index in range(TABLE_POSITIONS):
+        if states[index] == WON:
+            won[index] = 1
+            level = 1 if index < WEAK_POSITIONS else 0
+            distance[index] = level
+            levels[level].append(index)
+
+    level = 0
+    while level < len(levels):
+        next_distance = min(level + 1, MAX_DISTANCE)
+        found = []
+
+        for position in levels[level]:
+            for offset in range(first[position], first[position + 1]):
+                predecessor = predecessors[offset]
+                if won[predecessor]:
+                    continue
+
+                if predecessor < WEAK_POSITIONS:
+                    # The stronger side moves to the won position.
+                    won[predecessor] = 1
+                elif states[predecessor] == OPEN:
+                    # All the moves of the weaker side reach won positions.
+                    remaining[predecessor] -= 1
+                    if remaining[predecessor]:
+                        continue
+                    won[predecessor] = 1
+                else:
+                    continue
+
+                distance[predecessor] = next_distance
+                found.append(predecessor)
+
+        if found:
+            if level + 1 < len(levels):
+                levels[level + 1].extend(found)
+            else:
+                levels.append(found)
+        level += 1
+
+    table = bytearray(TABLE_BYTES)
+    for index in range(TABLE_POSITIONS):
+        if won[index]:
+            table[index >> 3] |= 1 << (index & 7)
+
+    return bytes(table), distance[WEAK_POSITIONS:].tobytes()
+
+
+def generate_table(kind, tables, workers):
+    """
+    Generates the table of a piece kind, tables are {kind: bytes} of
+    the tables generated before. Returns the table and its distances
+    as bytes.
+    """
+
+    chunks = [(kind, turn, strong_king) for turn in (0, 1) for strong_king in range(64)]
+
+    states = bytearray(TABLE_POSITIONS)
+    offsets = array("I", [0])
+    successors = array("I")
+
+    with multiprocessing.Pool(workers, _init_generator, (tables,)) as pool:
+        # The chunks are in the order of the indices.
+        for start, chunk_states, chunk_offsets, chunk_successors in pool.imap(_generate_chunk, chunks):
+            states[start:start + CHUNK_POSITIONS] = chunk_states
+            base = len(successors)
+            offsets.extend(base + offset for offset in chunk_offsets[1:])
+            successors.extend(chunk_successors)
+
+    return _propagate(states, offsets, successors)
+
+
+def generate(path, workers=None):
+    """
+    Generates all the tables to a file, printing the time taken by each.
+    """
+
+    workers = workers or os.cpu_count()
+    tables = {}
+    distances = {}
+    start = time.perf_counter()
+
+    for kind in TABLES:
+        table_start = time.perf_counter()
+        tables[kind], distances[kind] = generate_table(kind, tables, workers)
+
+        wins = sum(bin(byte).count("1") for byte in tables[kind])
+        # The distances are only stored for the weaker side to move.
+        print("K{0}K: {1} won positions, longest win {2} plies with the weaker side to move, {3:.1f} s".format(
+            PIECE_LETTERS[kind], wins, max(distances[kind]), time.perf_counter() - table_start))
+
+    with open(path, "wb") as bitbase_file:
+        for kind in TABLES:
+            bitbase_file.write(tables[kind])
+            bitbase_file.write(distances[kind])
+
+    print("Generated the bitbases with {0} workers in {1:.1f} s".format(workers, time.perf_counter() - start))
+
+
+class Bitbases(object):
+    """
+    The bitbases of a file generated by generate, memory-mapped.
+    """
+
+    def __init__(self, path):
+
+        self._file = open(path, "rb")
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) != len(TABLES) * FILE_TABLE_BYTES:
+            self.close()
+            raise ValueError("{0} is not a bitbase file".format(path))
+
+        # Byte offset of the table of each piece kind.
+        self.offsets = {kind: number * FILE_TABLE_BYTES for number, kind in enumerate(TABLES)}
+
+        self.hits = 0
+
+    def _lookup(self, board):
+        """
+        Returns (kind, turn, index) of the position in the tables,
+        None if the material of the position has no table.
+        """
+
+        kings = [None, None]
+        other = None
+
+        for row, line in enumerate(board.grid):
+            for col, piece in enumerate(line):
+                if piece:
+                    if piece.kind_code == KING:
+                        kings[piece.color_code] = row * 8 + col
+                    elif other:
+                        return None
+                    else:
+                        other = row * 8 + col, piece
+
+        if not other or None in kings or other[1].kind_code not in self.offsets:
+            return None
+
+        piece_sq, piece = other
+        strong = piece.color_code
+        strong_king = kings[strong]
+        weak_king = kings[1 - strong]
+
+        # The tables are of a stronger white, black is mirrored.
+        if strong == BLACK:
+            strong_king ^= 56
+            weak_king ^= 56
+            piece_sq ^= 56
+
+        turn = 0 if board.turn == piece.color else 1
+        return piece.kind_code, turn, position_index(turn, strong_king, weak_king, piece_sq)
+
+    def probe(self, board):
+        """
+        Returns WIN, DRAW or LOSS for the player to move, or None if
+        the material of the position has no table. Only the table
+        lookup depends on the position, it reads one bit.
+        """
+
+        position = self._lookup(board)
+        if position is None:
+            return None
+
+        kind, turn, index = position
+        self.hits += 1
+
+        if not self.data[self.offsets[kind] + (index >> 3)] >> (index & 7) & 1:
+            return DRAW
+        return WIN if turn == 0 else LOSS
+
+    def best_move(self, board):
+        """
+        Returns a move of the position in UCI notation that keeps the best
+        result, None if the material of the position has no table. Winning
+        moves reach the position closest to the mate or to the promotion,
+        the other moves are told apart by the evaluation.
+        """
+
+        position = self._lookup(board)
+        if position is None:
+            return None
+
+        # Imported here because the evaluation module builds on the internals.
+        from evaluation import evaluate
+
+        kind = position[0]
+        best = None
+        best_value = None
+
+        for from_tile, to_tile, promote in board.get_legal_move_list(board.turn):
+            if promote not in (None, "queen", "rook"):
+                continue
+
+            record = board.make_move(from_tile, to_tile, promote)
+
+            # Moves leaving the tables take the piece, a draw.
+            after = self._lookup(board)
+            result = DRAW
+            distance = 0
+
+            if after:
+                after_kind, turn, index = after
+                if self.data[self.offsets[after_kind] + (index >> 3)] >> (index & 7) & 1:
+                    result = WIN if turn == 1 else LOSS
+
+                # Promotions leave the table of the position, they are the goal.
+                if result == WIN and after_kind == kind:
+                    distance = self.data[self.offsets[kind] + TABLE_BYTES + index - WEAK_POSITIONS]
+
+            value = (result, -distance, -evaluate(board))
+            board.unmake_move(record)
+
+            if best_value is None or value > best_value:
+                best = Board.move_to_uci(from_tile, to_tile, promote)
+                best_value = value
+
+        return best
+
+    def close(self):
+
+        if self.data:
+            self.data.close()
+            self.data = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates the endgame bitbases.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="Generates the bitbase file.")
+    generate_parser.add_argument("path", help="Bitbase file to write.")
+    generate_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of generator processes.")
+
+    probe_parser = subparsers.add_parser("probe", help="Probes a position given by FEN.")
+    probe_parser.add_argument("path", help="Bitbase file.")
+    probe_parser.add_argument("fen")
+
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate(args.path, args.workers)
+    else:
+        bitbases = Bitbases(args.path)
+        board = Board.from_fen(args.fen)
+        result = bitbases.probe(board)
+        print({None: "not in the bitbases", WIN: "win", DRAW: "draw", LOSS: "loss"}[result],
+              bitbases.best_move(board) or "")
+        bitbases.close()
@@ -0,0 +1,578 @@
+"""
+The module with the bitboard backend of the chessboard.
+
+Every square is a bit of a Python integer, the bit index of a tile
+(row, col) is row * 8 + col. So bit 0 is a8 and bit 63 is h1, following
+the layout of Board.grid.
+"""
+
+from collections import defaultdict
+
+from internals import Board, COLOR_CODES, KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN, PROMOTION_KINDS
+
+# Directions in (row, col) form, same as in Board.get_moves.
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, 1), (1, -1)]
+ROOK_DIRECTIONS = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+KNIGHT_JUMPS = [(-2, -1), (-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2)]
+
+# The tile of every bit index.
+SQUARE_TILES = [divmod(sq, 8) for sq in range(64)]
+
+
+def _jump_table(jumps):
+    """
+    Precomputes the attacks of a non sliding piece for every square.
+    """
+
+    table = []
+    for row, col in SQUARE_TILES:
+        mask = 0
+        for x, y in jumps:
+            if 0 <= row + x <= 7 and 0 <= col + y <= 7:
+                mask |= 1 << ((row + x) * 8 + col + y)
+        table.append(mask)
+    return table
+
+
+def _ray_table(direction):
+    """
+    Precomputes the ray from every square to the edge of the board
+    in a single direction, the square itself is excluded.
+    """
+
+    table = []
+    x, y = direction
+    for row, col in SQUARE_TILES:
+        mask = 0
+        m, n = row + x, col + y
+        while 0 <= m <= 7 and 0 <= n <= 7:
+            mask |= 1 << (m * 8 + n)
+            m, n = m + x, n + y
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = _jump_table(KNIGHT_JUMPS)
+KING_ATTACKS = _jump_table(BISHOP_DIRECTIONS + ROOK_DIRECTIONS)
+
+# Attacks of a pawn on a square by color code, white pawns attack upwards.
+PAWN_ATTACKS = (
+    _jump_table([(-1, -1), (-1, 1)]),
+    _jump_table([(1, -1), (1, 1)])
+)
+
+# Rays of each direction, with a flag telling if the bit indexes
+# increase along the ray. The flag decides whether the nearest
+# blocker is the lowest or the highest set bit.
+BISHOP_RAYS = [(_ray_table(d), d[0] > 0 or (d[0] == 0 and d[1] > 0)) for d in BISHOP_DIRECTIONS]
+ROOK_RAYS = [(_ray_table(d), d[0] > 0 or (d[0] == 0 and d[1] > 0)) for d in ROOK_DIRECTIONS]
+
+# Empty tiles the king passes and the tiles that must be empty for castling,
+# indexed by the castling side. (rook_col, passed_cols, empty_cols)
+CASTLING = {
+    "kingside": (7, (5, 6), (5, 6)),
+    "queenside": (0, (3, 2), (3, 2, 1))
+}
+
+
+def sliding_attacks(sq, occupied, rays):
+    """
+    Returns the attacks of a sliding piece on a square, stopping
+    at the first occupied tile of each ray (which is attacked).
+    """
+
+    attacks = 0
+    for table, increasing in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if increasing:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            # Cut the part of the ray behind the blocker.
+            ray ^= table[blocker]
+        attacks |= ray
+    return attacks
+
+
+def _nearest(mask, increasing):
+    """
+    Returns the square of the set bit nearest to the start of a ray.
+    """
+
+    if increasing:
+        return (mask & -mask).bit_length() - 1
+    return mask.bit_length() - 1
+
+
+def mask_to_tiles(mask):
+    """
+    Converts a bitboard to a set of (row, col) tiles.
+    """
+
+    tiles = set()
+    while mask:
+        bit = mask & -mask
+        tiles.add(SQUARE_TILES[bit.bit_length() - 1])
+        mask ^= bit
+    return tiles
+
+
+class BitBoard(Board):
+    """
+    The chessboard with a bitboard backend. The grid is still kept up to date,
+    but move generation and attack queries are done on one integer per
+    piece type and color, plus the occupancy of each color.
+
+    The legal moves are generated directly from the checks and the pins
+    of the position (legal_generator = "direct"), or by trying every
+    pseudo legal move like Board does (legal_generator = "trial").
+    """
+
+    legal_generator = "direct"
+
+    def __init__(self, debug=0, fen=None):
+
+        # Bitboards of each piece, [color_code][kind_code]
+        self.pieces = [[0] * 6, [0] * 6]
+
+        # Occupied tiles of each color (by color code) and of both colors.
+        self.occupancy = [0, 0]
+        self.occupied = 0
+
+        Board.__init__(self, debug, fen)
+
+        self.rebuild_bitboards()
+
+    def rebuild_bitboards(self):
+        """
+        Computes all the bitboards from the grid from scratch.
+        """
+
+        pieces = self.pieces
+        occupancy = self.occupancy
+
+        for color in (0, 1):
+            pieces[color][:] = [0] * 6
+            occupancy[color] = 0
+
+        bit = 1
+        for row in self.grid:
+            for piece in row:
+                if piece:
+                    pieces[piece.color_code][piece.kind_code] |= bit
+                    occupancy[piece.color_code] |= bit
+                bit <<= 1
+
+        self.occupied = occupancy[0] | occupancy[1]
+
+    def _add_piece(self, piece, tile):
+
+        Board._add_piece(self, piece, tile)
+
+        bit = 1 << (tile[0] * 8 + tile[1])
+        self.pieces[piece.color_code][piece.kind_code] |= bit
+        self.occupancy[piece.color_code] |= bit
+        self.occupied |= bit
+
+    def _remove_piece(self, tile):
+
+        piece = Board._remove_piece(self, tile)
+
+        bit = 1 << (tile[0] * 8 + tile[1])
+        self.pieces[piece.color_code][piece.kind_code] ^= bit
+        self.occupancy[piece.color_code] ^= bit
+        self.occupied ^= bit
+
+        return piece
+
+    def attack_mask_from(self, sq, piece):
+        """
+        Returns the bitboard of the tiles attacked by a piece on a square.
+        """
+
+        kind = piece.kind_code
+
+        if kind == PAWN:
+            return PAWN_ATTACKS[piece.color_code][sq]
+        elif kind == KNIGHT:
+            return KNIGHT_ATTACKS[sq]
+        elif kind == BISHOP:
+            return sliding_attacks(sq, self.occupied, BISHOP_RAYS)
+        elif kind == ROOK:
+            return sliding_attacks(sq, self.occupied, ROOK_RAYS)
+        elif kind == QUEEN:
+            return sliding_attacks(sq, self.occupied, BISHOP_RAYS) | sliding_attacks(sq, self.occupied, ROOK_RAYS)
+        else:
+            return KING_ATTACKS[sq]
+
+    def attack_mask(self, color):
+        """
+        Returns the bitboard of all the tiles attacked by the given player.
+        """
+
+        return self._attack_mask(COLOR_CODES[color], self.occupied)
+
+    def _attack_mask(self, color, occupied):
+        """
+        attack_mask with the color code, the sliding pieces are
+        blocked by the given occupied tiles.
+        """
+
+        pieces = self.pieces[color]
+        attacks = 0
+
+        pawns = pieces[PAWN]
+        table = PAWN_ATTACKS[color]
+        while pawns:
+            bit = pawns & -pawns
+            attacks |= table[bit.bit_length() - 1]
+            pawns ^= bit
+
+        knights = pieces[KNIGHT]
+        while knights:
+            bit = knights & -knights
+            attacks |= KNIGHT_ATTACKS[bit.bit_length() - 1]
+            knights ^= bit
+
+        diagonal = pieces[BISHOP] | pieces[QUEEN]
+        while diagonal:
+            bit = diagonal & -diagonal
+            attacks |= sliding_attacks(bit.bit_length() - 1, occupied, BISHOP_RAYS)
+            diagonal ^= bit
+
+        straight = pieces[ROOK] | pieces[QUEEN]
+        while straight:
+            bit = straight & -straight
+            attacks |= sliding_attacks(bit.bit_length() - 1, occupied, ROOK_RAYS)
+            straight ^= bit
+
+        king = pieces[KING]
+        if king:
+            attacks |= KING_ATTACKS[king.bit_length() - 1]
+
+        return attacks
+
+    def is_attacked(self, sq, color):
+        """
+        Returns if a square is attacked by any piece of the given color.
+        Looks from the square outwards, instead of computing all the attacks.
+        """
+
+        return self._is_attacked(sq, COLOR_CODES[color])
+
+    def _is_attacked(self, sq, color):
+        """
+        is_attacked with the color code of the attacker.
+        """
+
+        pieces = self.pieces[color]
+
+        # A pawn of the color attacks the square if a pawn of the
+        # opponent on the square would attack that pawn.
+        if PAWN_ATTACKS[1 - color][sq] & pieces[PAWN]:
+            return True
+        if KNIGHT_ATTACKS[sq] & pieces[KNIGHT]:
+            return True
+        if KING_ATTACKS[sq] & pieces[KING]:
+            return True
+
+        diagonal = pieces[BISHOP] | pieces[QUEEN]
+        if diagonal and sliding_attacks(sq, self.occupied, BISHOP_RAYS) & diagonal:
+            return True
+
+        straight = pieces[ROOK] | pieces[QUEEN]
+        if straight and sliding_attacks(sq, self.occupied, ROOK_RAYS) & straight:
+            return True
+
+        return False
+
+    def get_moves(self, pos):
+        """
+        Get possible moves of a single piece.
+        Unlegal moves resulting in a threat for the king are included
+        in the result.
+        """
+
+        self.debug_output("get_moves called.", 5)
+
+        row, col = pos
+        sq = row * 8 + col
+        piece = self.grid[row][col]
+        color = piece.color_code
+        opponent = 1 - color
+        own = self.occupancy[color]
+
+        if piece.kind_code == PAWN:
+            step = 16 * color - 8
+            start_row = 1 if color else 6
+
+            targets = PAWN_ATTACKS[color][sq] & self.occupancy[opponent]
+
+            if not self.occupied & (1 << (sq + step)):
+                targets |= 1 << (sq + step)
+                if row == start_row and not self.occupied & (1 << (sq + 2 * step)):
+                    targets |= 1 << (sq + 2 * step)
+
+            if self.en_passant_square:
+                ep_row, ep_col = self.en_passant_square
+                if PAWN_ATTACKS[color][sq] & (1 << (ep_row * 8 + ep_col)):
+                    targets |= 1 << (ep_row * 8 + ep_col)
+
+            return mask_to_tiles(targets)
+
+        moves = mask_to_tiles(self.attack_mask_from(sq, piece) & ~own)
+
+        # Castling, same rules as in Board.get_moves.
+        if piece.kind_code == KING and piece.last_move is None and not self._is_attacked(sq, opponent):
+            for rook_col, passed_cols, empty_cols in CASTLING.values():
+                rook = self.grid[row][rook_col]
+                if not rook or rook.last_move is not None:
+                    continue
+                if any(self.occupied & (1 << (row * 8 + c)) for c in empty_cols):
+                    continue
+                if any(self._is_attacked(row * 8 + c, opponent) for c in passed_cols):
+                    continue
+                moves.add((row, passed_cols[1]))
+
+        return moves
+
+    def get_all_moves(self, color):
+        """
+        The method that returns all the possible moves of a particular player
+        (Including non-legal moves).
+        """
+
+        self.debug_output("get_all_moves called.", 4)
+
+        moves = {}
+        own = self.occupancy[COLOR_CODES[color]]
+        while own:
+            bit = own & -own
+            tile = SQUARE_TILES[bit.bit_length() - 1]
+            moves[tile] = list(self.get_moves(tile))
+            own ^= bit
+
+        return moves
+
+    def get_attacks(self, pos):
+        """
+        The method to get attacked tiles by a single particular piece.
+        """
+
+        row, col = pos
+        return mask_to_tiles(self.attack_mask_from(row * 8 + col, self.grid[row][col]))
+
+    def get_all_attacks(self, color):
+        """
+        The method to get all the attacked tiles by the given player.
+        """
+
+        return mask_to_tiles(self.attack_mask(color))
+
+    def king_position(self, color):
+        """
+        Method that returns the king's position in the given color
+        """
+
+        king = self.pieces[COLOR_CODES[color]][KING]
+        if king:
+            return SQUARE_TILES[king.bit_length() - 1]
+
+    def king_under_attack(self, color):
+        """
+        Method that returns if the king in the given color is under attack.
+        """
+
+        color = COLOR_CODES[color]
+        king = self.pieces[color][KING]
+        return bool(king) and self._is_attacked(king.bit_length() - 1, 1 - color)
+
+    def get_all_legal_moves(self, color):
+        """
+        Returns the legal moves of a player, {from_tile: [to_tile, ...]}.
+        """
+
+        if self.legal_generator != "direct":
+            return Board.get_all_legal_moves(self, color)
+
+        legal_moves = defaultdict(list)
+        for from_tile, to_tile, promote in self.generate_legal_moves(color):
+            # Promotions are listed once.
+            if promote in (None, "queen"):
+                legal_moves[from_tile].append(to_tile)
+
+        return legal_moves
+
+    def get_legal_move_list(self, color):
+
+        if self.legal_generator != "direct":
+            return Board.get_legal_move_list(self, color)
+
+        return self.generate_legal_moves(color)
+
+    def generate_legal_moves(self, color, captures=True, quiets=True):
+        """
+        Returns the legal moves of a player as (from_tile, to_tile, promote)
+        tuples, without trying the moves. The checking pieces and the pinned
+        pieces are found once, then the pieces other than the king may only
+        move to tiles stopping the check, and pinned pieces only along
+        their pin. The king may only move to tiles the opponent does not attack.
+
+        The captures, promotions included, and the quiet moves can be
+        generated separately, for searching the captures first.
+        """
+
+        us = COLOR_CODES[color]
+        them = 1 - us
+        pieces = self.pieces[us]
+        enemy = self.pieces[them]
+        own = self.occupancy[us]
+        occupied = self.occupied
+        grid = self.grid
+
+        moves = []
+
+        king = pieces[KING]
+        if not king:
+            return moves
+        king_sq = king.bit_length() - 1
+
+        # Tiles the king can not go to. The king is taken out of the occupied tiles,
+        # so that it can not step back along the ray of a slider checking it.
+        attacked = self._attack_mask(them, occupied ^ king)
+
+        # Checkers are found looking outwards from the king. The tiles that stop
+        # a check are the checker and the tiles between it and the king.
+        checkers = (PAWN_ATTACKS[us][king_sq] & enemy[PAWN]) | (KNIGHT_ATTACKS[king_sq] & enemy[KNIGHT])
+        check_mask = checkers
+
+        # {square of the pinned piece: tiles it can move to}
+        pins = {}
+
+        for rays, sliders in ((BISHOP_RAYS, enemy[BISHOP] | enemy[QUEEN]),
+                              (ROOK_RAYS, enemy[ROOK] | enemy[QUEEN])):
+            if not sliders:
+                continue
+
+            for table, increasing in rays:
+                blockers = table[king_sq] & occupied
+                if not blockers:
+                    continue
+
+                first = _nearest(blockers, increasing)
+                if sliders >> first & 1:
+                    checkers |= 1 << first
+                    check_mask |= table[king_sq] ^ table[first]
+
+                elif own >> first & 1:
+                    blockers ^= 1 << first
+                    if blockers:
+                        second = _nearest(blockers, increasing)
+                        if sliders >> second & 1:
+                            pins[first] = table[king_sq] ^ table[second]
+
+        check_count = bin(checkers).count("1")
+
+        opponents = self.occupancy[them]
+
+        # Tiles the moves may go to, for the stages asked for.
+        destinations = (opponents if captures else 0) | (~occupied if quiets else 0)
+
+        # King moves.
+        king_tile = SQUARE_TILES[king_sq]
+        targets = KING_ATTACKS[king_sq] & destinations & ~attacked
+        while targets:
+            bit = targets & -targets
+            moves.append((king_tile, SQUARE_TILES[bit.bit_length() - 1], None))
+            targets ^= bit
+
+        # Only the king can move out of a double check.
+        if check_count > 1:
+            return moves
+
+        # Castling, the king can not be in check, pass or land on an attacked tile.
+        king_piece = grid[king_tile[0]][king_tile[1]]
+        if quiets and not check_count and king_piece.last_move is None:
+            row = king_tile[0]
+            for rook_col, passed_cols, empty_cols in CASTLING.values():
+                rook = grid[row][rook_col]
+                if not rook or rook.last_move is not None:
+                    continue
+                if any(occupied >> (row * 8 + c) & 1 for c in empty_cols):
+                    continue
+                if any(attacked >> (row * 8 + c) & 1 for c in passed_cols):
+                    continue
+                moves.append((king_tile, (row, passed_cols[1]), None))
+
+        # The other pieces may only capture or block a checker.
+        allowed = check_mask if check_count else ~own
+
+        step = 16 * us - 8
+        start_row = 1 if us else 6
+        last_row = 7 if us else 0
+        last_rank = 0xFF << (8 * last_row)
+
+        others = own ^ king
+        while others:
+            bit = others & -others
+            others ^= bit
+            sq = bit.bit_length() - 1
+            from_tile = SQUARE_TILES[sq]
+            piece = grid[from_tile[0]][from_tile[1]]
+
+            if piece.kind_code == PAWN:
+                targets = PAWN_ATTACKS[us][sq] & opponents
+                if not occupied >> (sq + step) & 1:
+                    targets |= 1 << (sq + step)
+                    if from_tile[0] == start_row and not occupied >> (sq + 2 * step) & 1:
+                        targets |= 1 << (sq + 2 * step)
+
+                # Pushes to the last rank are promotions, not quiet moves.
+                if not captures:
+                    targets &= ~opponents & ~last_rank
+                elif not quiets:
+                    targets &= opponents | last_rank
+            else:
+                targets = self.attack_mask_from(sq, piece) & destinations
+
+            targets &= allowed
+            if sq in pins:
+                targets &= pins[sq]
+
+            while targets:
+                target = targets & -targets
+                to_tile = SQUARE_TILES[target.bit_length() - 1]
+                if piece.kind_code == PAWN and to_tile[0] == last_row:
+                    for kind in PROMOTION_KINDS:
+                        moves.append((from_tile, to_tile, kind))
+                else:
+                    moves.append((from_tile, to_tile, None))
+                targets ^= target
+
+        # En passant, checked by taking both pawns off the board and looking for
+        # a slider attacking the king. This also finds the pawns pinned along
+        # the row of the king, which the pins above miss as two pieces leave it.
+        if captures and self.en_passant_square and us == COLOR_CODES[self.turn]:
+            ep_row, ep_col = self.en_passant_square
+            ep_sq = ep_row * 8 + ep_col
+            captured_sq = ep_sq - step
+
+            capturers = PAWN_ATTACKS[them][ep_sq] & pieces[PAWN]
+            while capturers:
+                bit = capturers & -capturers
+                capturers ^= bit
+
+                after = occupied ^ bit ^ (1 << captured_sq) ^ (1 << ep_sq)
+                if sliding_attacks(king_sq, after, BISHOP_RAYS) & (enemy[BISHOP] | enemy[QUEEN]):
+                    continue
+                if sliding_attacks(king_sq, after, ROOK_RAYS) & (enemy[ROOK] | enemy[QUEEN]):
+                    continue
+                # Any other checker must be the captured pawn.
+                if (checkers & ~(1 << captured_sq)) & (enemy[PAWN] | enemy[KNIGHT]):
+                    continue
+
+                moves.append((SQUARE_TILES[bit.bit_length() - 1], (ep_row, ep_col), None))
+
+        return moves
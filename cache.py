@@ -0,0 +1,158 @@
+"""
+The module with the persistent analysis cache.
+
+Results of engine searches are kept in an SQLite database keyed by the
+Zobrist key of the position (Board.zobrist_key) and the engine, so they
+survive between runs and are shared by every process that opens the same
+file. The depths of different engines do not compare, so the results of
+an engine are only given back for the same engine. The database is in
+WAL mode, readers do not block each other or the writer.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+# Seconds of recency a ply of search depth is worth when choosing the
+# entries to evict. A deep result stays longer than a recent shallow one.
+DEPTH_WEIGHT = 3600
+
+# Puts between the checks of the size limit.
+EVICTION_INTERVAL = 1000
+
+# Version of the table layout, older tables are dropped.
+SCHEMA_VERSION = 1
+
+
+def _to_signed(key):
+    """
+    SQLite integers are signed 64-bit, Zobrist keys are unsigned.
+    """
+
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+class AnalysisCache(object):
+    """
+    On-disk cache of the deepest known analysis of positions.
+    Entries are dictionaries like the info of the engines:
+    {"depth": 20, "score": {"cp": 31}, "pv": [...], "bestmove": "e2e4"}
+    """
+
+    def __init__(self, path, max_entries=1000000):
+
+        self.max_entries = max_entries
+
+        # Connections are not shared by threads without a lock.
+        self._lock = threading.Lock()
+        self._puts = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        # Waits up to 30 seconds for another process writing to the database.
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        # The entries of the older layout have no engine, they are dropped.
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS analysis")
+            self.connection.execute("PRAGMA user_version = {0}".format(SCHEMA_VERSION))
+
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS analysis (
+                key INTEGER NOT NULL,
+                engine TEXT NOT NULL,
+                depth INTEGER NOT NULL,
+                score TEXT,
+                bestmove TEXT,
+                pv TEXT,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (key, engine)
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS analysis_eviction ON analysis (last_access)")
+
+    def get(self, key, min_depth=0, engine=""):
+        """
+        Returns the cached analysis of the position by the engine, or None
+        if there is none at least min_depth deep.
+        """
+
+        key = _to_signed(key)
+
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT depth, score, bestmove, pv FROM analysis WHERE key = ? AND engine = ? AND depth >= ?",
+                (key, engine, min_depth)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.connection.execute("UPDATE analysis SET last_access = ? WHERE key = ? AND engine = ?",
+                                    (time.time(), key, engine))
+
+        depth, score, bestmove, pv = row
+        return {
+            "depth": depth,
+            "score": json.loads(score) if score else None,
+            "bestmove": bestmove,
+            "pv": json.loads(pv) if pv else []
+        }
+
+    def put(self, key, info, engine=""):
+        """
+        Stores an analysis of the position by the engine if it is deeper than
+        the cached one of the engine, or as deep and the cached score is only
+        a bound. Returns if it is stored.
+        """
+
+        score = info.get("score")
+        pv = info.get("pv", [])
+        bestmove = info.get("bestmove") or (pv[0] if pv else None)
+        exact = not (score and "bound" in score)
+
+        with self._lock:
+            cursor = self.connection.execute("""
+                INSERT INTO analysis (key, engine, depth, score, bestmove, pv, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key, engine) DO UPDATE SET
+                    depth = excluded.depth, score = excluded.score, bestmove = excluded.bestmove,
+                    pv = excluded.pv, last_access = excluded.last_access
+                WHERE excluded.depth > analysis.depth OR
+                      (excluded.depth = analysis.depth AND ? AND analysis.score LIKE '%bound%')""",
+                (_to_signed(key), engine, info["depth"], json.dumps(score) if score else None, bestmove,
+                 json.dumps(pv), time.time(), exact))
+            stored = cursor.rowcount > 0
+
+            self._puts += 1
+            if self._puts % EVICTION_INTERVAL == 0:
+                self._evict()
+
+        return stored
+
+    def _evict(self):
+        """
+        Removes entries down to 90% of max_entries when the limit is exceeded,
+        the least recently used and shallowest ones first.
+        """
+
+        count = self.connection.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+        if count <= self.max_entries:
+            return
+
+        self.connection.execute("""
+            DELETE FROM analysis WHERE rowid IN (
+                SELECT rowid FROM analysis ORDER BY last_access + depth * ? LIMIT ?
+            )""", (DEPTH_WEIGHT, count - int(self.max_entries * 0.9)))
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
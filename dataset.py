@@ -0,0 +1,226 @@
+"""
+The module extracting position datasets from PGN archives.
+
+The games are split in the main process and replayed by a pool of worker
+processes, in batches. Every position of a game is written as a line of
+tab separated fields, the FEN, the move played in UCI notation and the
+result of the game:
+
+    rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1	e2e4	1-0
+
+The lines are written to numbered shard files in the output directory.
+In the ordered mode the shards have the games in the order of the archive,
+and the same archive always gives the same shards. In the unordered mode the
+batches are written as soon as they are replayed, which keeps every worker busy.
+Run as a script, for example:
+
+    python dataset.py games.pgn.bz2 positions/ --workers 8 --shard-size 1000000
+"""
+
+import argparse
+import collections
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+import bitboard
+import pgn
+from internals import Board
+
+
+def extract_positions(game):
+    """
+    Returns the dataset lines of the positions of a game,
+    raises ValueError if a move is illegal.
+    """
+
+    lines = []
+    for board, move in game.replay(bitboard.BitBoard):
+        lines.append("{0}\t{1}\t{2}\n".format(board.to_fen(), Board.move_to_uci(*move), game.result))
+    return lines
+
+
+def extract_batch(batch):
+    """
+    Replays a batch of games split by pgn.split_games, in a worker process.
+    Returns (batch_index, lines, games, skipped), malformed games are skipped.
+    """
+
+    batch_index, games = batch
+
+    lines = []
+    replayed = skipped = 0
+
+    for line_number, header_lines, movetext in games:
+        try:
+            lines.extend(extract_positions(pgn.parse_game(line_number, header_lines, movetext)))
+        except ValueError:
+            skipped += 1
+            continue
+        replayed += 1
+
+    return batch_index, lines, replayed, skipped
+
+
+class ShardWriter(object):
+    """
+    Writes lines to the shard files of a directory, a new shard
+    is started after every shard_size lines.
+    """
+
+    def __init__(self, directory, shard_size, prefix="positions"):
+
+        self.directory = directory
+        self.shard_size = shard_size
+        self.prefix = prefix
+
+        self.shards = 0
+        self.lines = 0
+
+        self._file = None
+        self._shard_lines = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, lines):
+
+        while lines:
+            if self._file is None or self._shard_lines >= self.shard_size:
+                self._next_shard()
+
+            count = min(len(lines), self.shard_size - self._shard_lines)
+            self._file.writelines(lines[:count])
+            self._shard_lines += count
+            self.lines += count
+            lines = lines[count:]
+
+    def _next_shard(self):
+
+        if self._file:
+            self._file.close()
+
+        path = os.path.join(self.directory, "{0}-{1:05d}.tsv".format(self.prefix, self.shards))
+        self._file = open(path, "w")
+        self._shard_lines = 0
+        self.shards += 1
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def open_input(path):
+    """
+    Opens the PGN input, "-" is the standard input.
+    """
+
+    if path == "-":
+        return open(sys.stdin.fileno(), encoding="utf-8", errors="replace", closefd=False)
+    return pgn.open_pgn(path)
+
+
+def _batches(stream, batch_size):
+    """
+    Yields (batch_index, games) batches of a PGN stream.
+    """
+
+    games = []
+    batch_index = 0
+
+    for game in pgn.split_games(stream):
+        games.append(game)
+        if len(games) == batch_size:
+            yield batch_index, games
+            batch_index += 1
+            games = []
+
+    if games:
+        yield batch_index, games
+
+
+def _extract_batches(pool, batches, window, ordered):
+    """
+    Yields the extract_batch results of the batches. The batches are
+    submitted from this thread, at most window of them ahead of the results,
+    so that the stream is not read further ahead of the workers. An error of
+    a worker is raised here, and nothing is left waiting when the pool is
+    terminated.
+    """
+
+    pending = collections.deque()
+    finished = queue.Queue()
+
+    def next_result():
+        if ordered:
+            return pending.popleft().get()
+
+        pending.popleft()
+        result = finished.get()
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    for batch in batches:
+        if ordered:
+            pending.append(pool.apply_async(extract_batch, (batch,)))
+        else:
+            pending.append(pool.apply_async(extract_batch, (batch,),
+                                            callback=finished.put, error_callback=finished.put))
+        if len(pending) >= window:
+            yield next_result()
+
+    while pending:
+        yield next_result()
+
+
+def extract_file(input_path, output_directory, workers, batch_size=100, shard_size=1000000, ordered=True):
+    """
+    Extracts the positions of the games of a PGN file to shards in the
+    output directory, printing the progress to stderr.
+    """
+
+    writer = ShardWriter(output_directory, shard_size)
+    games = skipped = 0
+    start = time.perf_counter()
+    last_report = start
+
+    with open_input(input_path) as stream, multiprocessing.Pool(workers) as pool:
+        # Batches read ahead of the workers, a few for each of them.
+        results = _extract_batches(pool, _batches(stream, batch_size), 4 * workers, ordered)
+
+        try:
+            for batch_index, lines, replayed, batch_skipped in results:
+                writer.write(lines)
+                games += replayed
+                skipped += batch_skipped
+
+                now = time.perf_counter()
+                if now - last_report >= 10:
+                    last_report = now
+                    print("{0} games, {1} positions, {2:.1f} games/s, {3:.0f} positions/s".format(
+                        games, writer.lines, games / (now - start), writer.lines / (now - start)), file=sys.stderr)
+        finally:
+            writer.close()
+
+    elapsed = time.perf_counter() - start
+    print("Extracted {0} positions of {1} games to {2} shards in {3:.1f} s".format(
+        writer.lines, games, writer.shards, elapsed), file=sys.stderr)
+    print("{0:.1f} games/s, {1:.0f} positions/s, skipped {2} malformed games".format(
+        games / elapsed, writer.lines / elapsed, skipped), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extracts position datasets from PGN archives.")
+    parser.add_argument("pgn", help="PGN file, may be compressed with gzip, bzip2 or xz. - for stdin.")
+    parser.add_argument("output", help="Directory of the shard files.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes.")
+    parser.add_argument("--batch-size", type=int, default=100, help="Games sent to a worker at once.")
+    parser.add_argument("--shard-size", type=int, default=1000000, help="Positions in a shard file.")
+    parser.add_argument("--unordered", action="store_true",
+                        help="Write the batches as they complete, not in the order of the archive.")
+    args = parser.parse_args()
+
+    extract_file(args.pgn, args.output, args.workers, args.batch_size, args.shard_size, not args.unordered)
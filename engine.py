@@ -1,110 +1,222 @@
+import asyncio
 import subprocess
 import threading
 import queue
 import time
 import os
 
+ENGINE_PATH = "octochess-windows-generic-r5190.exe"
+
+# Seconds to wait for the answers of uci and isready.
+HANDSHAKE_TIMEOUT = 30
+
+# Seconds between the checks that the engine is still alive,
+# while waiting for a search without a time limit.
+POLL_INTERVAL = 1.0
+
+
+class EngineError(Exception):
+    """
+    Raised when the engine does not answer in time or its process is dead.
+    """
+
+
+def parse_info_string(string):
+    """
+    Parses a UCI info line into a dictionary, e.g.
+    {"depth": 10, "score": {"cp": 35}, "pv": ["e2e4", "e7e5"]}
+    """
+
+    splitted = string.split()[1:]
+    parsed = {}
+
+    # Free text from the engine, e.g. "info string NNUE enabled".
+    if splitted and splitted[0] == "string":
+        parsed["string"] = " ".join(splitted[1:])
+        return parsed
+
+    for ind, word in enumerate(splitted):
+        if word.isalpha():
+            if word == "score":
+                parsed[word] = {}
+            elif word == "cp":
+                parsed["score"][word] = int(splitted[ind + 1])
+            elif word == "lowerbound" or word == "upperbound":
+                parsed["score"]["bound"] = word
+            elif word == "mate":
+                parsed["score"][word] = int(splitted[ind + 1])
+            elif word == "pv":
+                parsed[word] = splitted[ind + 1:]
+            elif word == "currmove":
+                parsed[word] = splitted[ind + 1]
+            else:
+                parsed[word] = int(splitted[ind + 1])
+    #print (parsed)
+    return parsed
+
+
 class Engine:
 
-    def __init__(self):
+    def __init__(self, path=ENGINE_PATH, debug=0, threads=None, hash_mb=4096):
 
-        self.process = subprocess.Popen("octochess-windows-generic-r5190.exe",
+        self.debug = debug
+
+        self.process = subprocess.Popen(path,
                                         stdin=subprocess.PIPE,
                                         stdout=subprocess.PIPE,
                                         universal_newlines=True)
 
         self.reader = StreamReader(self.process.stdout)
+
+        # Bytes sent to the engine, and the last position command,
+        # which is not sent again while the engine still has it.
+        self.bytes_written = 0
+        self._position_command = None
         
-        self._readline()
-        #self._isready()
         self._setuci()
-        self._write("setoption name Threads value {}".format(os.cpu_count()))
-        self._write("setoption name Hash value 4096")
+        self._write("setoption name Threads value {}".format(threads or os.cpu_count()))
+        self._write("setoption name Hash value {}".format(hash_mb))
         self._isready()
 
     def _write(self, command):
+        self.debug_output("<< " + command, 2)
         self.process.stdin.write(command + "\n")
         self.process.stdin.flush()
+        self.bytes_written += len(command) + 1
 
-    def _readline(self):
-        return self.reader.readline()
+    def _readline(self, timeout=None):
+        """
+        Blocks until the engine writes a line and returns it.
+        If timeout is None, waits as long as the engine is alive.
+        """
 
-    def _isready(self):
-        self._write("isready")
+        deadline = None if timeout is None else time.monotonic() + timeout
 
         while True:
-            response = self._readline()
-            if response == "readyok\n":
-                return True
+            wait = POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, deadline - time.monotonic())
+            if wait <= 0:
+                raise EngineError("Engine did not answer in {0} seconds.".format(timeout))
+
+            line = self.reader.readline(wait)
+            if line:
+                self.debug_output(">> " + line.rstrip(), 3)
+                return line
+
+            if self.reader.closed or self.process.poll() is not None:
+                raise EngineError("Engine process is not running.")
+
+    def _read_until(self, prefix, timeout=None):
+        """
+        Reads and discards lines until one starts with the prefix, returns it.
+        """
+
+        while True:
+            response = self._readline(timeout)
+            if response.startswith(prefix):
+                return response
+
+    def _isready(self):
+        self._write("isready")
+        self._read_until("readyok", HANDSHAKE_TIMEOUT)
+        return True
 
     def _setuci(self):
         self._write("uci")
+        self._read_until("uciok", HANDSHAKE_TIMEOUT)
+        return True
 
-        while True:
-            response = self._readline()
-            if response == "uciok\n":
-                return True
+    def debug_output(self, message, debug_level):
+        if debug_level <= self.debug:
+            print("[ENGINE] " + message)
 
     def new_game(self):
         self._write("ucinewgame")
+        self._position_command = None
 
-    def set_position(self, moves):
-        self._write("position startpos moves " + " ".join(moves))
+    def set_position(self, moves, fen=None):
+        """
+        Sets the position to the moves played from the start position,
+        or from the FEN position if one is given. Nothing is sent if
+        the engine is already in that position.
+        """
+
+        start = "fen " + fen if fen else "startpos"
+        command = "position " + start + " moves " + " ".join(moves)
+
+        if command != self._position_command:
+            self._write(command)
+            self._position_command = command
 
     def get_best_move(self, depth=""):
         self._write("go "+ str(depth))
 
+        response = self._read_until("bestmove")
+        return response.split()[1]
+
+    def analyse(self, limit=""):
+        """
+        Searches with "go <limit>" and returns the last info having a
+        principal variation, with the best move added as "bestmove".
+        """
+
+        self._write("go " + str(limit))
+        result = {}
+
         while True:
             response = self._readline()
-            if response and response.startswith("bestmove"):
-                return response.split()[1]
+            if response.startswith("info"):
+                info = parse_info_string(response)
+                if "pv" in info:
+                    result = info
+            elif response.startswith("bestmove"):
+                result["bestmove"] = response.split()[1]
+                return result
 
     def _parse_info_string(self, string):
-
-        splitted = string.split()[1:]
-        parsed = {}
-
-        for ind, word in enumerate(splitted):
-            if word.isalpha():
-                if word == "score":
-                    parsed[word] = {}
-                elif word == "cp":
-                    parsed["score"][word] = int(splitted[ind + 1])
-                elif word == "lowerbound" or word == "upperbound":
-                    parsed["score"]["bound"] = word
-                elif word == "mate":
-                    parsed["score"][word] = int(splitted[ind + 1])
-                elif word == "pv":
-                    parsed[word] = splitted[ind + 1:]
-                elif word == "currmove":
-                    parsed[word] = splitted[ind + 1]
-                else:
-                    parsed[word] = int(splitted[ind + 1])
-        #print (parsed)
-        return parsed
+        return parse_info_string(string)
 
     def start_infinite_search(self):
+        """
+        Starts a go infinite search at once, returns the generator of its info
+        dictionaries. A stop sent before the first info is not lost.
+        """
+
         self._write("go infinite")
+        return self._infinite_search_infos()
+
+    def _infinite_search_infos(self):
 
         while True:
             response = self._readline()
-            if response:
-                if response.startswith("info"):
-                    yield self._parse_info_string(response)
-                elif response.startswith("bestmove"):
-                    # Read and discard
-                    self.reader.readline()
-                    break
-                else:
-                    print("Unexpected output from engine.")
-            #time.sleep(0.2)
-            
+            if response.startswith("info"):
+                yield self._parse_info_string(response)
+            elif response.startswith("bestmove"):
+                break
+            else:
+                self.debug_output("Unexpected output from engine: " + response.rstrip(), 1)
+
     def stop_infinite_search(self):
         self._write("stop")
 
     def stop_process(self):
         self.process.terminate()
 
+    def is_alive(self, timeout=5):
+        """
+        Health check, returns if the process is running and answers isready in time.
+        """
+
+        if self.process.poll() is not None:
+            return False
+
+        try:
+            self._write("isready")
+            self._read_until("readyok", timeout)
+        except (EngineError, OSError):
+            return False
+
+        return True
+
     def print_board(self):
         self._write("d")
 
@@ -114,11 +226,282 @@ class Engine:
             if response.startswith("Checkers:"):
                 break
 
+class EnginePool:
+    """
+    A pool of warm engine processes. Games lease an engine with acquire and
+    give it back with release, the engine is reset with ucinewgame instead
+    of starting a new process. At most size processes are running, crashed
+    ones are replaced when they are found.
+    """
+
+    def __init__(self, size=2, path=ENGINE_PATH, debug=0, threads=None, hash_mb=4096):
+
+        self.size = size
+        self.debug = debug
+
+        # Arguments of the Engine processes.
+        self.engine_args = {"path": path, "debug": debug, "threads": threads, "hash_mb": hash_mb}
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+        # Number of started engines, idle or leased.
+        self._count = 0
+
+    def acquire(self, timeout=None):
+        """
+        Leases an engine, starting one if none is idle and the pool is not full.
+        Blocks for at most timeout seconds when all engines are leased.
+        """
+
+        while True:
+            try:
+                engine = self._idle.get_nowait()
+            except queue.Empty:
+                engine = None
+
+                with self._lock:
+                    start_new = self._count < self.size
+                    if start_new:
+                        self._count += 1
+
+                if start_new:
+                    try:
+                        return Engine(**self.engine_args)
+                    except Exception:
+                        with self._lock:
+                            self._count -= 1
+                        raise
+
+                try:
+                    engine = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise EngineError("No engine is released in {0} seconds.".format(timeout))
+
+            if engine.is_alive():
+                return engine
+
+            # The engine crashed while idle, it is replaced on the next round.
+            self.debug_output("Replacing a dead engine.", 1)
+            self._discard(engine)
+
+    def release(self, engine):
+        """
+        Gives a leased engine back, after stopping any search and resetting it.
+        The engine must not be used by the game after this.
+        """
+
+        try:
+            engine.stop_infinite_search()
+            engine.new_game()
+            alive = engine.is_alive()
+        except (EngineError, OSError):
+            alive = False
+
+        # The pool may be closed or shrunk while the engine was leased.
+        if alive and self._count <= self.size:
+            self._idle.put(engine)
+        else:
+            self._discard(engine)
+
+    def check_health(self):
+        """
+        Checks the idle engines, dead ones are removed so that
+        they are restarted when needed. Returns the number removed.
+        """
+
+        removed = 0
+        engines = []
+        while True:
+            try:
+                engines.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+        for engine in engines:
+            if engine.is_alive():
+                self._idle.put(engine)
+            else:
+                self._discard(engine)
+                removed += 1
+
+        return removed
+
+    def close(self):
+        """
+        Stops the idle engines. Leased ones are stopped when they are released.
+        """
+
+        self.size = 0
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def _discard(self, engine):
+        try:
+            engine.stop_process()
+        except OSError:
+            pass
+
+        with self._lock:
+            self._count -= 1
+
+    def debug_output(self, message, debug_level):
+        if debug_level <= self.debug:
+            print("[ENGINE POOL] " + message)
+
+
+class AsyncEngine:
+    """
+    The UCI engine driven with asyncio instead of threads, so that one
+    event loop can run many engine processes. Create it with
+    "engine = await AsyncEngine.start(path)". A single engine handles
+    one command at a time, the caller must not interleave searches.
+    """
+
+    def __init__(self, path=ENGINE_PATH, debug=0):
+
+        self.path = path
+        self.debug = debug
+        self.process = None
+
+    @classmethod
+    async def start(cls, path=ENGINE_PATH, options=None, debug=0):
+        """
+        Starts the engine process and completes the uci handshake.
+        options are sent with setoption, they default to the ones
+        Engine uses; many engines on a host should get smaller values.
+        """
+
+        engine = cls(path, debug)
+        engine.process = await asyncio.create_subprocess_exec(path,
+                                                              stdin=asyncio.subprocess.PIPE,
+                                                              stdout=asyncio.subprocess.PIPE)
+
+        if options is None:
+            options = {"Threads": os.cpu_count(), "Hash": 4096}
+
+        engine._write("uci")
+        await engine._read_until("uciok", HANDSHAKE_TIMEOUT)
+        for name, value in options.items():
+            engine._write("setoption name {0} value {1}".format(name, value))
+        await engine.isready()
+
+        return engine
+
+    def _write(self, command):
+        self.debug_output("<< " + command, 2)
+        self.process.stdin.write((command + "\n").encode())
+
+    async def _readline(self, timeout=None):
+        """
+        Waits for the next non-empty line of the engine, at most timeout seconds.
+        """
+
+        while True:
+            await self.process.stdin.drain()
+            try:
+                line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
+            except asyncio.TimeoutError:
+                raise EngineError("Engine did not answer in {0} seconds.".format(timeout))
+
+            if not line:
+                raise EngineError("Engine process is not running.")
+
+            line = line.decode()
+            if line.strip():
+                self.debug_output(">> " + line.rstrip(), 3)
+                return line
+
+    async def _read_until(self, prefix, timeout=None):
+        """
+        Reads and discards lines until one starts with the prefix, returns it.
+        """
+
+        while True:
+            response = await self._readline(timeout)
+            if response.startswith(prefix):
+                return response
+
+    async def isready(self):
+        self._write("isready")
+        await self._read_until("readyok", HANDSHAKE_TIMEOUT)
+        return True
+
+    async def new_game(self):
+        self._write("ucinewgame")
+        await self.isready()
+
+    async def set_position(self, moves, fen=None):
+        start = "fen " + fen if fen else "startpos"
+        self._write("position " + start + " moves " + " ".join(moves))
+        await self.process.stdin.drain()
+
+    async def get_best_move(self, depth=""):
+        self._write("go " + str(depth))
+
+        response = await self._read_until("bestmove")
+        return response.split()[1]
+
+    async def start_infinite_search(self):
+        """
+        Async iterator over the info dictionaries of a go infinite search.
+        It ends after stop_infinite_search is called. If the iteration is
+        left early or the task is cancelled, the search is stopped and the
+        output is read up to bestmove, so the engine is ready for the next
+        command. To leave early with break, iterate inside
+        "async with contextlib.aclosing(engine.start_infinite_search()) as infos",
+        otherwise the generator is only closed when it is garbage collected.
+        """
+
+        self._write("go infinite")
+        finished = False
+
+        try:
+            while True:
+                response = await self._readline()
+                if response.startswith("info"):
+                    yield parse_info_string(response)
+                elif response.startswith("bestmove"):
+                    finished = True
+                    break
+        finally:
+            if not finished and self.process.returncode is None:
+                self._write("stop")
+                await self._read_until("bestmove", HANDSHAKE_TIMEOUT)
+
+    def stop_infinite_search(self):
+        self._write("stop")
+
+    async def stop_process(self):
+        """
+        Asks the engine to quit and waits for it, terminating it if it does not.
+        """
+
+        if self.process.returncode is not None:
+            return
+
+        self._write("quit")
+        try:
+            await self.process.stdin.drain()
+            await asyncio.wait_for(self.process.wait(), HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionResetError, BrokenPipeError):
+            self.process.terminate()
+            await self.process.wait()
+
+    def debug_output(self, message, debug_level):
+        if debug_level <= self.debug:
+            print("[ENGINE] " + message)
+
+
 class StreamReader:
     """
     A class that reads a stream. This is implemented because of the need
-    of a non-blocking stream reader, which does not exist in subprocess
+    of reading with a timeout, which does not exist in subprocess
     module and hard to achieve using other Python modules with Windows.
+    A thread reads the lines into a queue, readers block on the queue.
     """
 
     def __init__(self, stream):
@@ -126,6 +509,9 @@ class StreamReader:
         self._stream = stream
         self._queue = queue.Queue()
 
+        # Set after the end of the stream is read.
+        self.closed = False
+
         self._thread = threading.Thread(target=self._fill_queue)
         self._thread.daemon = True
         self._thread.start()
@@ -134,17 +520,28 @@ class StreamReader:
 
         while True:
             line = self._stream.readline()
+
+            # An empty string is the end of the stream, the process exited.
+            if not line:
+                self.closed = True
+                self._queue.put(None)
+                return
+
             if line.strip():
                 self._queue.put(line)
 
     def readline(self, timeout = None):
+        """
+        Blocks until a line is read and returns it. Returns None if the
+        timeout, in seconds, passes first, or the stream is closed.
+        timeout=None waits without a limit.
+        """
+
+        if self.closed and self._queue.empty():
+            return None
 
         try:
-            a = self._queue.get(block = timeout is not None, timeout = timeout)
-            if a:
-                pass
-                print(a.strip())
-            return a
+            return self._queue.get(timeout = timeout)
         except queue.Empty:
             return None
 
@@ -0,0 +1,142 @@
+"""
+The module with the static evaluation of positions.
+
+The material and piece-square part of the score is kept up to date by the
+board on every move (Board.psqt_score), and so are the pawn counts of the
+files used for the pawn structure. Evaluating a position only adds the two.
+
+Packed positions (Board.pack) are scored without building boards, many of
+them at once with NumPy if it is installed.
+"""
+
+from internals import PACKED_POSITION, PAWN, PSQT
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Penalties of the pawn structure, per pawn.
+DOUBLED_PAWN = 15
+ISOLATED_PAWN = 15
+
+RECORD_SIZE = PACKED_POSITION.size
+
+
+def pawn_structure(files):
+    """
+    Returns the pawn structure score of a player from the number
+    of their pawns on each file, doubled and isolated pawns are penalized.
+    """
+
+    score = 0
+    for col, count in enumerate(files):
+        if count:
+            if count > 1:
+                score -= DOUBLED_PAWN * (count - 1)
+            if (col == 0 or not files[col - 1]) and (col == 7 or not files[col + 1]):
+                score -= ISOLATED_PAWN * count
+    return score
+
+
+def evaluate(board):
+    """
+    Static evaluation of the position, in centipawns from the
+    point of view of the player to move.
+    """
+
+    score = board.psqt_score + pawn_structure(board.pawn_files[0]) - pawn_structure(board.pawn_files[1])
+    return score if board.turn == "white" else -score
+
+
+def evaluate_packed(data):
+    """
+    Evaluates a single packed position, same as evaluate on its board.
+    """
+
+    occupied, pieces, flags = PACKED_POSITION.unpack(data)[:3]
+
+    score = 0
+    files = [[0] * 8, [0] * 8]
+    index = 0
+
+    while occupied:
+        bit = occupied & -occupied
+        sq = bit.bit_length() - 1
+        occupied ^= bit
+
+        code = (pieces[index >> 1] >> (4 * (index & 1))) & 15
+        index += 1
+
+        color, kind = divmod(code, 6)
+        score += PSQT[color][kind][sq]
+        if kind == PAWN:
+            files[color][sq & 7] += 1
+
+    score += pawn_structure(files[0]) - pawn_structure(files[1])
+    return -score if flags & 1 else score
+
+
+def _batch_tables():
+    """
+    PSQT as a (13, 64) array by the piece code of the packed positions,
+    the last row is for the empty tiles.
+    """
+
+    table = numpy.zeros((13, 64), dtype=numpy.int32)
+    for code in range(12):
+        table[code] = PSQT[code // 6][code % 6]
+    return table
+
+
+BATCH_TABLE = _batch_tables() if numpy else None
+
+
+def _batch_pawn_structure(pawns):
+    """
+    pawn_structure of an (n, 64) boolean array of pawns.
+    """
+
+    files = pawns.reshape(-1, 8, 8).sum(axis=1)
+
+    doubled = numpy.maximum(files - 1, 0).sum(axis=1)
+
+    padded = numpy.pad(files, ((0, 0), (1, 1)))
+    neighbours = (padded[:, :-2] + padded[:, 2:]) > 0
+    isolated = (files * ~neighbours).sum(axis=1)
+
+    return -DOUBLED_PAWN * doubled - ISOLATED_PAWN * isolated
+
+
+def evaluate_batch(data):
+    """
+    Evaluates the packed positions of a buffer (e.g. PositionArray.data),
+    returns the scores in the order of the positions. With NumPy all the
+    positions are decoded and scored in a few array operations, without
+    it they are evaluated one by one.
+    """
+
+    if numpy is None:
+        return [evaluate_packed(data[start:start + RECORD_SIZE]) for start in range(0, len(data), RECORD_SIZE)]
+
+    records = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, RECORD_SIZE)
+    count = len(records)
+
+    # The occupancy is little endian, bit n of the integer is tile n.
+    occupied = numpy.unpackbits(records[:, :8], axis=1, bitorder="little")
+
+    nibbles = numpy.empty((count, 32), dtype=numpy.uint8)
+    nibbles[:, 0::2] = records[:, 8:24] & 15
+    nibbles[:, 1::2] = records[:, 8:24] >> 4
+
+    # The n-th occupied tile has the n-th piece code. The cumulative sum
+    # is done in bytes, it is much slower on booleans.
+    index = numpy.cumsum(occupied, axis=1, dtype=numpy.uint8)
+    index = numpy.clip(index.astype(numpy.int16) - 1, 0, 31)
+    codes = numpy.where(occupied, numpy.take_along_axis(nibbles, index, axis=1), 12)
+
+    scores = BATCH_TABLE[codes, numpy.arange(64)].sum(axis=1)
+    scores += _batch_pawn_structure(codes == PAWN) - _batch_pawn_structure(codes == PAWN + 6)
+
+    black_to_move = (records[:, 24] & 1).astype(bool)
+    return numpy.where(black_to_move, -scores, scores)
@@ -3,6 +3,9 @@ import pygame
 # from pygame.locals import *
 from pygame import gfxdraw
 from button import Button
+import bitbase
+import book
+import engine
 import internals
 
 WHITE = (255, 255, 255)
@@ -26,7 +29,7 @@ class Gui(object):
     Main game class, where the main game function exists and includes other game functionalities.
     """
 
-    def __init__(self):
+    def __init__(self, engine_type="uci", book_path=None, bitbase_path=None):
         pygame.init()
         self.search_font = pygame.font.SysFont("monospace", 36)
         self.clock = pygame.time.Clock()
@@ -39,6 +42,16 @@ class Gui(object):
         self.program_state = "menu"
         self.analyzing = False
         self.game = None
+
+        # The engine used by the games, "uci", "native" or "parallel" (see internals.Game).
+        self.engine_type = engine_type
+
+        # The uci engine is kept running between games, one game is played at a time.
+        self.engine_pool = engine.EnginePool(1) if engine_type == "uci" else None
+
+        # The opening book of the games against the engine, optional.
+        self.book = book.OpeningBook(book_path) if book_path else None
+        self.bitbases = bitbase.Bitbases(bitbase_path) if bitbase_path else None
         # Define all buttons that are going to be used
         # Inside the program, using a dictionary.
         # Format {
@@ -71,9 +84,7 @@ class Gui(object):
             for event in pygame.event.get():
 
                 if event.type == pygame.QUIT:
-                    if self.game: self.game.game_exit()
-                    pygame.quit()
-                    sys.exit()
+                    self.quit()
 
                 # event button 1 is the left mouse button.
                 if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
@@ -83,16 +94,29 @@ class Gui(object):
             self.draw_gui()
 
     def test_game(self):
-        self.game = internals.Game(0, "test")
+        self.end_game()
+        self.game = internals.Game(0, "test", self.engine_type, self.engine_pool)
         self.program_state = "game"
 
     def new_game_ai(self):
 
-        self.game = internals.Game(0, "ai")
+        self.end_game()
+        self.game = internals.Game(0, "ai", self.engine_type, self.engine_pool, book=self.book, bitbases=self.bitbases)
         self.program_state = "game"
 
-    @staticmethod
-    def quit():
+    def end_game(self):
+        """
+        Gives the engine of the current game back to the pool.
+        """
+
+        if self.game:
+            self.game.game_exit()
+            self.game = None
+
+    def quit(self):
+        self.end_game()
+        if self.engine_pool:
+            self.engine_pool.close()
         pygame.quit()  # quits pygame
         sys.exit()
 
@@ -239,5 +263,11 @@ class Gui(object):
 
 
 if __name__ == "__main__":
-    G = Gui()
+    book_path = sys.argv[sys.argv.index("--book") + 1] if "--book" in sys.argv else None
+    bitbase_path = sys.argv[sys.argv.index("--bitbases") + 1] if "--bitbases" in sys.argv else None
+
+    if "--parallel" in sys.argv:
+        G = Gui("parallel", book_path, bitbase_path)
+    else:
+        G = Gui("native" if "--native" in sys.argv else "uci", book_path, bitbase_path)
     G.main()
@@ -1,33 +1,261 @@
-import copy
 from collections import defaultdict
 import engine
+import random
+import struct
 import threading
 
+# The kinds a pawn can be promoted to, in the order moves are generated.
+PROMOTION_KINDS = ("queen", "rook", "bishop", "knight")
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Integer codes of the colors and the kinds of the pieces. Pieces keep
+# the codes, move generation compares and indexes tables with them.
+WHITE, BLACK = 0, 1
+KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN = range(6)
+
+# Names of the codes, and codes of the names.
+COLORS = ("white", "black")
+KINDS = ("king", "queen", "rook", "bishop", "knight", "pawn")
+COLOR_CODES = {"white": WHITE, "black": BLACK}
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+# Directions of the pieces in (row, col) form, and how far they go, by kind code.
+# Each direction (y, x):
+#  y = -1 means piece goes up, y = 1 means piece goes down, y = 0 means row is constant.
+#  x = -1 means piece goes left, x = 1 means piece goes right, x = 0 means col is constant.
+BISHOP_MOVE = ((-1, -1), (-1, 1), (1, 1), (1, -1))
+ROOK_MOVE = ((-1, 0), (0, 1), (1, 0), (0, -1))
+QUEEN_MOVE = BISHOP_MOVE + ROOK_MOVE
+KNIGHT_MOVE = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2))
+
+PIECE_DIRECTIONS = (QUEEN_MOVE, QUEEN_MOVE, ROOK_MOVE, BISHOP_MOVE, KNIGHT_MOVE, None)
+PIECE_DISTANCES = (1, 7, 7, 7, 1, None)
+
+# Row step of the pawns and the row they start on, by color code.
+PAWN_STEPS = (-1, 1)
+PAWN_START_ROWS = (6, 1)
+
+
+def _jump_tiles(jumps):
+    """
+    Precomputes the tiles a non sliding piece attacks from every tile, [row][col].
+    """
+
+    return [[frozenset((row + x, col + y) for x, y in jumps if 0 <= row + x <= 7 and 0 <= col + y <= 7)
+             for col in range(8)] for row in range(8)]
+
+
+# Attacked tiles of the pieces that do not slide, by tile.
+# Pawn attacks are indexed by color code first.
+KNIGHT_TILES = _jump_tiles(KNIGHT_MOVE)
+KING_TILES = _jump_tiles(QUEEN_MOVE)
+PAWN_TILES = (_jump_tiles(((-1, -1), (-1, 1))), _jump_tiles(((1, -1), (1, 1))))
+
+
+# FEN letters of the pieces, indexed by kind_code + 6 * color_code.
+PIECE_LETTERS = "KQRBNPkqrbnp"
+
+# (color, kind) of the piece letters of FEN.
+FEN_PIECES = {
+    "K": ("white", "king"), "Q": ("white", "queen"), "R": ("white", "rook"),
+    "B": ("white", "bishop"), "N": ("white", "knight"), "P": ("white", "pawn"),
+    "k": ("black", "king"), "q": ("black", "queen"), "r": ("black", "rook"),
+    "b": ("black", "bishop"), "n": ("black", "knight"), "p": ("black", "pawn")
+}
+
+# The fixed size binary encoding of a position, see Board.pack.
+# (occupied tiles, piece codes, flags, en passant file, halfmove clock, fullmove number)
+PACKED_POSITION = struct.Struct("<Q16sBBBH3x")
+
+
+# Piece values in centipawns, by kind code. The king is never captured.
+MATERIAL = (0, 900, 500, 330, 320, 100)
+
+# Bonuses of the pieces on each tile for white, by kind code, in grid order
+# (a8 first). Black uses the table with the rows mirrored.
+PIECE_SQUARE = (
+    # King, stays behind the pawns until the endgame.
+    (-30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -20, -30, -30, -40, -40, -30, -30, -20,
+     -10, -20, -20, -20, -20, -20, -20, -10,
+     20, 20, 0, 0, 0, 0, 20, 20,
+     20, 30, 10, 0, 0, 10, 30, 20),
+    # Queen
+    (-20, -10, -10, -5, -5, -10, -10, -20,
+     -10, 0, 0, 0, 0, 0, 0, -10,
+     -10, 0, 5, 5, 5, 5, 0, -10,
+     -5, 0, 5, 5, 5, 5, 0, -5,
+     0, 0, 5, 5, 5, 5, 0, -5,
+     -10, 5, 5, 5, 5, 5, 0, -10,
+     -10, 0, 5, 0, 0, 0, 0, -10,
+     -20, -10, -10, -5, -5, -10, -10, -20),
+    # Rook, likes the seventh row and the center files.
+    (0, 0, 0, 0, 0, 0, 0, 0,
+     5, 10, 10, 10, 10, 10, 10, 5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     0, 0, 0, 5, 5, 0, 0, 0),
+    # Bishop
+    (-20, -10, -10, -10, -10, -10, -10, -20,
+     -10, 0, 0, 0, 0, 0, 0, -10,
+     -10, 0, 5, 10, 10, 5, 0, -10,
+     -10, 5, 5, 10, 10, 5, 5, -10,
+     -10, 0, 10, 10, 10, 10, 0, -10,
+     -10, 10, 10, 10, 10, 10, 10, -10,
+     -10, 5, 0, 0, 0, 0, 5, -10,
+     -20, -10, -10, -10, -10, -10, -10, -20),
+    # Knight, bad on the edges.
+    (-50, -40, -30, -30, -30, -30, -40, -50,
+     -40, -20, 0, 0, 0, 0, -20, -40,
+     -30, 0, 10, 15, 15, 10, 0, -30,
+     -30, 5, 15, 20, 20, 15, 5, -30,
+     -30, 0, 15, 20, 20, 15, 0, -30,
+     -30, 5, 10, 15, 15, 10, 5, -30,
+     -40, -20, 0, 5, 5, 0, -20, -40,
+     -50, -40, -30, -30, -30, -30, -40, -50),
+    # Pawn, pushed to the center and forward.
+    (0, 0, 0, 0, 0, 0, 0, 0,
+     50, 50, 50, 50, 50, 50, 50, 50,
+     10, 10, 20, 30, 30, 20, 10, 10,
+     5, 5, 10, 25, 25, 10, 5, 5,
+     0, 0, 0, 20, 20, 0, 0, 0,
+     5, -5, -10, 0, 0, -10, -5, 5,
+     5, 10, 10, -20, -20, 10, 10, 5,
+     0, 0, 0, 0, 0, 0, 0, 0)
+)
+
+# Material and tile bonus of every piece, from white's point of view,
+# [color_code][kind_code][square]. Kept summed in Board.psqt_score.
+PSQT = [
+    [[MATERIAL[kind] + PIECE_SQUARE[kind][sq] for sq in range(64)] for kind in range(6)],
+    [[-MATERIAL[kind] - PIECE_SQUARE[kind][sq ^ 56] for sq in range(64)] for kind in range(6)]
+]
+
+# Attack sets kept by a board before its cache is emptied.
+ATTACK_CACHE_SIZE = 256
+
+# Search depths of the AI moves of a Game, by the engine type. The
+# engine's analysis cached from a shallower search is not used for a move.
+SEARCH_DEPTHS = {"uci": 12, "native": 4, "parallel": 4}
+
+# Castling rights as bits of an integer, in FEN order (KQkq).
+# (bit, king_tile, rook_tile)
+CASTLING_RIGHTS = [
+    (1, (7, 4), (7, 7)),
+    (2, (7, 4), (7, 0)),
+    (4, (0, 4), (0, 7)),
+    (8, (0, 4), (0, 0))
+]
+
+# Random numbers of the Zobrist hashing. A fixed seed is used
+# so that the keys are the same in every run and every process.
+_zobrist_random = random.Random(20170412)
+
+# [color_code][kind_code][number of each square], a square is row * 8 + col.
+ZOBRIST_PIECES = [
+    [[_zobrist_random.getrandbits(64) for _ in range(64)] for kind in KINDS]
+    for color in COLORS
+]
+
+# Xored into the key when black is to move.
+ZOBRIST_BLACK_TURN = _zobrist_random.getrandbits(64)
+
+# Numbers of each castling rights combination, xor of the numbers of its rights.
+_zobrist_rights = [_zobrist_random.getrandbits(64) for _ in range(4)]
+ZOBRIST_CASTLING = [0] * 16
+for _rights in range(16):
+    for _i in range(4):
+        if _rights & (1 << _i):
+            ZOBRIST_CASTLING[_rights] ^= _zobrist_rights[_i]
+
+# Numbers of the file of the en passant square.
+ZOBRIST_EN_PASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]
+
 class Piece(object):
     """
     Class for the pieces in the game.
+    The color and the kind are given by name ("white", "king")
+    or by code (WHITE, KING), and kept as codes.
     """
 
+    __slots__ = ("color_code", "kind_code", "last_move")
+
     def __init__(self, color, kind):
 
         # Piece's player.
-        self.color = color
+        self.color_code = COLOR_CODES.get(color, color)
 
         # The type of the piece.
         # King, Bishop etc.
-        self.kind = kind
+        self.kind_code = KIND_CODES.get(kind, kind)
 
         # The last move of the piece
         # (from_tile, played_turn_num)
         self.last_move = None
 
+    @property
+    def color(self):
+        return COLORS[self.color_code]
+
+    @property
+    def kind(self):
+        return KINDS[self.kind_code]
+
+
+class MoveRecord(object):
+    """
+    The undo record of a move, produced by Board.make_move and
+    given back to Board.unmake_move to take the move back.
+    """
+
+    def __init__(self, from_tile, to_tile, piece, last_move, en_passant_square, zobrist_key):
+
+        self.from_tile = from_tile
+        self.to_tile = to_tile
+
+        # The moved piece and its last move before this move.
+        self.piece = piece
+        self.last_move = last_move
+
+        # The en passant square and the Zobrist key before the move.
+        self.en_passant_square = en_passant_square
+        self.zobrist_key = zobrist_key
+
+        # The captured piece and the tile it is captured on.
+        # The tile differs from to_tile for en passant.
+        self.captured = None
+        self.captured_tile = None
+
+        # (rook_from_tile, rook_to_tile) if the move is castling.
+        self.castle = None
+
+        # The new piece if the move is a promotion.
+        self.promoted = None
+
+        # The halfmove clock, the fullmove number and the player
+        # to move before the move.
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.turn = "white"
+
 
 class Board(object):
     """
     The class for the chessboard.
     """
 
-    def __init__(self, debug=0):
+    # How the legal moves are generated. Board only tries every pseudo legal
+    # move, BitBoard also has a "direct" generator.
+    legal_generator = "trial"
+
+    def __init__(self, debug=0, fen=None):
 
         self.debug = debug
         self.debug_output("Board object created with the debug level {0}.".format(self.debug), 1)
@@ -38,6 +266,32 @@ class Board(object):
         # marked square is the one behind the moved pawn.
         self.en_passant_square = None
 
+        # The player to move, switched by make_move.
+        self.turn = "white"
+
+        # Half moves since the last capture or pawn move (for the fifty move rule),
+        # and the number of the move, increased after black's move.
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+
+        # Attacked tiles of the positions seen, {(zobrist_key, color): tiles}.
+        # Every change of the pieces changes the key, so entries never go stale.
+        # The size 0 turns the cache off.
+        self.attack_cache = {}
+        self.attack_cache_size = ATTACK_CACHE_SIZE
+        self.attack_cache_hits = 0
+        self.attack_cache_misses = 0
+
+        # Material and piece-square score of the position for white (see PSQT),
+        # and the number of pawns of each color on each file, [color_code][col].
+        # Both are updated by _add_piece and _remove_piece.
+        self.psqt_score = 0
+        self.pawn_files = [[0] * 8, [0] * 8]
+
+        if fen:
+            self._load_fen(fen)
+            return
+
         # Define piece lists of each color, order is important.
         self.white_pieces = [
             Piece("white", "rook"),
@@ -76,6 +330,201 @@ class Board(object):
             self.grid[0][col] = piece
             self.grid[1][col] = self.black_pieces[col + 8]  # pawns
 
+        # Zobrist key of the position, updated by every move.
+        self.zobrist_key = self.compute_zobrist()
+        self.compute_psqt()
+
+    @classmethod
+    def from_fen(cls, fen, debug=0):
+        """
+        Creates a board from a FEN string. The halfmove clock and the
+        fullmove number may be missing, as in EPD.
+        """
+
+        return cls(debug, fen)
+
+    def _load_fen(self, fen):
+        """
+        Sets up the board from a FEN string, the board must be empty.
+        Castling rights are kept with the last_move of the pieces: every piece
+        is marked as moved except the kings and rooks that can still castle.
+        Raises ValueError if the FEN is malformed.
+        """
+
+        fields = fen.split()
+        if not 4 <= len(fields) <= 6:
+            raise ValueError("Invalid FEN, expected 4 to 6 fields: " + fen)
+
+        ranks = fields[0].split("/")
+        if len(ranks) != 8:
+            raise ValueError("Invalid FEN, expected 8 ranks: " + fen)
+
+        self.white_pieces = []
+        self.black_pieces = []
+
+        grid = self.grid
+        for row, rank in enumerate(ranks):
+            col = 0
+            for letter in rank:
+                if letter in "12345678":
+                    col += ord(letter) - 48
+                    continue
+
+                if col > 7 or letter not in FEN_PIECES:
+                    raise ValueError("Invalid FEN rank {0}: {1}".format(rank, fen))
+
+                piece = Piece(*FEN_PIECES[letter])
+                piece.last_move = (row, col)
+                grid[row][col] = piece
+
+                if piece.color_code == WHITE:
+                    self.white_pieces.append(piece)
+                else:
+                    self.black_pieces.append(piece)
+                col += 1
+
+            if col != 8:
+                raise ValueError("Invalid FEN rank {0}: {1}".format(rank, fen))
+
+        if fields[1] not in ("w", "b"):
+            raise ValueError("Invalid FEN side to move: " + fen)
+        self.turn = "white" if fields[1] == "w" else "black"
+
+        castling = fields[2]
+        if castling != "-" and (set(castling) - set("KQkq") or len(set(castling)) != len(castling)):
+            raise ValueError("Invalid FEN castling rights: " + fen)
+
+        # The en passant square is behind the pawn that just moved.
+        en_passant = fields[3]
+        if en_passant != "-" and (len(en_passant) != 2 or en_passant[0] not in "abcdefgh"
+                                  or en_passant[1] != ("6" if self.turn == "white" else "3")):
+            raise ValueError("Invalid FEN en passant square: " + fen)
+
+        if castling != "-":
+            for bit, king_tile, rook_tile in CASTLING_RIGHTS:
+                if "KQkq"[bit.bit_length() - 1] in castling:
+                    king = grid[king_tile[0]][king_tile[1]]
+                    rook = grid[rook_tile[0]][rook_tile[1]]
+                    # Rights without the pieces in place are ignored.
+                    if king and rook and king.kind_code == KING and rook.kind_code == ROOK:
+                        king.last_move = None
+                        rook.last_move = None
+
+        if en_passant != "-":
+            self.en_passant_square = Board.square_to_pos(en_passant)
+
+        # The move counters may be missing, as in EPD.
+        counters = fields[4:]
+        if not all(counter.isdigit() for counter in counters) or counters[1:2] == ["0"]:
+            raise ValueError("Invalid FEN move counters: " + fen)
+        if counters:
+            self.halfmove_clock = int(counters[0])
+        if len(counters) > 1:
+            self.fullmove_number = int(counters[1])
+
+        self.zobrist_key = self.compute_zobrist()
+        self.compute_psqt()
+
+    def to_fen(self):
+        """
+        Returns the FEN string of the position.
+        """
+
+        return "{0} {1} {2} {3} {4} {5}".format(
+            self.produce_fen_position(),
+            "w" if self.turn == "white" else "b",
+            self.produce_fen_castling() or "-",
+            Board.pos_to_square(self.en_passant_square) if self.en_passant_square else "-",
+            self.halfmove_clock,
+            self.fullmove_number)
+
+    def pack(self):
+        """
+        Returns the position encoded in 32 bytes (PACKED_POSITION):
+        a bitboard of the occupied tiles, a 4-bit code of each piece on
+        them in the order of the tiles, then a byte of flags (bit 0 is set
+        when black is to move, bits 1-4 are the castling rights, bit 5 is
+        set when there is an en passant square), the file of the en passant
+        square, the halfmove clock (up to 255) and the fullmove number.
+        """
+
+        occupied = 0
+        codes = []
+
+        bit = 1
+        for row in self.grid:
+            for piece in row:
+                if piece:
+                    occupied |= bit
+                    codes.append(piece.kind_code + 6 * piece.color_code)
+                bit <<= 1
+
+        if len(codes) > 32:
+            raise ValueError("Positions with more than 32 pieces can not be packed")
+
+        if len(codes) % 2:
+            codes.append(0)
+        pieces = bytes(codes[i] | (codes[i + 1] << 4) for i in range(0, len(codes), 2))
+
+        flags = (1 if self.turn == "black" else 0) | (self.castling_rights() << 1)
+        en_passant_file = 0
+        if self.en_passant_square:
+            flags |= 32
+            en_passant_file = self.en_passant_square[1]
+
+        return PACKED_POSITION.pack(occupied, pieces, flags, en_passant_file,
+                                    min(self.halfmove_clock, 255), min(self.fullmove_number, 65535))
+
+    @classmethod
+    def unpack(cls, data, debug=0):
+        """
+        Creates a board from a position encoded by pack.
+        """
+
+        return cls(debug, Board.packed_to_fen(data))
+
+    @staticmethod
+    def packed_to_fen(data):
+        """
+        Returns the FEN of a position encoded by pack.
+        """
+
+        occupied, pieces, flags, en_passant_file, halfmove_clock, fullmove_number = PACKED_POSITION.unpack(data)
+
+        ranks = []
+        index = 0
+        for row in range(8):
+            rank = ""
+            empties = 0
+            for col in range(8):
+                if occupied >> (row * 8 + col) & 1:
+                    code = (pieces[index >> 1] >> (4 * (index & 1))) & 15
+                    if code >= len(PIECE_LETTERS):
+                        raise ValueError("Invalid piece code in a packed position")
+                    index += 1
+
+                    if empties:
+                        rank += str(empties)
+                        empties = 0
+                    rank += PIECE_LETTERS[code]
+                else:
+                    empties += 1
+
+            if empties:
+                rank += str(empties)
+            ranks.append(rank)
+
+        rights = (flags >> 1) & 15
+        castling = "".join(letter for i, letter in enumerate("KQkq") if rights & (1 << i))
+
+        black = flags & 1
+        en_passant = "-"
+        if flags & 32:
+            en_passant = "abcdefgh"[en_passant_file] + ("3" if black else "6")
+
+        return "{0} {1} {2} {3} {4} {5}".format(
+            "/".join(ranks), "b" if black else "w", castling or "-", en_passant, halfmove_clock, fullmove_number)
+
     def get_moves(self, pos):
         """
         Get possible moves of a single piece.
@@ -85,30 +534,43 @@ class Board(object):
 
         self.debug_output("get_moves called.", 5)
 
-        moves = set()
+        grid = self.grid
         row, col = pos
-        piece = self.grid[row][col]
+        piece = grid[row][col]
+        kind = piece.kind_code
+        color = piece.color_code
+
+        if kind == PAWN:
+            step = PAWN_STEPS[color]
+
+            # Pawns move two tiles from their starting row.
+            if row == PAWN_START_ROWS[color]:
+                moves = self.direction_search(pos, [(step, 0)], 2)
+            else:
+                moves = self.direction_search(pos, [(step, 0)], 1)
 
-        # Directions packed in lists
-        # For the search function
-        # Each direction (y, x):
-        #  y = -1 means piece goes up, y = 1 means piece goes down, y = 0 means row is constant.
-        #  x = -1 means piece goes left, x = 1 means piece goes right, x = 0 means col is constant.
+                if self.en_passant_square in [(row + step, col - 1), (row + step, col + 1)]:
+                    moves.add(self.en_passant_square)
 
-        bishop_move = [(-1, -1), (-1, 1), (1, 1), (1, -1)]
-        rook_move = [(-1, 0), (0, 1), (1, 0), (0, -1)]
-        queen_move = bishop_move + rook_move
+        elif kind == KNIGHT:
+            # Add the jumps to empty tiles in the board.
+            moves = set()
+            for x, y in KNIGHT_MOVE:
+                m, n = row + x, col + y
+                if 0 <= m <= 7 and 0 <= n <= 7 and not grid[m][n]:
+                    moves.add((m, n))
 
-        if piece.kind == "king":
+        else:
             # The king moves like the queen, except the search length is 1.
-            moves = self.direction_search(pos, queen_move, 1)
-
-            # Check if the king can castle kingside.
-            # First condition is the king is not under attack
-            # Second condition is the king and the rook is not moved yet.
-            opponent = "white" if piece.color == "black" else "black"
-            if not self.king_under_attack(piece.color) and piece.last_move == None and self.grid[row][col + 3]:
-                if self.grid[row][col + 3].last_move == None:
+            moves = self.direction_search(pos, PIECE_DIRECTIONS[kind], PIECE_DISTANCES[kind])
+
+            if kind == KING and piece.last_move is None and not self.king_under_attack(COLORS[color]):
+                opponent = COLORS[1 - color]
+
+                # Check if the king can castle kingside.
+                # First condition is the king is not under attack
+                # Second condition is the king and the rook is not moved yet.
+                if grid[row][col + 3] and grid[row][col + 3].last_move is None:
                     tiles_between = self.direction_search(pos, [(0, 1)], 2)
 
                     # Third rule is there should be no pieces between the king and the rook (length must be 2)
@@ -119,70 +581,19 @@ class Board(object):
 
                 # Check if the king can castle queenside.
                 # Same rules as above.
-            if not self.king_under_attack(piece.color) and piece.last_move == None and self.grid[row][col - 4]:
-                if self.grid[row][col - 4].last_move == None:
+                if grid[row][col - 4] and grid[row][col - 4].last_move is None:
                     tiles_between = self.direction_search(pos, [(0, -1)], 3)
                     # Tiles king pass should have search length two.
                     # That is why it is calculated again.
                     tiles_king_pass = self.direction_search(pos, [(0, -1)], 2)
 
                     if len(tiles_between) == 3 and not tiles_king_pass.intersection(self.get_all_attacks(opponent)):
-                        moves.add((row, col - 2))                   
-
-        elif piece.kind == "queen":
-            moves = self.direction_search(pos, queen_move, 7)
-
-        elif piece.kind == "bishop":
-            moves = self.direction_search(pos, bishop_move, 7)
-
-        elif piece.kind == "knight":
-            # All the possible moves of a knight.
-            move_list = [(row - 2, col - 1),
-                         (row - 2, col + 1),
-                         (row - 1, col + 2),
-                         (row + 1, col + 2),
-                         (row + 2, col + 1),
-                         (row + 2, col - 1),
-                         (row + 1, col - 2),
-                         (row - 1, col - 2)]
-
-            # Add them if they are in the board
-            for move in move_list:
-                if 0 <= move[0] <= 7 and 0 <= move[1] <= 7:
-                    i, j = move
-                    if not self.grid[i][j]:
-                        moves.add(move) 
-
-        elif piece.kind == "rook":
-            moves = self.direction_search(pos, rook_move, 7)
-
-        elif piece.kind == "pawn":
-            
-            if piece.color == "white":
-                if row == 6:
-                    # Move of the white pawn is -1, 0 because it goes up.
-                    moves = self.direction_search(pos, [(-1, 0)], 2)
-                else:
-                    moves = self.direction_search(pos, [(-1, 0)], 1)
-
-                    if self.en_passant_square in [(row - 1, col - 1), (row - 1, col + 1)]:
-                        moves.add(self.en_passant_square)
-
-            elif piece.color == "black":
-                if row == 1:
-                    moves = self.direction_search(pos, [(1, 0)], 2)
-
-                else:
-                    moves = self.direction_search(pos, [(1, 0)], 1)
-                    
-                    if self.en_passant_square in [(row + 1, col - 1), (row + 1, col - 1)]:
-                        moves.add(self.en_passant_square)
+                        moves.add((row, col - 2))
 
         # Add attacked tiles with opponent pieces inside to legal moves.
-        for tile in self.get_attacks(pos):
-            i, j = tile
-            if self.grid[i][j] and self.grid[i][j].color != piece.color:
-                    moves.add((i, j))
+        for i, j in self.get_attacks(pos):
+            if grid[i][j] and grid[i][j].color_code != color:
+                moves.add((i, j))
 
         # This part will be handled in get_all_legal_moves function.
         # Not required anymore.
@@ -205,10 +616,11 @@ class Board(object):
         self.debug_output("get_all_moves called.", 4)
 
         moves = defaultdict(list)
+        color = COLOR_CODES[color]
 
         for i, row in enumerate(self.grid):
             for j, piece in enumerate(row):
-                if piece and piece.color == color:
+                if piece and piece.color_code == color:
                     for move in self.get_moves((i, j)):
                         moves[(i, j)].append(move)
 
@@ -233,76 +645,117 @@ class Board(object):
         
         return legal_moves  
 
-    def get_attacks(self, pos):
+    def get_legal_move_list(self, color):
         """
-        The method to get attacked tiles by a single particular piece.
+        Returns the legal moves of a player as a flat list of
+        (from_tile, to_tile, promote) tuples. Promotions are listed
+        once for every kind the pawn can become, promote is None
+        for the other moves.
         """
 
-        self.debug_output("get_attacks called.", 5)
+        moves = []
+        legal_moves = self.get_all_legal_moves(color)
 
-        tiles = set()
-        row, col = pos
-        piece = self.grid[row][col]
+        for from_tile in legal_moves:
+            piece = self.grid[from_tile[0]][from_tile[1]]
+            for to_tile in legal_moves[from_tile]:
+                if piece.kind_code == PAWN and (to_tile[0] == 0 or to_tile[0] == 7):
+                    for kind in PROMOTION_KINDS:
+                        moves.append((from_tile, to_tile, kind))
+                else:
+                    moves.append((from_tile, to_tile, None))
 
-        # Directions packed in lists
-        # For the search function
+        return moves
 
-        bishop_move = [(-1, -1), (-1, 1), (1, 1), (1, -1)]
-        rook_move = [(-1, 0), (0, 1), (1, 0), (0, -1)]
-        queen_move = bishop_move + rook_move
+    def perft(self, depth):
+        """
+        Counts the leaf nodes of the legal move tree of the given depth,
+        starting with the player to move.
+        """
 
-        if piece.kind == "king":
-            # The king attacks like the queen, except the search length is 1.
-            tiles = self.direction_search(pos, queen_move, 1, True)
+        if depth == 0:
+            return 1
 
-        elif piece.kind == "queen":
-            tiles = self.direction_search(pos, queen_move, 7, True)
+        moves = self.get_legal_move_list(self.turn)
 
-        elif piece.kind == "bishop":
-            tiles = self.direction_search(pos, bishop_move, 7, True)
+        # Leaf moves are counted without playing them.
+        if depth == 1:
+            return len(moves)
 
-        elif piece.kind == "knight":
+        nodes = 0
+        for from_tile, to_tile, promote in moves:
+            record = self.make_move(from_tile, to_tile, promote)
+            nodes += self.perft(depth - 1)
+            self.unmake_move(record)
 
-            # All the possible moves of a knight.
-            move_list = [(row - 2, col - 1),
-                         (row - 2, col + 1),
-                         (row - 1, col + 2),
-                         (row + 1, col + 2),
-                         (row + 2, col + 1),
-                         (row + 2, col - 1),
-                         (row + 1, col - 2),
-                         (row - 1, col - 2)]
+        return nodes
 
-            # Add them if they are in the board
-            for move in move_list:
-                if 0 <= move[0] <= 7 and 0 <= move[1] <= 7:
-                    tiles.add(move) 
+    def divide(self, depth):
+        """
+        Perft split by the root moves, returns {uci_move: node_count}.
+        Comparing it with another move generator's output shows
+        which move's subtree is miscounted.
+        """
 
-        elif piece.kind == "rook":
-            tiles = self.direction_search(pos, rook_move, 7, True)
+        counts = {}
+        for from_tile, to_tile, promote in self.get_legal_move_list(self.turn):
+            record = self.make_move(from_tile, to_tile, promote)
+            counts[Board.move_to_uci(from_tile, to_tile, promote)] = self.perft(depth - 1)
+            self.unmake_move(record)
 
-        elif piece.kind == "pawn":
-            if piece.color == "white":
-                if col > 0:
-                    tiles.add((row - 1, col - 1))
-                if col < 7:
-                    tiles.add((row - 1, col + 1))
+        return counts
 
-            elif piece.color == "black":
-                if col > 0:
-                    tiles.add((row + 1, col - 1))
-                if col < 7:
-                    tiles.add((row + 1, col + 1))
+    def get_attacks(self, pos):
+        """
+        The method to get attacked tiles by a single particular piece.
+        The tiles of pieces that do not slide come from tables, the
+        result must not be changed.
+        """
 
-        return tiles
+        self.debug_output("get_attacks called.", 5)
+
+        row, col = pos
+        piece = self.grid[row][col]
+        kind = piece.kind_code
+
+        if kind == PAWN:
+            return PAWN_TILES[piece.color_code][row][col]
+        elif kind == KNIGHT:
+            return KNIGHT_TILES[row][col]
+        elif kind == KING:
+            return KING_TILES[row][col]
+
+        return self.direction_search(pos, PIECE_DIRECTIONS[kind], PIECE_DISTANCES[kind], True)
 
     def get_all_attacks(self, color):
         """
         The method to get all the attacked tiles by the given player.
+        The result is cached for the position, it must not be changed.
         """
 
         self.debug_output("get_attacks called.", 3)
 
+        key = (self.zobrist_key, color)
+        tiles = self.attack_cache.get(key)
+        if tiles is not None:
+            self.attack_cache_hits += 1
+            return tiles
+
+        self.attack_cache_misses += 1
+        tiles = self._compute_attacks(COLOR_CODES[color])
+
+        if self.attack_cache_size:
+            if len(self.attack_cache) >= self.attack_cache_size:
+                self.attack_cache.clear()
+            self.attack_cache[key] = tiles
+
+        return tiles
+
+    def _compute_attacks(self, color):
+        """
+        The tiles attacked by the player of the color code, without the cache.
+        """
+
         tiles = set()
 
         for i, row in enumerate(self.grid):
@@ -314,11 +767,24 @@ class Board(object):
                     # the tile is actually the piece itself.
                     # Imagine continuing as tile == piece
 
-                    if tile.color == color:
-                        tiles = tiles.union(self.get_attacks((i, j)))
+                    if tile.color_code == color:
+                        tiles |= self.get_attacks((i, j))
 
         return tiles
 
+    def attack_cache_stats(self):
+        """
+        Returns the hits, the misses and the hit rate of the attack cache.
+        """
+
+        lookups = self.attack_cache_hits + self.attack_cache_misses
+        return {
+            "hits": self.attack_cache_hits,
+            "misses": self.attack_cache_misses,
+            "hit_rate": self.attack_cache_hits / lookups if lookups else 0.0,
+            "entries": len(self.attack_cache)
+        }
+
     def assume_move(self, move, color):
         """
         The method that assumes a move is played, to check if it is a legal move.
@@ -329,26 +795,26 @@ class Board(object):
 
         self.debug_output("assume_move called.", 2)
 
-        # Copy the board instance
-        # All the movement operations will be done
-        # on the copied board.
-
-        board_copy = copy.deepcopy(self) 
-
         from_tile, to_tile = move
 
+        # The move is played on the board itself and taken back
+        # right after the test, instead of copying the whole board.
         # promote=pawn is used for representing a pseudo-promote move,
         # when only assuming and testing.
-        board_copy.make_move(from_tile, to_tile, promote="pawn")
+        record = self.make_move(from_tile, to_tile, promote="pawn")
 
-        if board_copy.king_under_attack(color):
-            return False # King is still under attack after the move.
-        else:
-            return True # The move helps the given king out of check.
+        # If the king is still under attack after the move, it is not legal.
+        legal = not self.king_under_attack(color)
+
+        self.unmake_move(record)
+
+        return legal
 
     def make_move(self, from_tile, to_tile, promote="pawn"):
         """
         The method that handles piece alterations to apply a move.
+        Returns a MoveRecord, which can be given to unmake_move
+        to take the move back.
         """
 
         self.debug_output("make_move called.", 2)
@@ -357,96 +823,219 @@ class Board(object):
         tr, tc = to_tile
 
         piece = self.grid[fr][fc]
+        record = MoveRecord(from_tile, to_tile, piece, piece.last_move, self.en_passant_square, self.zobrist_key)
+        record.halfmove_clock = self.halfmove_clock
+        record.fullmove_number = self.fullmove_number
+        record.turn = self.turn
+
+        # Pieces are hashed in and out by _add_piece and _remove_piece,
+        # castling rights and en passant are updated at the end.
+        castling = self.castling_rights()
+
+        # A regular capture, en passant captures are handled below.
+        if self.grid[tr][tc]:
+            record.captured = self._remove_piece(to_tile)
+            record.captured_tile = to_tile
+
         piece.last_move = from_tile
+        self._remove_piece(from_tile)
 
         # Boolean value set true if a pawn went
         # two squares in the current move.
         pawn_double_moved = False
 
-        # Detect castling.
-        if piece.kind == "king":
-            # Queenside
-            if fc - tc == 2:
+        # Detect castling, the rook is moved alongside the king.
+        if piece.kind_code == KING and abs(tc - fc) == 2:
+            if tc < fc:
                 self.debug_output("Castled Queenside.", 3)
-                castle = self.grid[fr][0]
-                self.grid[fr][0] = 0
-                self.grid[fr][fc] = 0
-                self.grid[tr][tc] = piece
-                self.grid[fr][3] = castle       
-            # Kingside
-            elif tc - fc == 2:
-                self.debug_output("Castled Kingside.", 3)
-                castle = self.grid[fr][7]
-                self.grid[fr][7] = 0
-                self.grid[fr][fc] = 0
-                self.grid[tr][tc] = piece
-                self.grid[fr][5] = castle
+                record.castle = (fr, 0), (fr, 3)
             else:
-                # Regular king move
-                self.grid[fr][fc] = 0
-                self.grid[tr][tc] = piece 
+                self.debug_output("Castled Kingside.", 3)
+                record.castle = (fr, 7), (fr, 5)
+
+            rook_from, rook_to = record.castle
+            self._add_piece(self._remove_piece(rook_from), rook_to)
+            self._add_piece(piece, to_tile)
 
         # Detect promotion and en_passant.
-        elif piece.kind == "pawn":
-            
-            if piece.color == "white":
-                # If move is en_passant
-                if to_tile == self.en_passant_square:
-                    self.debug_output("White pawn at {0} made en_passant to {1}".format(from_tile, to_tile), 3)
-                    self.grid[fr][fc] = 0
-                    self.grid[tr + 1][tc] = 0
-                    self.grid[tr][tc] = piece
-                # If move is promotion
-                elif tr == 0:
-                    self.debug_output("White pawn at {0} made promotion to {1}, became a {2}".format(from_tile, to_tile, promote), 3)
-                    self.grid[fr][fc] = 0
-                    self.grid[tr][tc] = Piece("white", promote)
-                # If move is double pawn start
-                elif fr == 6 and tr == 4:
-                    self.debug_output("White pawn at {0} made double move to {1}, the next en_passant square is {2}".format(from_tile, to_tile, (tr + 1, tc)), 3)
-                    self.grid[fr][fc] = 0
-                    self.grid[tr][tc] = piece
-                    self.en_passant_square = (tr + 1, tc)
-                    pawn_double_moved = True
-                else:
-                    self.debug_output("White pawn at {0} made move to {1}".format(from_tile, to_tile), 3)
-                    self.grid[fr][fc] = 0
-                    self.grid[tr][tc] = piece
-
-
-            elif piece.color == "black":
-                # If move is en_passant
-                if to_tile == self.en_passant_square:
-                    self.debug_output("Black pawn at {0} made en_passant to {1}".format(from_tile, to_tile), 3)
-                    self.grid[fr][fc] = 0
-                    self.grid[tr - 1][tc] = 0
-                    self.grid[tr][tc] = piece
-                # If move is promotion
-                elif tr == 7:
-                    self.debug_output("Black pawn at {0} made promotion to {1}, became a {2}".format(from_tile, to_tile, promote), 3)
-                    self.grid[fr][fc] = 0
-                    self.grid[tr][tc] = Piece("black", promote)
-                # If move is double pawn start
-                elif fr == 1 and tr == 3:
-                    self.debug_output("Black pawn at {0} made double move to {1}, the next en_passant square is {2}".format(from_tile, to_tile, (tr - 1, tc)), 3)
-                    self.grid[fr][fc] = 0
-                    self.grid[tr][tc] = piece
-                    self.en_passant_square = (tr - 1, tc)
-                    pawn_double_moved = True
-                else:
-                    self.debug_output("Black pawn at {0} made move to {1}".format(from_tile, to_tile), 3)
-                    self.grid[fr][fc] = 0
-                    self.grid[tr][tc] = piece
+        elif piece.kind_code == PAWN:
+
+            # If move is en_passant, the captured pawn is
+            # next to the moving pawn, not on the target tile.
+            if to_tile == self.en_passant_square:
+                self.debug_output("{0} pawn at {1} made en_passant to {2}".format(piece.color, from_tile, to_tile), 3)
+                record.captured = self._remove_piece((fr, tc))
+                record.captured_tile = (fr, tc)
+                self._add_piece(piece, to_tile)
+
+            # If move is promotion
+            elif tr == 0 or tr == 7:
+                self.debug_output("{0} pawn at {1} made promotion to {2}, became a {3}".format(piece.color, from_tile, to_tile, promote), 3)
+                record.promoted = Piece(piece.color_code, promote)
+                record.promoted.last_move = from_tile
+                self._add_piece(record.promoted, to_tile)
+
+            # If move is double pawn start
+            elif abs(tr - fr) == 2:
+                self.en_passant_square = ((fr + tr) // 2, tc)
+                self.debug_output("{0} pawn at {1} made double move to {2}, the next en_passant square is {3}".format(piece.color, from_tile, to_tile, self.en_passant_square), 3)
+                self._add_piece(piece, to_tile)
+                pawn_double_moved = True
+
+            else:
+                self._add_piece(piece, to_tile)
 
         else:
-            self.grid[fr][fc] = 0
-            self.grid[tr][tc] = piece
+            self._add_piece(piece, to_tile)
 
         # If a pawn did not move double in this turn,
         # reset en passant square.
         if not pawn_double_moved:
             self.en_passant_square = None
 
+        # The clock restarts after irreversible moves.
+        if piece.kind_code == PAWN or record.captured:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+
+        if self.turn == "black":
+            self.fullmove_number += 1
+
+        self.turn = "white" if self.turn == "black" else "black"
+
+        self.zobrist_key ^= ZOBRIST_BLACK_TURN ^ ZOBRIST_CASTLING[castling] ^ ZOBRIST_CASTLING[self.castling_rights()]
+        if record.en_passant_square:
+            self.zobrist_key ^= ZOBRIST_EN_PASSANT[record.en_passant_square[1]]
+        if self.en_passant_square:
+            self.zobrist_key ^= ZOBRIST_EN_PASSANT[self.en_passant_square[1]]
+
+        return record
+
+    def unmake_move(self, record):
+        """
+        The method that takes back a move played with make_move,
+        restoring the board in place using the move's record.
+        """
+
+        self.debug_output("unmake_move called.", 2)
+
+        piece = record.piece
+
+        # Promoted piece is removed the same way as the pawn itself.
+        self._remove_piece(record.to_tile)
+        self._add_piece(piece, record.from_tile)
+        piece.last_move = record.last_move
+
+        if record.castle:
+            rook_from, rook_to = record.castle
+            self._add_piece(self._remove_piece(rook_to), rook_from)
+
+        if record.captured:
+            self._add_piece(record.captured, record.captured_tile)
+
+        # Restored as they were, the move may be of the player not to move,
+        # e.g. when assume_move tests it.
+        self.en_passant_square = record.en_passant_square
+        self.turn = record.turn
+        self.zobrist_key = record.zobrist_key
+
+        self.halfmove_clock = record.halfmove_clock
+        self.fullmove_number = record.fullmove_number
+
+    def _add_piece(self, piece, tile):
+        """
+        Puts a piece on an empty tile.
+        """
+
+        self.grid[tile[0]][tile[1]] = piece
+
+        color = piece.color_code
+        kind = piece.kind_code
+        sq = tile[0] * 8 + tile[1]
+
+        self.zobrist_key ^= ZOBRIST_PIECES[color][kind][sq]
+        self.psqt_score += PSQT[color][kind][sq]
+        if kind == PAWN:
+            self.pawn_files[color][tile[1]] += 1
+
+    def _remove_piece(self, tile):
+        """
+        Removes the piece on a tile and returns it.
+        """
+
+        piece = self.grid[tile[0]][tile[1]]
+        self.grid[tile[0]][tile[1]] = None
+
+        color = piece.color_code
+        kind = piece.kind_code
+        sq = tile[0] * 8 + tile[1]
+
+        self.zobrist_key ^= ZOBRIST_PIECES[color][kind][sq]
+        self.psqt_score -= PSQT[color][kind][sq]
+        if kind == PAWN:
+            self.pawn_files[color][tile[1]] -= 1
+
+        return piece
+
+    def castling_rights(self):
+        """
+        Returns the castling rights as bits of an integer (see CASTLING_RIGHTS).
+        A right exists while the king and the rook of that side never moved.
+        Whether castling is possible right now is not considered.
+        """
+
+        rights = 0
+        grid = self.grid
+
+        for bit, (kr, kc), (rr, rc) in CASTLING_RIGHTS:
+            king = grid[kr][kc]
+            rook = grid[rr][rc]
+            if king and rook and king.kind_code == KING and rook.kind_code == ROOK and \
+                    king.last_move is None and rook.last_move is None and king.color_code == rook.color_code:
+                rights |= bit
+
+        return rights
+
+    def compute_zobrist(self):
+        """
+        Computes the Zobrist key of the position from scratch. The key kept
+        in zobrist_key is updated incrementally, and must always be equal to this.
+        """
+
+        key = 0
+
+        for i, row in enumerate(self.grid):
+            for j, piece in enumerate(row):
+                if piece:
+                    key ^= ZOBRIST_PIECES[piece.color_code][piece.kind_code][i * 8 + j]
+
+        if self.turn == "black":
+            key ^= ZOBRIST_BLACK_TURN
+
+        key ^= ZOBRIST_CASTLING[self.castling_rights()]
+
+        if self.en_passant_square:
+            key ^= ZOBRIST_EN_PASSANT[self.en_passant_square[1]]
+
+        return key
+
+    def compute_psqt(self):
+        """
+        Computes psqt_score and pawn_files from scratch, they are
+        updated incrementally after this.
+        """
+
+        self.psqt_score = 0
+        self.pawn_files = [[0] * 8, [0] * 8]
+
+        for i, row in enumerate(self.grid):
+            for j, piece in enumerate(row):
+                if piece:
+                    self.psqt_score += PSQT[piece.color_code][piece.kind_code][i * 8 + j]
+                    if piece.kind_code == PAWN:
+                        self.pawn_files[piece.color_code][j] += 1
+
     def king_position(self, color):
         """
         Method that returns the king's position in the given color
@@ -454,10 +1043,12 @@ class Board(object):
 
         self.debug_output("king_position called.", 4)
 
+        color = COLOR_CODES[color]
+
         for i, row in enumerate(self.grid):
             for j, tile in enumerate(row):
                 # tile is a piece if filled.
-                if tile and tile.color == color and tile.kind == "king":
+                if tile and tile.kind_code == KING and tile.color_code == color:
                     return (i, j)
 
     def king_under_attack(self, color):
@@ -467,14 +1058,8 @@ class Board(object):
 
         self.debug_output("king_under_attack called.", 4)
 
-        if color == "white" and self.king_position("white") in self.get_all_attacks("black"):
-            return True
-
-        elif color == "black" and self.king_position("black") in self.get_all_attacks("white"):
-            return True
-
-        else:
-            return False
+        opponent = "white" if color == "black" else "black"
+        return self.king_position(color) in self.get_all_attacks(opponent)
 
     def direction_search(self, pos, directions, search_distance, inclusive = False):
         """
@@ -503,7 +1088,7 @@ class Board(object):
                         if in_tile or not (0 <= m <= 7 and 0 <= n <= 7):
 
                             # The mechanics of pawn is different.
-                            if piece.kind != "pawn":
+                            if piece.kind_code != PAWN:
                                 # Add the piece detected in the path regardless of the color, if search is inclusive.
                                 if inclusive and 0 <= m <= 7 and 0 <= n <= 7:
                                     tiles.add((m, n))
@@ -554,12 +1139,33 @@ class Board(object):
         pos = (7 - "12345678".index(square[1]), "abcdefgh".index(square[0]))
         return pos
 
+    @staticmethod
+    def move_to_uci(from_tile, to_tile, promote=None):
+        """
+        Converts a move to the long algebraic notation used by UCI, e.g. e7e8q.
+        """
+
+        move = Board.pos_to_square(from_tile) + Board.pos_to_square(to_tile)
+        if promote:
+            move += "n" if promote == "knight" else promote[0]
+        return move
+
+    @staticmethod
+    def uci_to_move(move):
+        """
+        Converts a UCI move string to a (from_tile, to_tile, promote) tuple,
+        promote is None if the move is not a promotion.
+        """
+
+        promote = None
+        if len(move) > 4:
+            promote = {"q": "queen", "r": "rook", "b": "bishop", "n": "knight"}[move[4]]
+
+        return Board.square_to_pos(move[:2]), Board.square_to_pos(move[2:4]), promote
+
     @staticmethod
     def piece_to_letter(piece):
-        letter = piece.kind[0] if piece.kind != "knight" else "n"
-        if piece.color == "white":
-            letter = letter.upper()
-        return letter
+        return PIECE_LETTERS[piece.kind_code + 6 * piece.color_code]
 
     def produce_fen_position(self):
 
@@ -587,49 +1193,84 @@ class Board(object):
         return position[:-1]
 
     def produce_fen_castling(self):
+        """
+        Returns the castling part of the FEN, an empty string if
+        neither player can castle anymore.
+        """
 
-        # Preparing castling part
-        castling = ""
-
-        # If the piece at (7, 4) never moved before (white king)
-
-        if self.grid[7][4].last_move == None:
-
-            # Use the get moves function to see if the king
-            # has the castling square in it's moves.
-            if self.grid[7][6].last_move == None:
-                castling += "K"
-            if self.grid[7][1].last_move == None:
-                castling += "Q"
-
-        if self.grid[0][4].last_move == None:  
-            if self.grid[0][6].last_move == None:
-                castling += "k"
-            if self.grid[7][1].last_move == None:
-                castling += "q"
-      
-        return castling
+        rights = self.castling_rights()
+        return "".join(letter for i, letter in enumerate("KQkq") if rights & (1 << i))
 
 
 class Game(object):
 
-    def __init__(self, debug, game_mode):
+    def __init__(self, debug, game_mode, engine_type="uci", engine_pool=None, analysis_cache=None,
+                 incremental_position=True, book=None, bitbases=None, search_depth=None):
 
         self.board = Board(debug)
 
         self.game_mode = game_mode
 
-        self.chess_engine = engine.Engine()
+        # "uci" drives the external engine process,
+        # "native" searches inside this process,
+        # "parallel" searches with a process for every CPU.
+        # A uci engine is leased from the pool if one is given.
+        # The analysis cache keeps the results of each type apart.
+        self.engine_type = engine_type
+        self.engine_pool = engine_pool if engine_type == "uci" else None
+
+        if engine_type == "native":
+            # Imported here because the search module builds on this one.
+            import search
+            self.chess_engine = search.Searcher(debug)
+        elif engine_type == "parallel":
+            import parallel
+            self.chess_engine = parallel.ParallelSearcher(debug)
+        elif self.engine_pool:
+            self.chess_engine = self.engine_pool.acquire()
+        else:
+            self.chess_engine = engine.Engine()
         self.search_thread_running = False
 
-        self.turn = "white"
+        # The engine searches the AI moves this deep.
+        self.search_depth = search_depth or SEARCH_DEPTHS[engine_type]
+
+        # Persistent results of the engine (cache.AnalysisCache), optional.
+        # Cached moves searched shallower than cache_min_depth are searched again,
+        # a shallower result would replace the engine's own search.
+        self.analysis_cache = analysis_cache
+        self.cache_min_depth = self.search_depth
+
+        # Opening book (book.OpeningBook), optional. It is looked up before
+        # the engine until a position is not in it. "weighted" picks book
+        # moves at random by their weights, "best" the highest weighted.
+        self.book = book
+        self.book_mode = "weighted"
+        self.in_book = book is not None
+
+        # Endgame bitbases (bitbase.Bitbases), optional. The positions
+        # in them are played from them, without the engine.
+        self.bitbases = bitbases
+
         self.move_count = 1
 
         self.all_moves = []
 
+        # The engine is sent the position from the last irreversible move
+        # (a capture or a pawn move) instead of the whole game. Positions
+        # before it can not repeat, so the engine still detects repetitions.
+        # base_fen is the FEN after that move, None for the start position.
+        self.incremental_position = incremental_position
+        self.base_fen = None
+        self.base_moves = []
+
         self.selected = None
         self.selected_moves = []
 
+        # The legal moves of the current position, computed when first needed
+        # and kept until a move is made. (zobrist_key, {from_tile: [to_tile, ...]})
+        self._legal_moves = None
+
         self.best_move = None
         self.best_move_string = ""
 
@@ -637,83 +1278,251 @@ class Game(object):
             "white": 1,
             "black": -1
         } 
-    def move(self, from_tile, to_tile):
 
+    @property
+    def turn(self):
+        """
+        The player to move, kept by the board.
+        """
 
-        self.board.make_move(from_tile, to_tile)
-        self.all_moves.append(Board.pos_to_square(from_tile) + Board.pos_to_square(to_tile))
-        self.turn = "white" if self.turn == "black" else "black"
+        return self.board.turn
+
+    def move(self, from_tile, to_tile, promote=None):
+
+        # Pawns reaching the last row become queens, unless told otherwise.
+        piece = self.board.grid[from_tile[0]][from_tile[1]]
+        if promote is None and piece.kind == "pawn" and to_tile[0] in (0, 7):
+            promote = "queen"
 
-        self.chess_engine.set_position(self.all_moves)
+        self.board.make_move(from_tile, to_tile, promote)
+        self._record_move(Board.move_to_uci(from_tile, to_tile, promote))
+
+        self.send_position()
         
-        if self.game_mode == "ai":
+        if self.game_mode == "ai" and not self.result():
             
 
-            move = self.chess_engine.get_best_move()
+            move = self.engine_move()
 
-            from_square, to_square = move[:2], move[2:]
-            from_pos, to_pos = Board.square_to_pos(from_square), Board.square_to_pos(to_square)
+            from_pos, to_pos, promote = Board.uci_to_move(move)
 
-            if self.board.grid[from_pos[0]][from_pos[1]].color != self.turn:
+            if to_pos not in self.legal_moves().get(from_pos, ()):
                 print ("Engine tried an illegal move.")
+                return
+
+            self.board.make_move(from_pos, to_pos, promote)
+            self._record_move(move)
+
+            self.send_position()
 
-            self.board.make_move(from_pos, to_pos)
-            self.all_moves.append(Board.pos_to_square(from_pos) + Board.pos_to_square(to_pos))
-            self.turn = "white" if self.turn == "black" else "black"
+    def _record_move(self, move):
+        """
+        Adds a move, already played on the board, to the move lists.
+        """
 
+        self.all_moves.append(move)
+        self._legal_moves = None
+
+        if self.board.halfmove_clock == 0:
+            self.base_fen = self.board.to_fen()
+            self.base_moves = []
+        else:
+            self.base_moves.append(move)
+
+    def send_position(self):
+        """
+        Sends the current position to the engine.
+        """
+
+        if self.incremental_position:
+            self.chess_engine.set_position(self.base_moves, self.base_fen)
+        else:
             self.chess_engine.set_position(self.all_moves)
 
 
+    def legal_moves(self):
+        """
+        Returns the legal moves of the player to move, {from_tile: [to_tile, ...]}.
+        They are generated once for a position, the result must not be changed.
+        """
+
+        key = self.board.zobrist_key
+        if self._legal_moves is None or self._legal_moves[0] != key:
+            self._legal_moves = key, dict(self.board.get_all_legal_moves(self.turn))
+
+        return self._legal_moves[1]
+
+    def result(self):
+        """
+        Returns the result of the game if it is over, as in PGN
+        ("1-0", "0-1" or "1/2-1/2"), None if it goes on.
+        """
+
+        if not self.legal_moves():
+            if self.board.king_under_attack(self.turn):
+                return "0-1" if self.turn == "white" else "1-0"
+            return "1/2-1/2"  # Stalemate
+
+        # Fifty moves of each player without a capture or a pawn move.
+        if self.board.halfmove_clock >= 100:
+            return "1/2-1/2"
+
+        return None
+
     def set_selection(self, pos):
         """
         Sets the list of moves which can be done by the selected piece.
         """
 
         self.selected = pos
-        self.selected_moves = self.board.get_all_legal_moves(self.turn)[pos]
+        self.selected_moves = self.legal_moves().get(pos, [])
 
     def remove_selection(self):
         
         self.selected = None
         self.selected_moves = []
 
+    def engine_move(self):
+        """
+        Returns the engine's move for the current position in UCI notation.
+        The opening book, the endgame bitbases and the analysis cache are
+        looked up first, and the new results are stored in the cache.
+        """
+
+        if self.in_book:
+            move = self.book_move()
+            if move:
+                return move
+
+        if self.bitbases:
+            move = self.bitbases.best_move(self.board)
+            if move:
+                return move
+
+        limit = "depth {0}".format(self.search_depth)
+
+        # An empty cache is false, its presence is checked.
+        if self.analysis_cache is None:
+            return self.chess_engine.get_best_move(limit)
+
+        key = self.board.zobrist_key
+
+        cached = self.analysis_cache.get(key, self.cache_min_depth, self.engine_type)
+        if cached and cached["bestmove"]:
+            return cached["bestmove"]
+
+        info = self.chess_engine.analyse(limit)
+        if "depth" in info:
+            self.analysis_cache.put(key, info, self.engine_type)
+
+        return info["bestmove"]
+
+    def book_move(self):
+        """
+        Returns a legal book move of the current position in UCI notation,
+        None when the game is out of the book.
+        """
+
+        move = self.book.get_move(self.board, self.book_mode)
+        if move:
+            from_pos, to_pos, promote = Board.uci_to_move(move)
+            if to_pos in self.legal_moves().get(from_pos, ()):
+                return move
+
+        self.in_book = False
+        return None
+
     def set_best_move(self):
-        move = self.chess_engine.get_best_move()
+        move = self.engine_move()
 
-        from_square, to_square = move[:2], move[2:]
-        from_pos, to_pos = self.board.square_to_pos(from_square), self.board.square_to_pos(to_square)
+        from_pos, to_pos, promote = Board.uci_to_move(move)
 
-        self.move(from_pos, to_pos)
+        self.move(from_pos, to_pos, promote)
         #self.best_move = from_pos, to_pos
 
     def search_best_move(self):
         self.search_thread_running = True
-        self.search_thread = threading.Thread(target=self._search_best_move)
+
+        # The search is started here, not in the thread, so that
+        # a stop_search before the thread runs stops it.
+        info_values = self.chess_engine.start_infinite_search()
+
+        self.search_thread = threading.Thread(target=self._search_best_move, args=(info_values,))
         self.search_thread.daemon = True
         self.search_thread.start()
 
-    def _search_best_move(self):
+    def _search_best_move(self, info_values):
+
+        key = self.board.zobrist_key
+        cached_depth = 0
+
+        # Show the cached analysis until the engine gets deeper.
+        if self.analysis_cache is not None:
+            cached = self.analysis_cache.get(key, engine=self.engine_type)
+            if cached and cached["bestmove"]:
+                self._show_analysis(cached)
+                cached_depth = cached["depth"]
 
-        info_values = self.chess_engine.start_infinite_search()
         for info in info_values:
-            if "pv" in info:
-                self.best_move = Board.square_to_pos(info["pv"][0][:2]), Board.square_to_pos(info["pv"][0][2:4])
+            if "pv" in info and info.get("depth", 0) >= cached_depth:
+                self._show_analysis(info)
+
+                if self.analysis_cache is not None and info.get("depth", 0) > cached_depth:
+                    self.analysis_cache.put(key, info, self.engine_type)
+                    cached_depth = info["depth"]
 
-                self.best_move_string= str(info["pv"][0]) + " " + "%+.3f" % (self.player_points[self.turn] * info["score"]["cp"] / 100) + "(Depth " + str(info["depth"]) + ")" 
         #print("Analysis is ended.")
         self.best_move = None
         self.best_move_string = ""
 
+    def _show_analysis(self, info):
+        """
+        Sets the best move and the analysis string shown by the GUI.
+        """
+
+        move = info["pv"][0] if info.get("pv") else info["bestmove"]
+        self.best_move = Board.square_to_pos(move[:2]), Board.square_to_pos(move[2:4])
+
+        score = info.get("score") or {}
+        if "mate" in score:
+            score = "#%+d" % (self.player_points[self.turn] * score["mate"])
+        elif "cp" in score:
+            score = "%+.3f" % (self.player_points[self.turn] * score["cp"] / 100)
+        else:
+            score = ""
+
+        self.best_move_string= str(move) + " " + score + "(Depth " + str(info["depth"]) + ")" 
+
     def stop_search(self):
         self.search_thread_running = False
         self.chess_engine.stop_infinite_search()
     
     def game_exit(self):
-        self.search_thread_running = False
-        self.chess_engine.stop_process()
+        if self.search_thread_running:
+            self.stop_search()
+            self.search_thread.join()
+
+        if self.engine_pool:
+            self.engine_pool.release(self.chess_engine)
+        else:
+            self.chess_engine.stop_process()
 
     def produce_fen(self):
-        pass
+        return self.board.to_fen()
+
+    def perft(self, depth):
+        """
+        Counts the leaf nodes of the legal move tree from the current position.
+        """
+
+        return self.board.perft(depth)
+
+    def divide(self, depth):
+        """
+        Perft node counts split by the root moves of the current position.
+        """
+
+        return self.board.divide(depth)
 
 if __name__ == "__main__":
     b = Board(1)
@@ -0,0 +1,201 @@
+"""
+The module with the move ordering of the search.
+
+Alpha-beta prunes the most when the best move is searched first. The moves
+of a position are given in stages, so that the later stages are not
+generated at all when an earlier move causes a cutoff:
+
+    1. the hash move, the best move found before in the position
+    2. the captures and promotions, most valuable victim first and
+       then least valuable attacker (MVV-LVA)
+    3. the killer moves, quiet moves that caused a cutoff at the same ply
+    4. the other quiet moves, by their history score
+
+The killer moves and the history scores are learned during the search
+and kept between the iterations of iterative deepening.
+"""
+
+from internals import COLOR_CODES, KINDS, PAWN
+
+PIECE_VALUES = {
+    "pawn": 100,
+    "knight": 320,
+    "bishop": 330,
+    "rook": 500,
+    "queen": 900,
+    "king": 0
+}
+
+# Values by kind code.
+KIND_VALUES = [PIECE_VALUES[kind] for kind in KINDS]
+
+# Killer moves kept for every ply.
+KILLER_SLOTS = 2
+
+# History scores are halved when they grow above this,
+# so that recent cutoffs count more than old ones.
+HISTORY_LIMIT = 1 << 20
+
+
+def is_capture(board, move):
+    """
+    Returns if a (from_tile, to_tile, promote) move captures a piece
+    or promotes a pawn.
+    """
+
+    from_tile, to_tile, promote = move
+    if promote or board.grid[to_tile[0]][to_tile[1]]:
+        return True
+    return to_tile == board.en_passant_square and board.grid[from_tile[0]][from_tile[1]].kind_code == PAWN
+
+
+def capture_value(board, move):
+    """
+    Ordering value of a capture, the most valuable victim first,
+    then the least valuable attacker.
+    """
+
+    from_tile, to_tile, promote = move
+    victim = board.grid[to_tile[0]][to_tile[1]]
+    attacker = board.grid[from_tile[0]][from_tile[1]]
+
+    value = KIND_VALUES[victim.kind_code] if victim else KIND_VALUES[PAWN]
+    if promote:
+        value += PIECE_VALUES[promote]
+
+    return 10 * value - KIND_VALUES[attacker.kind_code] // 10
+
+
+def generate_captures(board):
+    """
+    Returns the legal captures and promotions of the player to move.
+    """
+
+    if hasattr(board, "generate_legal_moves"):
+        return board.generate_legal_moves(board.turn, quiets=False)
+    return [move for move in board.get_legal_move_list(board.turn) if is_capture(board, move)]
+
+
+def generate_quiets(board):
+    """
+    Returns the legal moves of the player to move that are not
+    captures or promotions.
+    """
+
+    if hasattr(board, "generate_legal_moves"):
+        return board.generate_legal_moves(board.turn, captures=False)
+    return [move for move in board.get_legal_move_list(board.turn) if not is_capture(board, move)]
+
+
+def is_legal(board, move):
+    """
+    Returns if a move, e.g. from the transposition table, is legal in
+    the position, without generating all the moves.
+    """
+
+    from_tile, to_tile, promote = move
+    piece = board.grid[from_tile[0]][from_tile[1]]
+    if not piece or piece.color != board.turn:
+        return False
+
+    # A pawn reaching the last row must promote, other moves must not.
+    if (piece.kind_code == PAWN and to_tile[0] in (0, 7)) != (promote is not None):
+        return False
+
+    return to_tile in board.get_moves(from_tile) and board.assume_move([from_tile, to_tile], board.turn)
+
+
+class MoveOrderer(object):
+    """
+    Gives the moves of the positions of a search in the order to search them,
+    and learns the killer moves and history scores from the cutoffs.
+    """
+
+    def __init__(self, max_ply=128):
+
+        # [[move, move], ...] by ply
+        self.killers = [[None] * KILLER_SLOTS for _ in range(max_ply + 1)]
+
+        # history[color][from square][to square]
+        self.history = [[[0] * 64 for _ in range(64)] for _ in range(2)]
+
+    def clear(self):
+        """
+        Forgets everything learned, for a new game.
+        """
+
+        for killers in self.killers:
+            killers[:] = [None] * KILLER_SLOTS
+
+        for table in self.history:
+            for scores in table:
+                scores[:] = [0] * 64
+
+    def new_search(self):
+        """
+        The killer moves are of the previous position, they are cleared.
+        The history scores are aged, the previous search still tells
+        something about the quiet moves of the position.
+        """
+
+        for killers in self.killers:
+            killers[:] = [None] * KILLER_SLOTS
+
+        for table in self.history:
+            for scores in table:
+                scores[:] = [score >> 1 for score in scores]
+
+    def moves(self, board, ply, first_moves=()):
+        """
+        Yields the legal moves of the player to move, in stages. The first
+        moves, e.g. the hash move, are yielded first if they are legal.
+        """
+
+        searched = []
+        for move in first_moves:
+            if move and move not in searched and is_legal(board, move):
+                searched.append(move)
+                yield move
+
+        captures = generate_captures(board)
+        captures.sort(key=lambda move: capture_value(board, move), reverse=True)
+        for move in captures:
+            if move not in searched:
+                yield move
+
+        quiets = generate_quiets(board)
+
+        killers = [move for move in self.killers[ply] if move in quiets and move not in searched]
+        for move in killers:
+            yield move
+
+        color = COLOR_CODES[board.turn]
+        history = self.history[color]
+        quiets.sort(key=lambda move: history[move[0][0] * 8 + move[0][1]][move[1][0] * 8 + move[1][1]], reverse=True)
+        for move in quiets:
+            if move not in searched and move not in killers:
+                yield move
+
+    def cutoff(self, board, move, depth, ply):
+        """
+        Called when a move causes a beta cutoff, after it is taken back.
+        Quiet moves become killer moves of the ply and gain history score,
+        more for the cutoffs of deeper searches.
+        """
+
+        if is_capture(board, move):
+            return
+
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1:] = killers[:-1]
+            killers[0] = move
+
+        (from_row, from_col), (to_row, to_col), promote = move
+        scores = self.history[COLOR_CODES[board.turn]][from_row * 8 + from_col]
+        scores[to_row * 8 + to_col] += depth * depth
+
+        if scores[to_row * 8 + to_col] > HISTORY_LIMIT:
+            for table in self.history:
+                for row in table:
+                    row[:] = [score >> 1 for score in row]
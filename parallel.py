@@ -0,0 +1,204 @@
+"""
+The module with the parallel search, Lazy SMP over processes.
+
+Threads do not make a Python search faster, so the helper searchers run in
+a pool of processes. Every helper searches the same position as the main
+searcher, and they share one transposition table in shared memory. The
+helpers find the results of each other in the table, which makes the main
+searcher reach its depths sooner. The helpers skip some of the depths,
+each in its own pattern, so that they do not all search the same tree.
+
+ParallelSearcher has the methods of search.Searcher, so a Game can use it
+with the "parallel" engine type:
+
+    game = internals.Game(0, "ai", "parallel")
+"""
+
+import ctypes
+import multiprocessing
+import os
+import time
+
+import search
+import transposition
+from bitboard import BitBoard
+
+# Depths skipped by the helpers: helper i skips depth d when
+# ((d + SKIP_PHASE[i]) // SKIP_SIZE[i]) is odd, the patterns repeat
+# after 20 helpers.
+SKIP_SIZE = (1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 3, 3, 4, 4, 4, 4, 4, 4, 4, 4)
+SKIP_PHASE = (0, 1, 0, 1, 2, 3, 0, 1, 2, 3, 4, 5, 0, 1, 2, 3, 4, 5, 6, 7)
+
+# The searcher of a helper process, made by _init_helper.
+_helper = None
+
+
+class HelperSearcher(search.Searcher):
+    """
+    The searcher of a helper process. It stops when the main searcher sets
+    the stop event, and publishes its node count to the main searcher.
+    """
+
+    def __init__(self, table, stop_event, node_counts):
+
+        search.Searcher.__init__(self, table=table)
+
+        self.stop_event = stop_event
+
+        # Node counts of the helpers, shared with the main searcher.
+        # Index 0 is the main searcher's, it is not used.
+        self.node_counts = node_counts
+
+        # Index of the helper, given with every search.
+        self.index = 1
+
+    def _depths(self, limits):
+
+        skip = (self.index - 1) % len(SKIP_SIZE)
+        for depth in search.Searcher._depths(self, limits):
+            if not ((depth + SKIP_PHASE[skip]) // SKIP_SIZE[skip]) % 2:
+                yield depth
+
+    def _check_limits(self):
+
+        self.node_counts[self.index] = self.nodes
+        if self.stop_event.is_set():
+            raise search.SearchAborted()
+        search.Searcher._check_limits(self)
+
+
+def _init_helper(size_mb, shared_table, stop_event, node_counts):
+    """
+    Initializer of the helper processes.
+    """
+
+    global _helper
+
+    table = transposition.SharedTranspositionTable(size_mb, shared=shared_table)
+    _helper = HelperSearcher(table, stop_event, node_counts)
+
+
+def _helper_search(index, fen, limits, age, new_game):
+    """
+    Searches a position in a helper process until the depth limit
+    or the stop event, returns the number of nodes searched.
+    """
+
+    helper = _helper
+    helper.index = index
+
+    if new_game:
+        helper.orderer.clear()
+
+    # The age before the search of the main searcher, the search
+    # increments it to the age the main searcher is storing with.
+    helper.tt.age = age
+
+    for info in helper._iterate(BitBoard(0, fen), limits):
+        pass
+
+    helper.node_counts[index] = helper.nodes
+    return helper.nodes
+
+
+class ParallelSearcher(search.Searcher):
+    """
+    The in-process engine searching with several processes. The main
+    searcher runs in this process and reports the search, the helpers
+    run in a process pool. threads is the number of searchers,
+    the number of CPUs by default.
+    """
+
+    def __init__(self, debug=0, movetime=3000, hash_mb=16, threads=None):
+
+        self.threads = threads or os.cpu_count()
+        self.hash_mb = hash_mb
+
+        table = transposition.SharedTranspositionTable(hash_mb)
+        search.Searcher.__init__(self, debug, movetime, hash_mb, table=table)
+
+        self.stop_event = multiprocessing.Event()
+        self.node_counts = multiprocessing.RawArray(ctypes.c_uint64, self.threads)
+
+        # Nodes searched by the helpers in the last search.
+        self.helper_nodes = 0
+
+        # The helpers forget their killer moves and history in the next search.
+        self._new_game = False
+
+        self.pool = None
+        if self.threads > 1:
+            self.pool = multiprocessing.Pool(self.threads - 1, _init_helper,
+                                             (hash_mb, table.shared, self.stop_event, self.node_counts))
+
+    def new_game(self):
+        search.Searcher.new_game(self)
+        self._new_game = True
+
+    def _iterate(self, board, limits):
+        """
+        Starts a search of the main searcher and the helpers. The stop event
+        is cleared here and not in the generator, so that a stop before the
+        first depth is searched is not lost.
+        """
+
+        self.stop_event.clear()
+
+        # The age of the table before the main searcher increments it.
+        age = self.tt.age
+        infos = search.Searcher._iterate(self, board, limits)
+        return self._deepen_with_helpers(board, limits, age, infos)
+
+    def _deepen_with_helpers(self, board, limits, age, infos):
+        """
+        Iterative deepening of the main searcher, with the helpers searching
+        the same position. The nodes and the speed in the info are of
+        all the searchers.
+        """
+
+        start = time.perf_counter()
+        results = self._start_helpers(board, limits, age)
+
+        try:
+            for info in infos:
+                nodes = info["nodes"] + sum(self.node_counts[1:])
+                elapsed = time.perf_counter() - start
+                info["nodes"] = nodes
+                info["nps"] = int(nodes / elapsed) if elapsed else 0
+                yield info
+        finally:
+            self._stop_helpers(results)
+
+    def _start_helpers(self, board, limits, age):
+
+        if not self.pool:
+            return []
+
+        for index in range(self.threads):
+            self.node_counts[index] = 0
+
+        # Only the main searcher keeps the time and the node limits.
+        helper_limits = {"depth": limits["depth"]} if "depth" in limits else {}
+
+        fen = board.to_fen()
+        results = [self.pool.apply_async(_helper_search, (index, fen, helper_limits, age, self._new_game))
+                   for index in range(1, self.threads)]
+        self._new_game = False
+        return results
+
+    def _stop_helpers(self, results):
+
+        self.stop_event.set()
+        self.helper_nodes = sum(result.get() for result in results)
+
+    def stop_infinite_search(self):
+        self.stopped = True
+        self.stop_event.set()
+
+    def stop_process(self):
+
+        self.stop_infinite_search()
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,168 @@
+"""
+The perft runner, counting the nodes of the legal move tree of well known
+positions and comparing them with their published node counts.
+Run as a script, for example:
+
+    python perft.py --depth 3 --backend bitboard --generator direct
+
+The self-test runs every backend and generator, checking the node counts
+and the Zobrist keys, and exits with an error if any of them fails:
+
+    python perft.py --self-test
+"""
+
+import argparse
+import time
+
+import bitboard
+import internals
+
+# (name, fen, node counts starting from depth 1)
+POSITIONS = [
+    ("startpos", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("promotions-mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333]),
+    ("discovered-checks", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+BACKENDS = {
+    "grid": internals.Board,
+    "bitboard": bitboard.BitBoard
+}
+
+# (backend, generator) pairs of the self-test.
+SELF_TEST_BOARDS = [("grid", "trial"), ("bitboard", "trial"), ("bitboard", "direct")]
+
+
+def verify_hash(board, depth):
+    """
+    Walks the legal move tree like perft, checking that the incrementally
+    updated Zobrist key equals a recomputation from scratch at every node,
+    and that unmake_move restores it. Returns the number of leaf nodes.
+    """
+
+    # Not asserts, the checks must also run with python -O.
+    if board.zobrist_key != board.compute_zobrist():
+        raise AssertionError("Zobrist key mismatch in " + board.to_fen())
+
+    if depth == 0:
+        return 1
+
+    nodes = 0
+    for from_tile, to_tile, promote in board.get_legal_move_list(board.turn):
+        key = board.zobrist_key
+        record = board.make_move(from_tile, to_tile, promote)
+        nodes += verify_hash(board, depth - 1)
+        board.unmake_move(record)
+        if board.zobrist_key != key:
+            raise AssertionError("Zobrist key not restored by unmake_move in " + board.to_fen())
+
+    return nodes
+
+
+def run(positions, depth, board_class, divide=False, check_hash=False, generator=None):
+    """
+    Runs perft on the positions, prints the node counts and speed.
+    The legal move generator of the boards is changed if one is given.
+    Returns the names of the positions with wrong node counts.
+    """
+
+    failed = []
+    total_nodes = 0
+    total_time = 0
+
+    for name, fen, expected in positions:
+        board = board_class.from_fen(fen)
+        if generator:
+            board.legal_generator = generator
+        position_depth = min(depth, len(expected))
+
+        start = time.perf_counter()
+        if check_hash:
+            nodes = verify_hash(board, position_depth)
+        elif divide:
+            counts = board.divide(position_depth)
+            nodes = sum(counts.values())
+        else:
+            nodes = board.perft(position_depth)
+        elapsed = time.perf_counter() - start
+
+        total_nodes += nodes
+        total_time += elapsed
+
+        status = "ok" if nodes == expected[position_depth - 1] else "FAIL (expected {0})".format(expected[position_depth - 1])
+        if nodes != expected[position_depth - 1]:
+            failed.append(name)
+
+        print("{0:22} depth {1}  {2:>10} nodes  {3:8.2f} s  {4:>8.0f} nps  {5}".format(
+            name, position_depth, nodes, elapsed, nodes / elapsed, status))
+
+        if divide:
+            for move in sorted(counts):
+                print("    {0}: {1}".format(move, counts[move]))
+
+    print("total {0} nodes in {1:.2f} s, {2:.0f} nps".format(total_nodes, total_time, total_nodes / total_time))
+
+    return failed
+
+
+def self_test(depth=2):
+    """
+    Runs perft with the Zobrist key checks on all the positions, with every
+    backend and generator. Returns the failures as "backend/generator: name"
+    for wrong node counts and "backend/generator: Zobrist key" for wrong keys.
+    """
+
+    failed = []
+
+    for backend, generator in SELF_TEST_BOARDS:
+        print("{0} backend, {1} generator".format(backend, generator))
+        try:
+            names = run(POSITIONS, depth, BACKENDS[backend], check_hash=True, generator=generator)
+        except AssertionError as error:
+            print(error)
+            names = ["Zobrist key"]
+        failed.extend("{0}/{1}: {2}".format(backend, generator, name) for name in names)
+
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perft node counts of the move generator.")
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--self-test", action="store_true",
+                        help="Check the node counts and the Zobrist keys with every backend and generator.")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="grid")
+    parser.add_argument("--generator", choices=("trial", "direct"),
+                        help="Legal move generator, direct is only in the bitboard backend.")
+    parser.add_argument("--position", choices=[name for name, _, _ in POSITIONS],
+                        help="Run a single position instead of all of them.")
+    parser.add_argument("--divide", action="store_true", help="Print the node counts of each root move.")
+    parser.add_argument("--verify-hash", action="store_true",
+                        help="Check the incremental Zobrist key against a recomputation at every node.")
+    args = parser.parse_args()
+
+    if args.generator == "direct" and args.backend != "bitboard":
+        parser.error("the direct generator needs the bitboard backend")
+
+    if args.self_test:
+        failed = self_test(args.depth)
+        if failed:
+            raise SystemExit("Self-test failed: " + ", ".join(failed))
+        raise SystemExit()
+
+    selected = [position for position in POSITIONS if args.position in (None, position[0])]
+    failed = run(selected, args.depth, BACKENDS[args.backend], args.divide, args.verify_hash, args.generator)
+
+    if failed:
+        raise SystemExit("Wrong node counts: " + ", ".join(failed))
@@ -0,0 +1,374 @@
+"""
+The module with the streaming PGN reader.
+
+Games are read one at a time, so files of any size are replayed without
+loading them into memory. Files ending in .gz, .bz2 or .xz are decompressed
+while reading. Run as a script to replay every game of a file and report
+the speed, for example:
+
+    python pgn.py games.pgn.gz --backend bitboard
+"""
+
+import argparse
+import bz2
+import gzip
+import lzma
+import re
+import sys
+import time
+
+import bitboard
+import internals
+from internals import Board, COLOR_CODES, KIND_CODES, KING, PAWN
+
+# Opening functions of the compressed files, by extension.
+OPENERS = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+    ".lzma": lzma.open
+}
+
+SAN_PIECES = {"K": "king", "Q": "queen", "R": "rook", "B": "bishop", "N": "knight"}
+
+HEADER = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+
+# Comments, variations and annotations are skipped, move numbers too.
+# A comment may contain anything, so it is matched first.
+MOVETEXT_TOKEN = re.compile(r"""
+    (?P<comment>\{[^}]*\}?|;[^\n]*)
+    |(?P<open>\()
+    |(?P<close>\))
+    |(?P<result>1-0|0-1|1/2-1/2|\*)
+    |(?P<number>\d+\.+)
+    |(?P<nag>\$\d+)
+    |(?P<move>[^\s(){};$]+)
+    """, re.VERBOSE)
+
+SAN_MOVE = re.compile(r"^([KQRBN])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBN]))?$")
+
+
+def open_pgn(path):
+    """
+    Opens a PGN file as text, decompressing it by its extension.
+    Undecodable bytes are replaced, the game they are in is most
+    likely skipped later as malformed.
+    """
+
+    for extension, opener in OPENERS.items():
+        if path.endswith(extension):
+            return opener(path, "rt", encoding="utf-8", errors="replace")
+
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def parse_san(board, san):
+    """
+    Returns the (from_tile, to_tile, promote) move of a SAN move
+    in the position of the board, raises ValueError if the move
+    is not legal or ambiguous.
+    """
+
+    color = COLOR_CODES[board.turn]
+    text = san.rstrip("+#!?")
+
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        row = 0 if color else 7
+        from_tile = (row, 4)
+        to_tile = (row, 6) if len(text) == 3 else (row, 2)
+
+        king = board.grid[row][4]
+        if not king or king.kind_code != KING or king.color_code != color:
+            raise ValueError("Illegal move " + san)
+        candidates = [from_tile]
+        promote = None
+    else:
+        match = SAN_MOVE.match(text)
+        if not match:
+            raise ValueError("Invalid SAN move " + san)
+
+        letter, from_file, from_rank, square, promotion = match.groups()
+        kind = KIND_CODES[SAN_PIECES[letter]] if letter else PAWN
+        to_tile = Board.square_to_pos(square)
+        promote = SAN_PIECES[promotion] if promotion else None
+
+        if kind == PAWN and to_tile[0] in (0, 7) and not promote:
+            raise ValueError("Promotion piece missing in " + san)
+
+        # Pieces of the kind on the given file and rank, the moves
+        # are checked only for them.
+        rows = [8 - int(from_rank)] if from_rank else range(8)
+        if from_file:
+            cols = [ord(from_file) - 97]
+        elif kind == PAWN:
+            cols = [to_tile[1]]  # Captures always name the file
+        else:
+            cols = range(8)
+
+        candidates = []
+        for row in rows:
+            for col in cols:
+                piece = board.grid[row][col]
+                if piece and piece.kind_code == kind and piece.color_code == color:
+                    candidates.append((row, col))
+
+    moves = [from_tile for from_tile in candidates
+             if to_tile in board.get_moves(from_tile) and board.assume_move([from_tile, to_tile], board.turn)]
+
+    if len(moves) != 1:
+        raise ValueError("{0} move {1}".format("Ambiguous" if moves else "Illegal", san))
+
+    return moves[0], to_tile, promote
+
+
+class PGNGame(object):
+    """
+    A game read from a PGN file, its headers and its mainline moves in SAN.
+    The moves are checked only when the game is replayed.
+    """
+
+    def __init__(self, headers, moves, result, line_number):
+
+        # {"White": "...", "Event": "...", ...}
+        self.headers = headers
+
+        self.moves = moves
+
+        # The game termination marker of the movetext,
+        # or the Result header if there is none.
+        self.result = result
+
+        # Line of the file the game starts in, for error messages.
+        self.line_number = line_number
+
+    def start_board(self, board_class=Board):
+        """
+        Returns the board of the starting position of the game,
+        given by the FEN header if there is one.
+        """
+
+        return board_class.from_fen(self.headers["FEN"]) if "FEN" in self.headers else board_class()
+
+    def replay(self, board_class=Board):
+        """
+        Replays the game, yields (board, move) before every move is made,
+        the move is a (from_tile, to_tile, promote) tuple. The board is
+        changed when the generator continues, copy it to keep a position.
+        Raises ValueError at the first illegal move.
+        """
+
+        board = self.start_board(board_class)
+
+        for san in self.moves:
+            move = parse_san(board, san)
+            yield board, move
+            board.make_move(*move)
+
+    def uci_moves(self, board_class=Board):
+        """
+        Returns the moves of the game in UCI notation.
+        """
+
+        return [Board.move_to_uci(*move) for board, move in self.replay(board_class)]
+
+    def play(self, game):
+        """
+        Plays the moves of the game on a Game, which must be
+        in the starting position of the game.
+        """
+
+        for board, move in self.replay():
+            game.move(*move)
+
+
+def _scan_movetext(line, in_comment):
+    """
+    Scans a movetext line of split_games. Returns (in_comment, ended),
+    if a comment continues on the next line and if the line ends with
+    the result of the game. Comments after the result do not matter.
+    """
+
+    if in_comment:
+        end = line.find("}")
+        if end < 0:
+            return True, False
+        line = line[end + 1:]
+
+    ended = False
+    for match in MOVETEXT_TOKEN.finditer(line):
+        token = match.group()
+        if token.startswith("{") and not token.endswith("}"):
+            return True, False
+        if match.lastgroup != "comment":
+            ended = match.lastgroup == "result"
+
+    return False, ended
+
+
+def split_games(stream):
+    """
+    Yields (line_number, header_lines, movetext) of every game of a stream,
+    without parsing them. A game ends at its result, where the headers of
+    the next one start, or at the end of the stream. The movetext keeps
+    its line breaks, they end the ";" comments.
+    """
+
+    start = 1
+    headers = []
+    movetext = []
+    in_comment = False
+
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+
+        # Escaped lines are for other programs.
+        if not line or line.startswith("%"):
+            continue
+
+        if line.startswith("["):
+            if movetext:
+                yield start, headers, "\n".join(movetext)
+                headers = []
+                movetext = []
+            if not headers:
+                start = line_number
+            headers.append(line)
+        else:
+            if not headers and not movetext:
+                start = line_number
+            movetext.append(line)
+
+            # The next game may have no headers, the result ends this one.
+            in_comment, ended = _scan_movetext(line, in_comment)
+            if ended:
+                yield start, headers, "\n".join(movetext)
+                headers = []
+                movetext = []
+
+    if headers or movetext:
+        yield start, headers, "\n".join(movetext)
+
+
+def parse_game(line_number, header_lines, movetext):
+    """
+    Parses a game split by split_games into a PGNGame,
+    raises ValueError if it is malformed.
+    """
+
+    headers = {}
+    for line in header_lines:
+        match = HEADER.match(line)
+        if not match:
+            raise ValueError("Invalid header line {0}: {1}".format(line_number, line))
+        headers[match.group(1)] = match.group(2).replace('\\"', '"')
+
+    moves = []
+    result = None
+    variation_depth = 0
+
+    for token in MOVETEXT_TOKEN.finditer(movetext):
+        kind = token.lastgroup
+
+        if kind == "open":
+            variation_depth += 1
+        elif kind == "close":
+            variation_depth -= 1
+            if variation_depth < 0:
+                raise ValueError("Unbalanced variation in the game at line {0}".format(line_number))
+        elif variation_depth:
+            continue
+        elif kind == "result":
+            result = token.group()
+        elif kind == "move":
+            moves.append(token.group())
+
+    if variation_depth:
+        raise ValueError("Unbalanced variation in the game at line {0}".format(line_number))
+
+    if not moves and not headers:
+        raise ValueError("Empty game at line {0}".format(line_number))
+
+    return PGNGame(headers, moves, result or headers.get("Result", "*"), line_number)
+
+
+class PGNReader(object):
+    """
+    Iterates the games of a PGN stream. Games that can not be parsed
+    are skipped and counted, the stream goes on.
+    """
+
+    def __init__(self, stream):
+
+        self.stream = stream
+
+        self.games = 0
+        self.skipped = 0
+
+    def __iter__(self):
+
+        for line_number, header_lines, movetext in split_games(self.stream):
+            try:
+                game = parse_game(line_number, header_lines, movetext)
+            except ValueError:
+                self.skipped += 1
+                continue
+
+            self.games += 1
+            yield game
+
+
+def read_games(path):
+    """
+    Yields the games of a PGN file, compressed or not.
+    """
+
+    with open_pgn(path) as stream:
+        yield from PGNReader(stream)
+
+
+def replay_file(path, board_class=Board, limit=None):
+    """
+    Replays the games of a file, games with illegal moves are skipped.
+    Prints the number of games and moves replayed per second.
+    """
+
+    games = moves = illegal = 0
+    start = time.perf_counter()
+
+    with open_pgn(path) as stream:
+        reader = PGNReader(stream)
+
+        for game in reader:
+            if limit is not None and games >= limit:
+                break
+
+            try:
+                played = sum(1 for _ in game.replay(board_class))
+            except ValueError as error:
+                print("Skipped the game at line {0}: {1}".format(game.line_number, error), file=sys.stderr)
+                illegal += 1
+                continue
+
+            games += 1
+            moves += played
+
+            if games % 1000 == 0:
+                elapsed = time.perf_counter() - start
+                print("{0} games, {1:.1f} games/s, {2:.0f} moves/s".format(
+                    games, games / elapsed, moves / elapsed), file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print("Replayed {0} games, {1} moves in {2:.1f} s".format(games, moves, elapsed))
+    print("{0:.1f} games/s, {1:.0f} moves/s".format(games / elapsed, moves / elapsed))
+    print("Skipped {0} unparsable games and {1} games with illegal moves".format(reader.skipped, illegal))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays the games of a PGN file.")
+    parser.add_argument("pgn", help="PGN file, may be compressed with gzip, bzip2 or xz.")
+    parser.add_argument("--backend", choices=("grid", "bitboard"), default="bitboard")
+    parser.add_argument("--limit", type=int, help="Number of games to replay.")
+    args = parser.parse_args()
+
+    board_class = bitboard.BitBoard if args.backend == "bitboard" else internals.Board
+    replay_file(args.pgn, board_class, args.limit)
@@ -0,0 +1,120 @@
+"""
+The module with the array of packed positions.
+
+Positions are kept as the 32-byte records of Board.pack, one after another,
+in a bytearray or in a memory-mapped file. A file of positions has no header,
+so it can also be written by appending the packed positions to it:
+
+    with open("positions.bin", "ab") as output:
+        output.write(board.pack())
+"""
+
+import mmap
+
+from internals import Board, PACKED_POSITION
+
+RECORD_SIZE = PACKED_POSITION.size
+
+
+class PositionArray(object):
+    """
+    Random access array of packed positions. Items are the packed bytes,
+    use board(index) to get a board of a position.
+    """
+
+    def __init__(self, data=None):
+
+        # A bytearray, or an mmap for the arrays of open().
+        self.data = bytearray() if data is None else data
+
+        if len(self.data) % RECORD_SIZE:
+            raise ValueError("The data is not a whole number of packed positions")
+
+        self._file = None
+
+    @classmethod
+    def open(cls, path, writable=False):
+        """
+        Maps a file of packed positions to memory. Only the pages of the
+        accessed positions are read, the file may be larger than the memory.
+        A writable array changes the file when items are set.
+        """
+
+        position_file = open(path, "r+b" if writable else "rb")
+        try:
+            data = mmap.mmap(position_file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file can not be mapped.
+            data = bytearray()
+
+        array = cls(data)
+        array._file = position_file
+        return array
+
+    def __len__(self):
+        return len(self.data) // RECORD_SIZE
+
+    def __getitem__(self, index):
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Position index out of range")
+
+        return bytes(self.data[index * RECORD_SIZE:(index + 1) * RECORD_SIZE])
+
+    def __setitem__(self, index, packed):
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Position index out of range")
+        if len(packed) != RECORD_SIZE:
+            raise ValueError("A packed position is {0} bytes".format(RECORD_SIZE))
+
+        self.data[index * RECORD_SIZE:(index + 1) * RECORD_SIZE] = packed
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, board):
+        """
+        Appends a board, or a position already packed. Memory-mapped arrays
+        have a fixed size, append to their file instead.
+        """
+
+        if not isinstance(self.data, bytearray):
+            raise TypeError("Can not append to a memory-mapped position array")
+
+        packed = board if isinstance(board, (bytes, bytearray)) else board.pack()
+        if len(packed) != RECORD_SIZE:
+            raise ValueError("A packed position is {0} bytes".format(RECORD_SIZE))
+
+        self.data += packed
+
+    def extend(self, boards):
+        for board in boards:
+            self.append(board)
+
+    def board(self, index, board_class=Board):
+        """
+        Returns a board of the position at the index.
+        """
+
+        return board_class.unpack(self[index])
+
+    def fen(self, index):
+        return Board.packed_to_fen(self[index])
+
+    def save(self, path):
+        with open(path, "wb") as position_file:
+            position_file.write(self.data)
+
+    def close(self):
+
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,375 @@
+"""
+The module with the in-process chess engine. It searches the bitboard
+backend of the board with iterative deepening alpha-beta, and has the
+same methods as engine.Engine, so a Game can use either of them.
+"""
+
+import time
+
+from bitboard import BitBoard
+from evaluation import evaluate
+from internals import Board
+import ordering
+from ordering import capture_value, generate_captures
+import transposition
+
+# Scores above MATE - MAX_PLY are mates, the distance to the mate
+# is subtracted so that shorter mates score higher.
+MATE = 100000
+MAX_PLY = 128
+
+# Nodes searched between the checks of the time and node limits.
+CHECK_INTERVAL = 1024
+
+
+class SearchAborted(Exception):
+    """
+    Raised inside the search when it is stopped or runs out of budget.
+    """
+
+
+def score_to_table(score, ply):
+    """
+    Mate scores are stored in the transposition table as the distance
+    from the stored position, not from the root.
+    """
+
+    if score > MATE - MAX_PLY:
+        return score + ply
+    if score < -MATE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+
+    if score > MATE - MAX_PLY:
+        return score - ply
+    if score < -MATE + MAX_PLY:
+        return score + ply
+    return score
+
+
+def score_to_info(score):
+    """
+    Converts a search score to the score dictionary of UCI info lines.
+    """
+
+    if abs(score) > MATE - MAX_PLY:
+        plies = MATE - abs(score)
+        moves = (plies + 1) // 2
+        return {"mate": moves if score > 0 else -moves}
+    return {"cp": score}
+
+
+class Searcher(object):
+    """
+    The in-process engine. Iterative deepening negamax with alpha-beta
+    pruning and quiescence search, limited by depth, time or nodes.
+    """
+
+    def __init__(self, debug=0, movetime=3000, hash_mb=16, move_ordering=True, table=None):
+
+        self.debug = debug
+
+        # Results of the searched positions, kept between searches.
+        # A table shared with other searchers may be given.
+        self.tt = table if table is not None else transposition.TranspositionTable(hash_mb)
+
+        # Milliseconds to think when get_best_move is given no limits.
+        self.default_movetime = movetime
+
+        self.board = BitBoard(debug)
+
+        self.stopped = False
+        self.nodes = 0
+        self.deadline = None
+        self.max_nodes = None
+
+        # The principal variation of the last completed iteration,
+        # searched first in the next one.
+        self.pv = []
+
+        # Killer moves and history scores, see the ordering module.
+        # Without move ordering the moves are searched in the order
+        # they are generated, for comparing the node counts.
+        self.move_ordering = move_ordering
+        self.orderer = ordering.MoveOrderer(MAX_PLY)
+
+    def new_game(self):
+        self.board = BitBoard(self.debug)
+        self.tt.clear()
+        self.orderer.clear()
+
+    def set_position(self, moves, fen=None):
+        """
+        Replays the moves, in UCI notation, from the start position or
+        the FEN position if one is given. A new board is built so that
+        a running search is not disturbed.
+        """
+
+        board = BitBoard(self.debug, fen)
+        for move in moves:
+            board.make_move(*Board.uci_to_move(move))
+
+        self.board = board
+
+    def get_best_move(self, depth=""):
+        """
+        Searches the current position and returns the best move in UCI notation.
+        The argument is the same as the arguments of the UCI go command, e.g.
+        "depth 6", "movetime 1000" or "nodes 50000".
+        """
+
+        limits = self._parse_go(str(depth))
+        if not limits:
+            limits["movetime"] = self.default_movetime
+
+        board = self.board
+        best_move = None
+        for info in self._iterate(board, limits):
+            best_move = info["pv"][0]
+
+        if best_move is None:
+            # Stopped before the first iteration completed.
+            moves = board.get_legal_move_list(board.turn)
+            best_move = Board.move_to_uci(*moves[0]) if moves else None
+
+        return best_move
+
+    def analyse(self, limit=""):
+        """
+        Same as get_best_move, but returns the info of the last completed
+        depth, with the best move added as "bestmove".
+        """
+
+        limits = self._parse_go(str(limit))
+        if not limits:
+            limits["movetime"] = self.default_movetime
+
+        result = {}
+        for info in self._iterate(self.board, limits):
+            result = info
+
+        result["bestmove"] = result["pv"][0] if result else self.get_best_move("depth 1")
+        return result
+
+    def start_infinite_search(self):
+        """
+        Searches the current position until stop_infinite_search is called,
+        yielding an info dictionary after every completed depth.
+        """
+
+        return self._iterate(self.board, {})
+
+    def stop_infinite_search(self):
+        self.stopped = True
+
+    def stop_process(self):
+        # There is no process, only a search to stop.
+        self.stopped = True
+
+    def _parse_go(self, string):
+        """
+        Parses the arguments of a UCI go command into a dictionary of limits.
+        """
+
+        limits = {}
+        words = string.split()
+
+        for ind, word in enumerate(words):
+            if word in ("depth", "movetime", "nodes") and ind + 1 < len(words):
+                limits[word] = int(words[ind + 1])
+
+        return limits
+
+    def _iterate(self, board, limits):
+        """
+        Starts a search, returns the generator of the iterative deepening.
+        The search is reset here and not in the generator, so that a stop
+        before the first depth is searched is not lost.
+        """
+
+        self.stopped = False
+        self.nodes = 0
+        self.pv = []
+
+        start = time.perf_counter()
+        self.deadline = start + limits["movetime"] / 1000 if "movetime" in limits else None
+        self.max_nodes = limits.get("nodes")
+        self.tt.new_search()
+        self.orderer.new_search()
+
+        return self._deepen(board, limits, start)
+
+    def _deepen(self, board, limits, start):
+        """
+        Iterative deepening, yields the info of every completed depth.
+        """
+
+        for depth in self._depths(limits):
+            # The limits are only checked every CHECK_INTERVAL nodes.
+            if self.stopped:
+                break
+
+            try:
+                score, pv = self._negamax(board, depth, -MATE, MATE, 0)
+            except SearchAborted:
+                break
+
+            if not pv:
+                # No legal moves, the game is over.
+                break
+
+            self.pv = pv
+            elapsed = time.perf_counter() - start
+
+            yield {
+                "depth": depth,
+                "score": score_to_info(score),
+                "nodes": self.nodes,
+                "time": int(elapsed * 1000),
+                "nps": int(self.nodes / elapsed) if elapsed else 0,
+                "hashfull": int(1000 * self.tt.fill_ratio()),
+                "pv": [Board.move_to_uci(*move) for move in pv]
+            }
+
+            # No need to look deeper after a forced mate is found.
+            if abs(score) > MATE - MAX_PLY:
+                break
+
+    def _depths(self, limits):
+        """
+        The depths of the iterations of the search.
+        """
+
+        return range(1, min(limits.get("depth", MAX_PLY), MAX_PLY) + 1)
+
+    def _check_limits(self):
+        if self.stopped:
+            raise SearchAborted()
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchAborted()
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            raise SearchAborted()
+
+    def _ordered_moves(self, board, ply, hash_move):
+        """
+        Yields the moves of the position in the order to search them,
+        the principal variation move is searched first with the hash move.
+        """
+
+        if not self.move_ordering:
+            return iter(board.get_legal_move_list(board.turn))
+
+        pv_move = self.pv[ply] if ply < len(self.pv) else None
+        return self.orderer.moves(board, ply, (hash_move, pv_move))
+
+    def _negamax(self, board, depth, alpha, beta, ply):
+        """
+        Alpha-beta search, returns (score, principal_variation).
+        """
+
+        self.nodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            self._check_limits()
+
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiescence(board, alpha, beta), []
+
+        key = board.zobrist_key
+        hash_move = None
+
+        entry = self.tt.probe(key)
+        if entry:
+            entry_depth, bound, score, hash_move = entry
+            score = score_from_table(score, ply)
+
+            # The root always searches, to have a principal variation.
+            if ply > 0 and entry_depth >= depth:
+                if bound == transposition.EXACT or \
+                        (bound == transposition.LOWER and score >= beta) or \
+                        (bound == transposition.UPPER and score <= alpha):
+                    return score, [hash_move] if hash_move else []
+
+        original_alpha = alpha
+        best_score = -MATE
+        best_pv = []
+
+        for move in self._ordered_moves(board, ply, hash_move):
+            record = board.make_move(*move)
+            try:
+                score, pv = self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                board.unmake_move(record)
+            score = -score
+
+            # The first move is kept even if all of them fail low,
+            # the root must always have one to play.
+            if score > best_score or not best_pv:
+                best_score = score
+                best_pv = [move] + pv
+
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    if self.move_ordering:
+                        self.orderer.cutoff(board, move, depth, ply)
+                    break
+
+        if not best_pv:
+            if board.king_under_attack(board.turn):
+                return -MATE + ply, []  # Checkmated
+            return 0, []  # Stalemate
+
+        if best_score >= beta:
+            bound = transposition.LOWER
+        elif best_score > original_alpha:
+            bound = transposition.EXACT
+        else:
+            bound = transposition.UPPER
+
+        self.tt.store(key, depth, bound, score_to_table(best_score, ply), best_pv[0])
+
+        return best_score, best_pv
+
+    def _quiescence(self, board, alpha, beta):
+        """
+        Searches only the captures and promotions, until the position is quiet,
+        so that the evaluation is not done in the middle of an exchange.
+        """
+
+        self.nodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            self._check_limits()
+
+        # The player to move can choose not to capture.
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return beta
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        captures = generate_captures(board)
+        if self.move_ordering:
+            captures.sort(key=lambda move: capture_value(board, move), reverse=True)
+
+        for move in captures:
+            record = board.make_move(*move)
+            try:
+                score = -self._quiescence(board, -beta, -alpha)
+            finally:
+                board.unmake_move(record)
+
+            if score >= beta:
+                return beta
+            if score > alpha:
+                alpha = score
+
+        return alpha
+
+
+if __name__ == "__main__":
+    searcher = Searcher()
+    for info in searcher._iterate(searcher.board, {"movetime": 5000}):
+        print(info)
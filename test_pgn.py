@@ -0,0 +1,47 @@
+"""
+Tests of the PGN splitting and parsing. Run with:
+
+    python -m unittest test_pgn
+"""
+
+import io
+import unittest
+
+import pgn
+
+
+def parse_all(text):
+    return [pgn.parse_game(*game) for game in pgn.split_games(io.StringIO(text))]
+
+
+class SplitGamesTest(unittest.TestCase):
+
+    def test_rest_of_line_comment(self):
+        games = parse_all("1. e4 ; a comment\ne5 2. Nf3 Nc6 1-0\n")
+
+        self.assertEqual(len(games), 1)
+        self.assertEqual(games[0].moves, ["e4", "e5", "Nf3", "Nc6"])
+        self.assertEqual(games[0].result, "1-0")
+
+    def test_comment_after_result(self):
+        games = parse_all("1. e4 e5 1-0 ; decisive\n1. d4 d5 0-1\n")
+
+        self.assertEqual([game.moves for game in games], [["e4", "e5"], ["d4", "d5"]])
+        self.assertEqual([game.result for game in games], ["1-0", "0-1"])
+
+    def test_result_in_comment(self):
+        games = parse_all('[Event "a"]\n\n1. e4 { not\nover 1-0 yet } e5\n; 0-1 neither\n2. Nf3 *\n')
+
+        self.assertEqual(len(games), 1)
+        self.assertEqual(games[0].moves, ["e4", "e5", "Nf3"])
+        self.assertEqual(games[0].result, "*")
+
+    def test_headerless_game_after_game(self):
+        games = parse_all('[Event "a"]\n[Result "1-0"]\n\n1. e4 e5 1-0\n\n1. c4 c5 1/2-1/2\n')
+
+        self.assertEqual([game.moves for game in games], [["e4", "e5"], ["c4", "c5"]])
+        self.assertEqual(games[1].headers, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,223 @@
+"""
+The module with the transposition table of the search.
+
+The table is a preallocated array of 64-bit integers. Every bucket has two
+entries of two integers each, the Zobrist key and the packed data. The key
+is stored XORed with the data, so that an entry written half by one process
+and half by another does not match the key and is ignored. Processes can
+share a table this way without locks (SharedTranspositionTable).
+
+The packed data:
+
+    bits  0-14  best move (from square, to square, promotion)
+    bits 15-35  score, offset to be unsigned
+    bits 36-43  depth
+    bits 44-45  bound type
+    bits 46-53  age, the search the entry is stored in
+
+The first entry of a bucket is depth-preferred, it is only replaced by
+an equal or deeper search of the same age. The second is always replaced.
+"""
+
+import ctypes
+import multiprocessing
+from array import array
+
+# Bound types, zero marks an empty entry.
+EXACT = 1
+LOWER = 2  # The score is at least this (beta cutoff)
+UPPER = 3  # The score is at most this (failed low)
+
+SCORE_OFFSET = 1 << 20
+
+# Two entries of two 8-byte integers in a bucket.
+BUCKET_SIZE = 32
+
+PROMOTIONS = (None, "queen", "rook", "bishop", "knight")
+
+
+def encode_move(move):
+    """
+    Packs a (from_tile, to_tile, promote) move into 15 bits.
+    """
+
+    if move is None:
+        return 0
+
+    (fr, fc), (tr, tc), promote = move
+    return (fr * 8 + fc) | ((tr * 8 + tc) << 6) | (PROMOTIONS.index(promote) << 12)
+
+
+def decode_move(code):
+    """
+    Unpacks a move packed by encode_move, returns None for no move.
+    """
+
+    if not code:
+        return None
+
+    return divmod(code & 63, 8), divmod((code >> 6) & 63, 8), PROMOTIONS[code >> 12]
+
+
+def bucket_count(size_mb):
+    """
+    The number of buckets of a table of at most size_mb megabytes. It is
+    a power of two, so that the bucket of a key is found with a mask.
+    """
+
+    buckets = 1
+    while buckets * 2 * BUCKET_SIZE <= size_mb * 1024 * 1024:
+        buckets *= 2
+    return buckets
+
+
+class TranspositionTable(object):
+    """
+    Fixed size hash table of search results, keyed by the Zobrist key of the position.
+    """
+
+    def __init__(self, size_mb=16):
+
+        buckets = bucket_count(size_mb)
+
+        self.mask = buckets - 1
+        self.entries = 2 * buckets
+        self.table = self._allocate(buckets * BUCKET_SIZE // 8)
+
+        self.age = 0
+
+        # Statistics, see stats()
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0
+        self.stores = 0
+        self.replacements = 0
+        self.used = 0
+
+    def _allocate(self, length):
+        return array("Q", bytes(8 * length))
+
+    def new_search(self):
+        """
+        Marks the start of a new search, entries of older searches
+        are replaced before the deeper ones of the current search.
+        """
+
+        self.age = (self.age + 1) & 255
+
+    def clear(self):
+
+        self.table = self._allocate(len(self.table))
+        self.age = 0
+        self.used = 0
+
+    def probe(self, key):
+        """
+        Returns (depth, bound, score, move) stored for the key, or None.
+        """
+
+        self.probes += 1
+        table = self.table
+        index = (key & self.mask) * 4
+
+        for slot in (index, index + 2):
+            data = table[slot + 1]
+            if data and table[slot] ^ data == key:
+                self.hits += 1
+                return ((data >> 36) & 255,
+                        (data >> 44) & 3,
+                        ((data >> 15) & 0x1FFFFF) - SCORE_OFFSET,
+                        decode_move(data & 0x7FFF))
+
+        # Another position is stored where this one would be.
+        if table[index + 1] or table[index + 3]:
+            self.collisions += 1
+
+        return None
+
+    def store(self, key, depth, bound, score, move):
+
+        self.stores += 1
+        table = self.table
+        index = (key & self.mask) * 4
+
+        data = (encode_move(move) | ((score + SCORE_OFFSET) << 15) |
+                (min(depth, 255) << 36) | (bound << 44) | (self.age << 46))
+
+        old = table[index + 1]
+
+        # Depth-preferred entry, taken if it is empty, holds the same position,
+        # is from an older search or is not deeper than this one.
+        if not old or table[index] ^ old == key or (old >> 46) & 255 != self.age or (old >> 36) & 255 <= depth:
+            slot = index
+        else:
+            slot = index + 2
+            old = table[slot + 1]
+
+        if not old:
+            self.used += 1
+        elif table[slot] ^ old != key:
+            self.replacements += 1
+
+        table[slot] = key ^ data
+        table[slot + 1] = data
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def fill_ratio(self):
+        return self.used / self.entries
+
+    def stats(self):
+        """
+        Returns the usage statistics, to size the table for the hardware.
+        """
+
+        return {
+            "size_mb": len(self.table) * 8 / (1024 * 1024),
+            "entries": self.entries,
+            "probes": self.probes,
+            "hits": self.hits,
+            "hit_rate": self.hit_rate(),
+            "collisions": self.collisions,
+            "stores": self.stores,
+            "replacements": self.replacements,
+            "fill_ratio": self.fill_ratio()
+        }
+
+
+class SharedTranspositionTable(TranspositionTable):
+    """
+    Transposition table in shared memory, for the search processes of a
+    parallel search. Create it in the parent process and give its shared
+    array to the others, which make their own tables over it:
+
+        table = SharedTranspositionTable(64)
+        ...
+        table = SharedTranspositionTable(64, shared=parent_table.shared)
+
+    The statistics are of the process, the fill ratio counts only
+    the entries the process stored.
+    """
+
+    def __init__(self, size_mb=16, shared=None):
+
+        self.shared = shared
+        TranspositionTable.__init__(self, size_mb)
+
+    def _allocate(self, length):
+
+        if self.shared is None:
+            self.shared = multiprocessing.RawArray(ctypes.c_uint64, length)
+        elif len(self.shared) != length:
+            raise ValueError("The shared table is not of the given size")
+
+        # Indexing a memoryview is much faster than indexing a ctypes array.
+        return memoryview(self.shared).cast("B").cast("Q")
+
+    def clear(self):
+
+        # The memory stays shared, it is zeroed in place.
+        ctypes.memset(self.shared, 0, ctypes.sizeof(self.shared))
+        self.age = 0
+        self.used = 0